@@ -1,126 +1,375 @@
-import json
+import asyncio
+
+from bson import ObjectId
 from fastapi import APIRouter, UploadFile, File, Form, Request, HTTPException
+from PIL import UnidentifiedImageError
 from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
 
 from app.config import get_settings
 from app.models.schemas import FileType
-from app.services import mongo_service, openai_service, redis_service, file_processor
+from app.services import (
+    extraction_service,
+    file_service,
+    generation_service,
+    metrics,
+    mongo_service,
+    openai_service,
+    redis_service,
+    retrieval_service,
+    sse,
+    summary_service,
+    task_queue,
+    upload_service,
+)
+from app.services.token_counter import count_tokens
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 settings = get_settings()
 
 
+async def _generate_title(conversation_id: str, message: str) -> str:
+    title = await openai_service.generate_title(message)
+    await mongo_service.update_conversation_title(conversation_id, title)
+    return title
+
+
+def _message_usage(meta: dict, text: str, error: bool = False) -> dict:
+    """What producing an answer cost, as stored on the assistant message."""
+    usage = meta.get("usage") or {}
+    cached = meta.get("cached", False)
+    return {
+        "model": (meta.get("route") or {}).get("model"),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        # A stream closed early never gets its usage chunk; estimate what was generated
+        "completion_tokens": usage.get("completion_tokens", 0 if cached else count_tokens(text)),
+        "ttft_ms": meta.get("ttft_ms"),
+        "generation_ms": meta.get("generation_ms"),
+        "cached": cached,
+        "error": error,
+    }
+
+
+async def _encode_image(upload: upload_service.IngestedFile) -> tuple[str, str]:
+    """encode_image for an inline upload, failing with the statuses the other upload paths use."""
+    try:
+        return await extraction_service.encode_image(upload.path, upload.sha256)
+    except UnidentifiedImageError as e:
+        raise HTTPException(415, f"File {upload.filename} does not look like a valid image") from e
+    except Exception as e:  # Corrupt image data, pool timeouts
+        detail = str(e) or type(e).__name__
+        raise HTTPException(422, f"File {upload.filename} could not be processed: {detail}") from e
+
+
+def _use_response_cache(request: Request) -> bool:
+    """Clients opt out of cached answers with `Cache-Control: no-cache` (or no-store)."""
+    cache_control = request.headers.get("cache-control", "").lower()
+    return "no-cache" not in cache_control and "no-store" not in cache_control
+
+
 @router.post("/send")
 async def send_message(
     request: Request,
     message: str = Form(...),
     conversation_id: str | None = Form(None),
     files: list[UploadFile] = File(default=[]),
+    file_ids: list[str] = Form(default=[]),
 ):
-    """Send a message with optional files, returns SSE stream."""
+    """Send a message with optional files, returns SSE stream.
+
+    Files can be sent inline or uploaded beforehand via `POST /api/files` and
+    referenced by `file_ids`; pre-uploaded files cost the send path no file work.
+    """
     # Rate limiting
     client_ip = request.client.host if request.client else "unknown"
     if not await redis_service.check_rate_limit(client_ip):
         raise HTTPException(429, "Rate limit exceeded. Try again in a minute.")
+    if not await redis_service.check_token_budget(client_ip):
+        raise HTTPException(429, "Daily token budget exhausted. Try again tomorrow.")
 
-    # Create or get conversation
+    # Create or get conversation, with the history not yet folded into its rolling summary
     if not conversation_id:
         convo = await mongo_service.create_conversation()
         conversation_id = str(convo["_id"])
+        history = []
     else:
-        convo = await mongo_service.get_conversation(conversation_id)
+        convo, history = await mongo_service.get_conversation_with_history(
+            conversation_id, settings.history_fetch_limit
+        )
         if not convo:
             raise HTTPException(404, "Conversation not found")
 
-    # Process uploaded files
+    # Stream uploads to spool files (validated, sniffed and hashed chunk by chunk)
+    if len(files) + len(file_ids) > settings.max_files_per_message:
+        raise HTTPException(413, f"At most {settings.max_files_per_message} files per message")
+    uploads: list[upload_service.IngestedFile] = []
+    try:
+        for f in files:
+            if not f.filename:
+                continue
+            try:
+                uploads.append(await upload_service.ingest(f))
+            except upload_service.UploadRejected as e:
+                raise HTTPException(e.status_code, e.detail) from e
+
+        # Extract text or encode images for all files in parallel, off the event loop
+        results = await extraction_service.run_all(*(
+            _encode_image(u)
+            if u.file_type == FileType.image
+            else extraction_service.extract(u.path, u.file_type, u.sha256)
+            for u in uploads
+        ))
+
+        image_data = [
+            (u.filename, *result) for u, result in zip(uploads, results) if u.file_type == FileType.image
+        ]
+        extracted_texts = [
+            None if u.file_type == FileType.image else result for u, result in zip(uploads, results)
+        ]
+
+        # Store all file metadata in one batch
+        inline_ids = await mongo_service.store_files(conversation_id, [
+            {
+                "filename": u.filename,
+                "content_type": u.content_type,
+                "size": u.size,
+                "file_type": u.file_type.value,
+                "extracted_text": extracted,
+                "file_path": u.path,
+                "sha256": u.sha256,
+            }
+            for u, extracted in zip(uploads, extracted_texts)
+        ])
+    finally:
+        for u in uploads:
+            u.cleanup()
+
+    file_metadata_list = [
+        {
+            "filename": u.filename,
+            "content_type": u.content_type,
+            "size": u.size,
+            "file_type": u.file_type.value,
+            "file_id": file_id,
+        }
+        for u, file_id in zip(uploads, inline_ids)
+    ]
+
+    # Pre-uploaded files are already extracted and chunked; they only need linking
+    attached_chunks = 0
+    if file_ids:
+        try:
+            prepared = await file_service.wait_ready(file_ids, conversation_id)
+        except file_service.FileNotUsable as e:
+            raise HTTPException(e.status_code, e.detail) from e
+        attached_chunks = await mongo_service.attach_files(conversation_id, file_ids)
+        for doc in prepared:
+            file_metadata_list.append({
+                "filename": doc["filename"],
+                "content_type": doc["content_type"],
+                "size": doc["size"],
+                "file_type": doc["file_type"],
+                "file_id": str(doc["_id"]),
+            })
+            if image := doc.get("model_image"):
+                image_data.append((doc["filename"], image["url"], image["detail"]))
+
+    # Chunk new documents into the conversation's index, then pick the chunks relevant to this message
+    to_index = [
+        (file_id, u.filename, extracted)
+        for u, file_id, extracted in zip(uploads, inline_ids, extracted_texts)
+        if extracted
+    ]
+    await retrieval_service.index_files(conversation_id, to_index)
     file_texts: list[tuple[str, str]] = []
-    image_data: list[tuple[str, str]] = []
-    file_metadata_list = []
-
-    for f in files:
-        if not f.filename:
-            continue
-        content_bytes = await f.read()
-
-        # Validate size
-        if len(content_bytes) > settings.max_file_size_mb * 1024 * 1024:
-            raise HTTPException(413, f"File {f.filename} exceeds {settings.max_file_size_mb}MB limit")
-
-        file_type = file_processor.detect_file_type(f.filename, f.content_type or "")
-
-        # Extract text or encode image
-        if file_type == FileType.image:
-            b64 = file_processor.image_to_base64(content_bytes, f.content_type or "image/png")
-            image_data.append((f.filename, b64))
-            extracted = None
-        else:
-            extracted = file_processor.extract_text(content_bytes, file_type)
-            if extracted:
-                file_texts.append((f.filename, extracted))
-
-        # Store file metadata in DB
-        file_id = await mongo_service.store_file_metadata(
-            conversation_id=conversation_id,
-            filename=f.filename,
-            content_type=f.content_type or "",
-            size=len(content_bytes),
-            file_type=file_type.value,
-            extracted_text=extracted,
-            file_data=content_bytes,
+    if to_index or attached_chunks or convo.get("document_chunks"):
+        file_texts = await retrieval_service.select_context(
+            conversation_id, message, [file_id for file_id, _, _ in to_index] + file_ids
         )
-        file_metadata_list.append({
-            "filename": f.filename,
-            "content_type": f.content_type or "",
-            "size": len(content_bytes),
-            "file_type": file_type.value,
-            "file_id": file_id,
-        })
 
     # Store user message
-    await mongo_service.add_message(
+    user_msg = await mongo_service.add_message(
         conversation_id=conversation_id,
         role="user",
         content=message,
         files=file_metadata_list,
     )
 
-    # Get conversation history
-    history = await mongo_service.get_messages(conversation_id)
+    # Generate title from first message in the background, off the time-to-first-token path
+    title_task = None
+    if convo.get("message_count", 0) == 0:
+        title_task = task_queue.submit(_generate_title, conversation_id, message)
+
+    # Generate in the background; this request (and any later one) just reads the events
+    generation = generation_service.Generation(str(ObjectId()))
+    await generation.emit("start", {
+        "conversation_id": conversation_id,
+        "message_id": generation.message_id,
+    })
+    generation_service.start(
+        generation,
+        _run_generation,
+        client_ip,
+        conversation_id,
+        convo,
+        history,
+        user_msg,
+        message,
+        file_texts,
+        image_data,
+        title_task,
+        _use_response_cache(request),
+    )
+    return _event_stream(generation_service.events(generation.message_id))
+
+
+async def _run_generation(
+    generation: generation_service.Generation,
+    client_ip: str,
+    conversation_id: str,
+    convo: dict,
+    history: list[dict],
+    user_msg: dict,
+    message: str,
+    file_texts: list[tuple[str, str]],
+    image_data: list[tuple[str, str, str]],
+    title_task: asyncio.Task | None,
+    use_cache: bool,
+):
+    stream_meta: dict = {}
+    title_sent = title_task is None
+
+    async def emit_title():
+        nonlocal title_sent
+        if title_sent or not title_task.done():
+            return
+        title_sent = True
+        if not title_task.cancelled() and not title_task.exception():
+            await generation.emit("title", {"title": title_task.result()})
+
+    tokens = openai_service.chat_stream(
+        conversation_history=history,
+        user_message=message,
+        file_texts=file_texts,
+        image_data=image_data,
+        summary=convo.get("summary"),
+        use_cache=use_cache,
+        meta=stream_meta,
+    )
+    # Tokens are merged into frames, so thousands of streams don't mean one event per delta
+    frames = sse.coalesce(
+        tokens,
+        settings.sse_coalesce_ms / 1000,
+        settings.sse_max_frame_bytes,
+        settings.sse_buffer_tokens,
+    )
+    parts: list[str] = []
+    cancelled = False
+    error = None
+    try:
+        async for frame in frames:
+            parts.append(frame)
+            await generation.emit("token", {"token": frame})
+            await emit_title()
+            if await generation.should_stop():
+                cancelled = True
+                break
+    except Exception as e:
+        error = str(e)
+    finally:
+        # Closing the frames closes the upstream stream, so a cancelled answer stops billing at once
+        await frames.aclose()
+
+    if error is not None and not parts:
+        await generation.emit("error", {"error": error})
+        return
 
-    # Generate title from first message
-    if len(history) == 1:
-        title = await openai_service.generate_title(message)
-        await mongo_service.update_conversation_title(conversation_id, title)
+    # Persist what was generated, even if cancelled or cut off by an error (it was billed).
+    # Written through, not write-behind: clients reload the history after `done`,
+    # possibly from another worker
+    complete_text = stream_meta.get("text") or "".join(parts)
+    usage = _message_usage(stream_meta, complete_text, error=error is not None)
+    total_tokens = stream_meta.get("usage", {}).get("total_tokens") or usage["completion_tokens"]
+    await redis_service.record_token_usage(client_ip, total_tokens)
+    assistant_msg = await mongo_service.add_message(
+        conversation_id=conversation_id,
+        role="assistant",
+        content=complete_text,
+        token_count=total_tokens,
+        message_id=generation.message_id,
+        usage=usage,
+    )
+    summary_service.maybe_summarize(conversation_id, history + [user_msg, assistant_msg])
+    if error is not None:
+        await generation.emit("error", {"error": error})
+        return
+
+    # Give a still-running title a moment so viewers get it before `done`
+    if not title_sent:
+        await asyncio.wait({title_task}, timeout=settings.title_wait_seconds)
+        await emit_title()
 
-    # Stream response via SSE
-    async def event_generator():
-        full_response = []
+    await generation.emit("done", {
+        "conversation_id": conversation_id,
+        "message_id": generation.message_id,
+        "cached": stream_meta.get("cached", False),
+        "route": stream_meta.get("route"),
+        "cancelled": cancelled,
+    })
+
+
+def _event_stream(events) -> EventSourceResponse:
+    async def counted():
+        metrics.ACTIVE_STREAMS.inc()
         try:
-            async for token in openai_service.chat_stream(
-                conversation_history=history[:-1],  # Exclude the message we just added
-                user_message=message,
-                file_texts=file_texts,
-                image_data=image_data,
-            ):
-                full_response.append(token)
-                yield {"event": "token", "data": json.dumps({"token": token})}
-
-            # Store assistant response
-            complete_text = "".join(full_response)
-            await mongo_service.add_message(
-                conversation_id=conversation_id,
-                role="assistant",
-                content=complete_text,
-            )
-
-            yield {
-                "event": "done",
-                "data": json.dumps({"conversation_id": conversation_id}),
-            }
-        except Exception as e:
-            yield {"event": "error", "data": json.dumps({"error": str(e)})}
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+            metrics.ACTIVE_STREAMS.dec()
+
+    stream = counted()
+    return EventSourceResponse(
+        stream,
+        ping=settings.sse_ping_seconds,
+        send_timeout=settings.sse_send_timeout_seconds,
+        # On disconnect the response stops iterating without closing the generator; close it here
+        background=BackgroundTask(stream.aclose),
+    )
+
+
+async def _persisted_events(message: dict):
+    """A finished generation whose stream has expired, replayed from the stored message."""
+    yield {"event": "token", "data": sse.dumps({"token": message["content"]})}
+    yield {
+        "event": "done",
+        "data": sse.dumps({
+            "conversation_id": message["conversation_id"],
+            "message_id": str(message["_id"]),
+        }),
+    }
+
+
+@router.get("/stream/{message_id}")
+async def resume_stream(request: Request, message_id: str):
+    """Follow a generation, from the start or after the `Last-Event-ID` the client last saw."""
+    if not ObjectId.is_valid(message_id):
+        raise HTTPException(400, "Invalid message id")
+    if await generation_service.exists(message_id):
+        last_event_id = request.headers.get("last-event-id")
+        return _event_stream(generation_service.events(message_id, last_event_id))
+    message = await mongo_service.get_message(message_id)
+    if not message or message["role"] != "assistant":
+        raise HTTPException(404, "Generation not found")
+    return _event_stream(_persisted_events(message))
 
-    return EventSourceResponse(event_generator())
+
+@router.post("/stream/{message_id}/cancel")
+async def cancel_stream(message_id: str):
+    """Stop a running generation; what was generated so far is kept."""
+    if not await generation_service.cancel(message_id):
+        raise HTTPException(404, "Generation not running")
+    return {"status": "cancelling"}
 
 
 @router.post("/send-simple")
@@ -133,22 +382,46 @@ async def send_message_simple(
     client_ip = request.client.host if request.client else "unknown"
     if not await redis_service.check_rate_limit(client_ip):
         raise HTTPException(429, "Rate limit exceeded.")
+    if not await redis_service.check_token_budget(client_ip):
+        raise HTTPException(429, "Daily token budget exhausted.")
 
     if not conversation_id:
         convo = await mongo_service.create_conversation()
         conversation_id = str(convo["_id"])
+        history = []
+    else:
+        convo, history = await mongo_service.get_conversation_with_history(
+            conversation_id, settings.history_fetch_limit
+        )
+        if not convo:
+            raise HTTPException(404, "Conversation not found")
 
-    await mongo_service.add_message(conversation_id, "user", message)
-    history = await mongo_service.get_messages(conversation_id)
+    user_msg = await mongo_service.add_message(conversation_id, "user", message)
 
-    if len(history) == 1:
-        title = await openai_service.generate_title(message)
-        await mongo_service.update_conversation_title(conversation_id, title)
+    if convo.get("message_count", 0) == 0:
+        task_queue.submit(_generate_title, conversation_id, message)
 
+    meta: dict = {}
     content, tokens = await openai_service.chat_complete(
-        conversation_history=history[:-1],
+        conversation_history=history,
         user_message=message,
+        summary=convo.get("summary"),
+        use_cache=_use_response_cache(request),
+        meta=meta,
     )
 
-    await mongo_service.add_message(conversation_id, "assistant", content, token_count=tokens)
-    return {"conversation_id": conversation_id, "content": content, "tokens": tokens}
+    await redis_service.record_token_usage(client_ip, tokens)
+    assistant_msg = await mongo_service.add_message(
+        conversation_id,
+        "assistant",
+        content,
+        token_count=tokens,
+        usage=_message_usage(meta, content),
+    )
+    summary_service.maybe_summarize(conversation_id, history + [user_msg, assistant_msg])
+    return {
+        "conversation_id": conversation_id,
+        "content": content,
+        "tokens": tokens,
+        "route": meta.get("route"),
+    }
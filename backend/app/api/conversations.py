@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 
 from app.services import mongo_service
-from app.models.schemas import ConversationResponse, ConversationListResponse, MessageResponse
+from app.models.schemas import (
+    ConversationResponse,
+    ConversationListResponse,
+    ConversationUsageResponse,
+    MessageListResponse,
+    MessageResponse,
+)
 
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
 
@@ -24,16 +30,32 @@ def _format_message(doc: dict) -> dict:
         "content": doc["content"],
         "files": doc.get("files", []),
         "token_count": doc.get("token_count", 0),
+        "usage": doc.get("usage"),
         "created_at": doc["created_at"],
     }
 
 
+def _page_fields(page: dict) -> dict:
+    return {k: page[k] for k in ("older_cursor", "newer_cursor", "has_older", "has_newer")}
+
+
 @router.get("", response_model=ConversationListResponse)
-async def list_conversations(skip: int = 0, limit: int = 50):
-    convos, total = await mongo_service.list_conversations(skip, limit)
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    before: str | None = None,
+    after: str | None = None,
+    exact_total: bool = False,
+):
+    """Most recently updated first. Pass `before=older_cursor` to load older
+    conversations, or `after=newer_cursor` to fetch ones updated since."""
+    try:
+        page = await mongo_service.list_conversations(limit, before, after, exact_total)
+    except ValueError as e:
+        raise HTTPException(400, str(e)) from e
     return {
-        "conversations": [_format_conversation(c) for c in convos],
-        "total": total,
+        "conversations": [_format_conversation(c) for c in page["items"]],
+        "total": page["total"],
+        **_page_fields(page),
     }
 
 
@@ -45,13 +67,41 @@ async def get_conversation(conversation_id: str):
     return _format_conversation(convo)
 
 
-@router.get("/{conversation_id}/messages")
-async def get_messages(conversation_id: str, limit: int = 50):
+@router.get("/{conversation_id}/messages", response_model=MessageListResponse)
+async def get_messages(
+    conversation_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: str | None = None,
+    after: str | None = None,
+):
+    """Chronological page of messages, the latest ones by default. Pass
+    `before=older_cursor` to load earlier messages, `after=newer_cursor` for newer."""
     convo = await mongo_service.get_conversation(conversation_id)
     if not convo:
         raise HTTPException(404, "Conversation not found")
-    messages = await mongo_service.get_messages(conversation_id, limit)
-    return [_format_message(m) for m in messages]
+    try:
+        page = await mongo_service.get_messages(conversation_id, limit, before, after)
+    except ValueError as e:
+        raise HTTPException(400, str(e)) from e
+    return {
+        "messages": [_format_message(m) for m in page["items"]],
+        "total": convo.get("message_count", 0),
+        **_page_fields(page),
+    }
+
+
+@router.get("/{conversation_id}/usage", response_model=ConversationUsageResponse)
+async def get_conversation_usage(conversation_id: str):
+    """Tokens and latency of the conversation's answers, per model."""
+    convo = await mongo_service.get_conversation(conversation_id)
+    if not convo:
+        raise HTTPException(404, "Conversation not found")
+    models = await mongo_service.get_conversation_usage(conversation_id)
+    return {
+        "conversation_id": conversation_id,
+        "models": models,
+        "total_tokens": sum(m["total_tokens"] for m in models),
+    }
 
 
 @router.patch("/{conversation_id}")
@@ -1,49 +1,203 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
+import asyncio
 
-from app.services import mongo_service
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from sse_starlette.sse import EventSourceResponse
+
+from app.config import get_settings
+from app.models.schemas import FileType, SpreadsheetLookupRequest, SpreadsheetLookupResponse
+from app.services import extraction_service, file_service, mongo_service, redis_service, spreadsheet, sse, storage_service, upload_service
 
 router = APIRouter(prefix="/api/files", tags=["files"])
+settings = get_settings()
 
 
-@router.get("/{file_id}")
-async def get_file(file_id: str):
-    """Get file metadata."""
-    file_doc = await mongo_service.get_file(file_id)
-    if not file_doc:
-        raise HTTPException(404, "File not found")
+def _parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single `bytes=` range into inclusive (start, end). None = not satisfiable."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if not start_s:
+            # Suffix range: the last N bytes
+            length = int(end_s)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _format_file(file_doc: dict) -> dict:
     return {
         "id": str(file_doc["_id"]),
         "filename": file_doc["filename"],
         "content_type": file_doc["content_type"],
         "size": file_doc["size"],
         "file_type": file_doc["file_type"],
-        "has_extracted_text": bool(file_doc.get("extracted_text")),
+        "status": file_doc.get("status", "ready"),
+        "error": file_doc.get("error"),
+        "progress": file_doc.get("progress"),
+        "has_extracted_text": file_doc.get("has_extracted_text", False),
+    }
+
+
+@router.post("", status_code=202)
+async def upload_file(
+    request: Request,
+    file: UploadFile = File(...),
+    conversation_id: str | None = Form(None),
+):
+    """Upload a file ahead of sending; it is prepared in the background.
+
+    Poll `GET /api/files/{id}` (or follow `/events`) until `status` is "ready",
+    then pass the id as `file_ids` to `/api/chat/send`.
+    """
+    client_ip = request.client.host if request.client else "unknown"
+    if not await redis_service.check_rate_limit(client_ip):
+        raise HTTPException(429, "Rate limit exceeded. Try again in a minute.")
+    if conversation_id and not await mongo_service.get_conversation(conversation_id):
+        raise HTTPException(404, "Conversation not found")
+    try:
+        upload = await upload_service.ingest(file)
+    except upload_service.UploadRejected as e:
+        raise HTTPException(e.status_code, e.detail) from e
+    file_id = await file_service.accept(upload, conversation_id)
+    return {
+        "file_id": file_id,
+        "filename": upload.filename,
+        "content_type": upload.content_type,
+        "size": upload.size,
+        "file_type": upload.file_type.value,
+        "status": "processing",
     }
 
 
+@router.get("/{file_id}")
+async def get_file(file_id: str):
+    """Get file metadata, including processing status."""
+    file_doc = await mongo_service.get_file(file_id)
+    if not file_doc:
+        raise HTTPException(404, "File not found")
+    return _format_file(file_doc)
+
+
+@router.get("/{file_id}/events")
+async def file_events(file_id: str):
+    """SSE `status` events (status and page progress) for a file until it is ready or failed."""
+    file_doc = await mongo_service.get_file(file_id)
+    if not file_doc:
+        raise HTTPException(404, "File not found")
+
+    async def events():
+        doc, last = file_doc, None
+        while True:
+            status = doc.get("status", "ready")
+            if (status, doc.get("progress")) != last:
+                last = status, doc.get("progress")
+                yield {"event": "status", "data": sse.dumps(_format_file(doc))}
+            if status != "processing":
+                return
+            await asyncio.sleep(0.25)
+            doc = await mongo_service.get_file(file_id) or {**doc, "status": "failed"}
+
+    return EventSourceResponse(events(), ping=settings.sse_ping_seconds)
+
+
 @router.get("/{file_id}/download")
-async def download_file(file_id: str):
-    """Download file binary data."""
+async def download_file(file_id: str, request: Request):
+    """Download file binary data, streamed in chunks with Range/ETag support."""
     file_doc = await mongo_service.get_file(file_id)
     if not file_doc:
         raise HTTPException(404, "File not found")
-    if "file_data" not in file_doc:
-        raise HTTPException(404, "File data not available")
-    return Response(
-        content=file_doc["file_data"],
+
+    headers = {"Content-Disposition": f'attachment; filename="{file_doc["filename"]}"'}
+
+    sha256 = file_doc.get("sha256")
+    if not sha256:
+        file_data = await mongo_service.get_inline_file_data(file_id)
+        if file_data is None:
+            raise HTTPException(404, "File data not available")
+        return Response(content=file_data, media_type=file_doc["content_type"], headers=headers)
+
+    etag = f'"{sha256}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    size = file_doc["size"]
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    # If-Range: only honour the range when the client's copy is still current
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            raise HTTPException(416, "Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        (start, end), status = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers.update({
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+    })
+    return StreamingResponse(
+        storage_service.get_storage().iter_range(sha256, start, end),
+        status_code=status,
         media_type=file_doc["content_type"],
-        headers={"Content-Disposition": f'attachment; filename="{file_doc["filename"]}"'},
+        headers=headers,
     )
 
 
 @router.get("/{file_id}/text")
 async def get_file_text(file_id: str):
     """Get extracted text from a file."""
-    file_doc = await mongo_service.get_file(file_id)
+    file_doc = await mongo_service.get_file_text(file_id)
     if not file_doc:
         raise HTTPException(404, "File not found")
     return {
         "filename": file_doc["filename"],
         "extracted_text": file_doc.get("extracted_text", ""),
     }
+
+
+@router.post("/{file_id}/lookup", response_model=SpreadsheetLookupResponse)
+async def lookup_rows(file_id: str, body: SpreadsheetLookupRequest):
+    """Rows of a spreadsheet or CSV matching every filter, for questions its summary can't answer."""
+    file_doc = await mongo_service.get_file(file_id)
+    if not file_doc:
+        raise HTTPException(404, "File not found")
+    if file_doc["file_type"] not in (FileType.xlsx.value, FileType.csv.value):
+        raise HTTPException(400, "Lookups are only supported for spreadsheets and CSV files")
+
+    async def run(source: bytes | str):
+        return await extraction_service.run_in_pool(
+            spreadsheet.lookup,
+            source,
+            FileType(file_doc["file_type"]),
+            body.sheet,
+            [f.model_dump() for f in body.filters],
+            body.columns,
+            min(body.limit, settings.spreadsheet_lookup_max_results),
+            settings.extraction_max_rows,
+        )
+
+    try:
+        sha256 = file_doc.get("sha256")
+        if not sha256:
+            data = await mongo_service.get_inline_file_data(file_id)
+            if data is None:
+                raise HTTPException(404, "File data not available")
+            return await run(data)
+        # Workers read the file from disk, as extraction does, instead of being sent its bytes
+        async with storage_service.get_storage().as_path(sha256) as path:
+            return await run(path)
+    except ValueError as e:
+        raise HTTPException(400, str(e)) from e
+    except asyncio.TimeoutError as e:
+        raise HTTPException(504, f"Lookup timed out after {settings.extraction_timeout_seconds:g}s") from e
@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Query
+
+from app.services import mongo_service
+from app.models.schemas import DailyUsageResponse
+
+router = APIRouter(prefix="/api/usage", tags=["usage"])
+
+
+@router.get("/daily", response_model=DailyUsageResponse)
+async def daily_usage(days: int = Query(30, ge=1, le=366)):
+    """Tokens and latency per day and model over the last `days` days (UTC), for capacity planning."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = await mongo_service.get_daily_usage(since)
+    return {"days": rows, "total_tokens": sum(r["total_tokens"] for r in rows)}
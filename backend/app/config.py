@@ -1,15 +1,83 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
 
+class ModelBackend(BaseModel):
+    """One routable model endpoint (see MODEL_BACKENDS)."""
+    name: str
+    model: str
+    tier: str = "primary"  # "primary" or "fast"
+    provider: str = "openai"  # "openai" (any OpenAI-compatible API) or "fake"
+    base_url: str | None = None
+    api_key: str | None = None
+    options: dict = {}  # Provider options, e.g. ttft_seconds / error_rate for "fake"
+
+
 class Settings(BaseSettings):
     # OpenAI
     openai_api_key: str = ""
+    openai_base_url: str | None = None
     openai_model: str = "gpt-4o"
+    title_model: str = "gpt-4o-mini"
+
+    # Model routing
+    model_backends: list[ModelBackend] = []  # JSON; empty = OPENAI_MODEL plus FAST_MODEL on OpenAI
+    fast_model: str = "gpt-4o-mini"
+    fast_route_max_prompt_tokens: int = 800  # Text-only prompts up to this size go to the fast tier; 0 = off
+    router_window: int = 50  # Recent calls per backend used for latency/error stats
+    router_error_threshold: float = 0.5  # Backends failing more often than this are tried last
+    router_first_token_timeout_seconds: float = 15.0  # Fail over if no token by then
+
+    # Upstream HTTP client (shared connection pool for all OpenAI calls)
+    upstream_max_connections: int = 100
+    upstream_max_keepalive: int = 20
+    upstream_keepalive_expiry_seconds: float = 30.0
+    upstream_http2: bool = True  # Needs the h2 package; falls back to HTTP/1.1
+    upstream_connect_timeout_seconds: float = 5.0
+    upstream_read_timeout_seconds: float = 60.0  # Max gap between bytes, including between stream chunks
+    upstream_write_timeout_seconds: float = 10.0
+    upstream_pool_timeout_seconds: float = 10.0
+    upstream_max_concurrency: int = 32  # Calls in flight at once; the rest queue
+    upstream_max_retries: int = 2  # On 429/5xx/connection errors, before any output
+    upstream_retry_base_seconds: float = 0.5
+    upstream_retry_max_seconds: float = 8.0
+    title_timeout_seconds: float = 10.0
+    title_hedge_delay_seconds: float = 1.5  # Start a second title request after this; 0 = off
+
+    # Background tasks (title generation, summaries)
+    background_task_concurrency: int = 8
+    background_task_retries: int = 2
+    background_task_retry_base_seconds: float = 0.5
+    title_wait_seconds: float = 2.0  # How long a finished stream waits for a late title
+
+    # Context window
+    context_token_budget: int = 16000  # Prompt tokens: system + history + current message
+    history_fetch_limit: int = 100  # Most recent messages considered for the context
+    tokenizer: str = "tiktoken"  # "tiktoken" or "approx" (~4 chars per token)
+
+    # Rolling summary of older turns
+    summary_trigger_tokens: int = 8000  # Verbatim history size that triggers a new summary
+    summary_keep_recent_tokens: int = 3000  # Newest turns that always stay verbatim
+    summary_model: str = "gpt-4o-mini"
+    summary_max_tokens: int = 600
+
+    # Streaming (SSE)
+    sse_coalesce_ms: int = 30  # Merge tokens arriving within this window into one event; 0 = one per token
+    sse_max_frame_bytes: int = 1024  # Send early once this much text is pending
+    sse_buffer_tokens: int = 256  # Read-ahead for slow clients before upstream reads pause
+    sse_ping_seconds: int = 15  # Heartbeat comments that keep idle proxies from closing the stream
+    sse_send_timeout_seconds: float = 30.0  # Drop clients that stop reading
+    generation_stream_ttl_seconds: int = 900  # Redis Stream per generation, for resume and other workers
+    generation_local_retention_seconds: float = 60.0  # In-process log kept after a generation ends
 
     # MongoDB
     mongodb_uri: str = "mongodb://localhost:27017"
     mongodb_db_name: str = "fullstack_ai_chat"
+    write_behind_interval_seconds: float = 0.25  # Flush cadence for buffered messages/counters
+    write_behind_max_messages: int = 500
+    message_storage: str = "documents"  # "documents" (one per message) or "buckets" (see scripts/migrate_messages.py)
+    message_bucket_size: int = 100  # Messages per bucket document in "buckets" mode
 
     # Redis
     redis_url: str = "redis://localhost:6379"
@@ -21,10 +89,53 @@ class Settings(BaseSettings):
 
     # File Upload
     max_file_size_mb: int = 10
+    max_files_per_message: int = 10
+    upload_chunk_size: int = 1024 * 1024
+    upload_spool_dir: str | None = None  # None = system temp dir
+    preupload_ttl_seconds: int = 24 * 3600  # Files uploaded ahead but never sent are deleted after this
+    preupload_sweep_interval_seconds: float = 600.0
     allowed_extensions: list[str] = [
-        "pdf", "docx", "xlsx", "png", "jpg", "jpeg", "webp"
+        "pdf", "docx", "xlsx", "csv", "png", "jpg", "jpeg", "webp"
     ]
 
+    # Document retrieval (large files are chunked; only relevant chunks reach the prompt)
+    max_document_tokens: int = 6000  # File context per prompt
+    retrieval_chunk_tokens: int = 400
+    retrieval_chunk_overlap_tokens: int = 50
+    retrieval_top_k: int = 12
+
+    # File Storage
+    storage_backend: str = "gridfs"  # "gridfs" or "local"
+    storage_local_path: str = "uploads"
+    storage_chunk_size: int = 255 * 1024
+
+    # File Extraction (runs in a process pool, off the event loop)
+    extraction_workers: int = 2  # 0 = use a thread instead of a process pool
+    extraction_timeout_seconds: float = 30.0
+    extraction_max_pages: int = 200
+    extraction_max_rows: int = 50_000  # Spreadsheet rows loaded per sheet for statistics and lookups
+    extraction_max_chars: int = 1_000_000  # Text kept per document (PDFs stop extracting here)
+    extraction_pdf_shard_pages: int = 8  # Pages per parallel PDF extraction job
+
+    # Spreadsheets (xlsx/csv) are summarized for the prompt; rows are fetched via lookups
+    spreadsheet_sample_rows: int = 20  # Rows shown in each sheet's summary
+    spreadsheet_max_sheet_chars: int = 8000  # Summary size cap per sheet
+    spreadsheet_lookup_max_results: int = 500
+
+    # Images sent to the model (resized, stripped of metadata and recompressed first)
+    image_max_long_side: int = 2048
+    image_max_short_side: int = 768  # High detail scales the short side to this anyway
+    image_low_detail_max_side: int = 512  # Images this small are sent with detail "low"
+    image_format: str = "webp"  # "webp" or "jpeg"
+    image_quality: int = 85
+
+    # Caching (in-process LRU in front of Redis)
+    local_cache_max_bytes: int = 64 * 1024 * 1024
+    extraction_cache_ttl_seconds: int = 7 * 24 * 3600
+    response_cache_ttl_seconds: int = 24 * 3600
+    response_cache_max_chars: int = 32000  # Longer answers aren't cached
+    conversation_cache_ttl_seconds: int = 600  # Redis only; holds mutable data
+
     # Rate Limiting
     rate_limit_per_minute: int = 20
     daily_token_budget: int = 100000
@@ -1,11 +1,23 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import get_settings
-from app.api import chat, conversations, files
-from app.services import mongo_service, redis_service
+from app.middleware import BodySizeLimitMiddleware, MetricsMiddleware
+from app.api import chat, conversations, files, usage
+from app.services import (
+    extraction_service,
+    file_service,
+    generation_service,
+    metrics,
+    model_router,
+    mongo_service,
+    redis_service,
+    response_cache,
+    task_queue,
+    upstream,
+)
 
 settings = get_settings()
 
@@ -15,8 +27,15 @@ async def lifespan(app: FastAPI):
     # Startup
     await mongo_service.connect_db()
     await redis_service.connect_redis()
+    extraction_service.start_executor()
+    file_service.start_sweeper()
     yield
     # Shutdown
+    await generation_service.drain()
+    await file_service.drain()
+    await task_queue.drain()
+    extraction_service.shutdown_executor()
+    await upstream.close()
     await redis_service.close_redis()
     await mongo_service.close_db()
 
@@ -36,10 +55,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Bound request bodies: every file at the size limit plus 1MB for form fields
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=(settings.max_file_size_mb * settings.max_files_per_message + 1) * 1024 * 1024,
+)
+
+# Outermost, so the timing covers everything below
+app.add_middleware(MetricsMiddleware)
+
 # Routes
 app.include_router(chat.router)
 app.include_router(conversations.router)
 app.include_router(files.router)
+app.include_router(usage.router)
 
 
 @app.get("/health")
@@ -51,9 +80,18 @@ async def health():
         "version": "1.0.0",
         "mongodb": "connected" if mongo_ok else "disconnected",
         "redis": "connected" if redis_ok else "disconnected",
+        "response_cache": response_cache.stats(),
+        "upstream": upstream.stats(),
+        "model_router": model_router.stats(),
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    payload, content_type = metrics.render()
+    return Response(payload, media_type=content_type)
+
+
 @app.get("/")
 async def root():
     return {"message": "Conversa AI API | by AiwithDhruv", "docs": "/docs"}
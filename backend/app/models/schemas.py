@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
 from enum import Enum
+from typing import Literal
 
 
 class MessageRole(str, Enum):
@@ -13,6 +14,7 @@ class FileType(str, Enum):
     pdf = "pdf"
     docx = "docx"
     xlsx = "xlsx"
+    csv = "csv"
     image = "image"
 
 
@@ -29,6 +31,16 @@ class MessageCreate(BaseModel):
     conversation_id: str | None = None
 
 
+class MessageUsage(BaseModel):
+    model: str | None = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    ttft_ms: int | None = None
+    generation_ms: int | None = None
+    cached: bool = False
+    error: bool = False  # The stream failed part-way; the message holds what arrived
+
+
 class MessageResponse(BaseModel):
     id: str
     conversation_id: str
@@ -36,6 +48,7 @@ class MessageResponse(BaseModel):
     content: str
     files: list[FileMetadata] = []
     token_count: int = 0
+    usage: MessageUsage | None = None
     created_at: datetime
 
 
@@ -54,6 +67,69 @@ class ConversationResponse(BaseModel):
 class ConversationListResponse(BaseModel):
     conversations: list[ConversationResponse]
     total: int
+    older_cursor: str | None = None
+    newer_cursor: str | None = None
+    has_older: bool = False
+    has_newer: bool = False
+
+
+class MessageListResponse(BaseModel):
+    messages: list[MessageResponse]
+    total: int
+    older_cursor: str | None = None
+    newer_cursor: str | None = None
+    has_older: bool = False
+    has_newer: bool = False
+
+
+class UsageRollup(BaseModel):
+    model: str
+    messages: int = 0
+    cached: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    avg_ttft_ms: float | None = None
+    avg_generation_ms: float | None = None
+
+
+class DailyUsage(UsageRollup):
+    day: str
+
+
+class ConversationUsageResponse(BaseModel):
+    conversation_id: str
+    models: list[UsageRollup]
+    total_tokens: int = 0
+
+
+class DailyUsageResponse(BaseModel):
+    days: list[DailyUsage]
+    total_tokens: int = 0
+
+
+class SpreadsheetFilter(BaseModel):
+    column: str
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte", "contains"] = "eq"
+    value: str | int | float | bool
+
+
+class SpreadsheetLookupRequest(BaseModel):
+    sheet: str | None = None  # Defaults to the first sheet
+    filters: list[SpreadsheetFilter] = []
+    columns: list[str] | None = None  # Defaults to all columns
+    limit: int = Field(50, ge=1)
+
+
+class SpreadsheetLookupResponse(BaseModel):
+    sheet: str
+    columns: list[str]
+    rows: list[list]
+    row_numbers: list[int]
+    matched: int
+    scanned_rows: int
+    total_rows: int
 
 
 class ChatRequest(BaseModel):
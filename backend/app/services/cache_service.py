@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+from app.config import get_settings
+from app.services import redis_service
+
+settings = get_settings()
+
+
+class LRUCache:
+    """Small in-process LRU bounded by the total size of its string values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> str | None:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        if len(value) > self.max_bytes:
+            return
+        self.pop(key)
+        self._data[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self._size -= len(evicted)
+
+    def pop(self, key: str):
+        value = self._data.pop(key, None)
+        if value is not None:
+            self._size -= len(value)
+
+    def clear(self):
+        self._data.clear()
+        self._size = 0
+
+
+_local = LRUCache(settings.local_cache_max_bytes)
+
+
+async def get(key: str) -> str | None:
+    """Two-tier lookup: in-process LRU first, then Redis (which refills the LRU)."""
+    value = _local.get(key)
+    if value is not None:
+        return value
+    try:
+        value = await redis_service.cache_get(key)
+    except Exception:
+        return None  # A cache outage must never fail the request
+    if value is not None:
+        _local.set(key, value)
+    return value
+
+
+async def set(key: str, value: str, ttl: int):
+    _local.set(key, value)
+    try:
+        await redis_service.cache_set(key, value, ttl=ttl)
+    except Exception:
+        pass
@@ -0,0 +1,15 @@
+from app.services.token_counter import message_tokens
+
+
+def pack_history(conversation_history: list[dict], token_budget: int) -> list[dict]:
+    """Keep the newest messages that fit in the token budget, in chronological order."""
+    packed = []
+    used = 0
+    for msg in reversed(conversation_history):
+        cost = message_tokens(msg)
+        if used + cost > token_budget:
+            break
+        packed.append(msg)
+        used += cost
+    packed.reverse()
+    return packed
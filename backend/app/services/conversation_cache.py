@@ -0,0 +1,146 @@
+import json
+
+from bson import json_util
+
+from app.config import get_settings
+from app.services import metrics, redis_service
+
+settings = get_settings()
+
+# A conversation is cached as its document plus a list of its newest messages.
+# The document carries "_recent": how many messages the list holds, or -1 when
+# the list is not cached. Both keys share a hash tag so they live on one slot.
+
+_READ_LUA = """
+local doc = redis.call('GET', KEYS[1])
+if not doc then
+  return false
+end
+return {doc, redis.call('LRANGE', KEYS[2], 0, -1)}
+"""
+
+# Refills after a miss race writers: an entry already cached has been kept current
+# by _UPDATE_LUA, so it is only replaced by one with more messages, or by the same
+# count plus the message list it lacks. Returns 1 if written.
+_WRITE_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if raw then
+  local doc = cjson.decode(raw)
+  local cached, count = doc['message_count'] or 0, tonumber(ARGV[3])
+  if cached > count or (cached == count and (doc['_recent'] >= 0 or ARGV[4] == '-1')) then
+    return 0
+  end
+end
+redis.call('DEL', KEYS[2])
+for i = 5, #ARGV do
+  redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+if #ARGV > 4 then
+  redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Write-through for counter updates and new messages; a no-op when not cached
+_UPDATE_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+  return 0
+end
+local doc = cjson.decode(raw)
+local ttl = tonumber(ARGV[4])
+for field, n in pairs(cjson.decode(ARGV[1])) do
+  doc[field] = (doc[field] or 0) + n
+end
+if ARGV[2] ~= '' then
+  doc['updated_at'] = cjson.decode(ARGV[2])
+end
+if ARGV[3] ~= '' and doc['_recent'] >= 0 then
+  local cap = tonumber(ARGV[5])
+  redis.call('RPUSH', KEYS[2], ARGV[3])
+  redis.call('LTRIM', KEYS[2], -cap, -1)
+  redis.call('EXPIRE', KEYS[2], ttl)
+  doc['_recent'] = math.min(doc['_recent'] + 1, cap)
+end
+redis.call('SET', KEYS[1], cjson.encode(doc), 'EX', ttl)
+return 1
+"""
+
+
+def recent_cap() -> int:
+    """How many of a conversation's newest messages are cached."""
+    return settings.history_fetch_limit
+
+
+def _keys(conversation_id: str) -> list[str]:
+    return [f"conversation:{{{conversation_id}}}", f"conversation:{{{conversation_id}}}:recent"]
+
+
+async def get(conversation_id: str, limit: int = 0) -> tuple[dict | None, list[dict] | None]:
+    """The cached conversation and, if the cache can answer it, its newest `limit` messages.
+
+    Messages come back as None when they aren't cached, or when the cached list
+    is capped below `limit` and older messages might be missing.
+    """
+    try:
+        result = await redis_service.run_script(_READ_LUA, _keys(conversation_id), [])
+    except Exception:
+        return None, None  # A cache outage must never fail the request
+    if not result:
+        metrics.cache_result("conversation", False)
+        return None, None
+    raw_doc, raw_messages = result
+    doc = json_util.loads(raw_doc)
+    cached = doc.pop("_recent", -1)
+    if limit and (cached < 0 or cached != len(raw_messages) or (
+        len(raw_messages) < limit and cached >= recent_cap()
+    )):
+        metrics.cache_result("conversation", False)
+        return doc, None
+    metrics.cache_result("conversation", True)
+    return doc, [json_util.loads(m) for m in (raw_messages[-limit:] if limit else [])]
+
+
+async def put(conversation: dict, messages: list[dict] | None = None):
+    """Cache a conversation read from the database, with its newest messages if given.
+
+    `messages` must be the conversation's newest messages in chronological
+    order; fewer than `recent_cap()` means that is all of them. An entry that is
+    already cached with as many messages is kept (see _WRITE_LUA).
+    """
+    messages = messages[-recent_cap():] if messages is not None else None
+    doc = {**conversation, "_recent": len(messages) if messages is not None else -1}
+    args = [
+        json_util.dumps(doc),
+        settings.conversation_cache_ttl_seconds,
+        conversation.get("message_count", 0),
+        doc["_recent"],
+    ]
+    args += [json_util.dumps(m) for m in messages or []]
+    try:
+        await redis_service.run_script(_WRITE_LUA, _keys(str(conversation["_id"])), args)
+    except Exception:
+        pass
+
+
+async def update(conversation_id: str, inc: dict, updated_at=None, message: dict | None = None):
+    """Apply counter increments (and append a new message) to a cached conversation."""
+    args = [
+        json.dumps(inc),
+        json_util.dumps(updated_at) if updated_at else "",
+        json_util.dumps(message) if message else "",
+        settings.conversation_cache_ttl_seconds,
+        recent_cap(),
+    ]
+    try:
+        await redis_service.run_script(_UPDATE_LUA, _keys(conversation_id), args)
+    except Exception:
+        pass
+
+
+async def invalidate(conversation_id: str):
+    try:
+        await redis_service.cache_delete(*_keys(conversation_id))
+    except Exception:
+        pass
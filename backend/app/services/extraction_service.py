@@ -0,0 +1,297 @@
+import asyncio
+import multiprocessing
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import get_settings
+from app.models.schemas import FileType
+from app.services import cache_service, file_processor, metrics
+
+settings = get_settings()
+
+_executor: ProcessPoolExecutor | None = None
+_retired: list[ProcessPoolExecutor] = []  # Replaced pools whose workers are killed after a grace period
+
+
+def start_executor():
+    global _executor
+    if settings.extraction_workers > 0:
+        # "spawn" so workers don't inherit the event loop / Mongo client threads of the parent
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.extraction_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+
+def _terminate(executor: ProcessPoolExecutor):
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    if executor in _retired:
+        _retired.remove(executor)
+
+
+def shutdown_executor():
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    for executor in list(_retired):
+        _terminate(executor)
+
+
+def _recycle_executor():
+    """Replace the pool after a job overran: later jobs get fresh workers at once.
+
+    The old workers (one still busy with the overrunning job) are killed after
+    one more extraction timeout, which every other job they hold has to finish
+    within anyway.
+    """
+    global _executor
+    old, _executor = _executor, None
+    start_executor()
+    if old:
+        old.shutdown(wait=False)
+        _retired.append(old)
+        asyncio.get_running_loop().call_later(settings.extraction_timeout_seconds, _terminate, old)
+
+
+async def run_in_pool(fn, *args):
+    """Run a CPU-bound function off the event loop with the per-file timeout.
+
+    Falls back to the default thread pool when no process pool is running.
+    Cancelling the awaiting task drops the job if a worker hasn't picked it up
+    yet; if one has, the pool is recycled so the job can't keep the worker.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _executor
+    if pool is None:
+        return await asyncio.wait_for(
+            loop.run_in_executor(None, fn, *args),
+            timeout=settings.extraction_timeout_seconds,
+        )
+    job = pool.submit(fn, *args)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(job), timeout=settings.extraction_timeout_seconds)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a hostile file) - replace the pool for later calls
+        if _executor is pool:
+            shutdown_executor()
+            start_executor()
+        raise
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # wait_for already cancelled the job if it was still queued
+        if job.running() and _executor is pool:
+            _recycle_executor()
+        raise
+
+
+def _cache_key(sha256: str, file_type: FileType) -> str:
+    # Caps change the output, so they're part of the key
+    return (
+        f"extract:{sha256}:{file_type.value}:"
+        f"{settings.extraction_max_pages}:{settings.extraction_max_rows}:{settings.extraction_max_chars}:"
+        f"{settings.spreadsheet_sample_rows}:{settings.spreadsheet_max_sheet_chars}"
+    )
+
+
+def _page_cache_key(sha256: str, page: int) -> str:
+    return f"pdfpage:{sha256}:{page}"
+
+
+async def _cached(key: str | None) -> str | None:
+    return await cache_service.get(key) if key else None
+
+
+async def pdf_page_count(source: bytes | str, sha256: str | None = None) -> int:
+    key = f"pdfpages:{sha256}" if sha256 else None
+    if (cached := await _cached(key)) is not None:
+        return int(cached)
+    count = await run_in_pool(file_processor.pdf_page_count, source)
+    if key:
+        await cache_service.set(key, str(count), ttl=settings.extraction_cache_ttl_seconds)
+    return count
+
+
+async def iter_pdf_pages(
+    source: bytes | str, pages: int, sha256: str | None = None
+) -> AsyncGenerator[tuple[int, str], None]:
+    """Yield (page index, text) for the first `pages` pages, in order, as soon as each is ready.
+
+    Pages missing from the per-page cache are split into shards of contiguous
+    pages that extract in parallel across the pool, so a large PDF uses every
+    worker and its first pages are available before the last shard finishes.
+    Closing the generator cancels the shards still queued.
+    """
+    keys = [_page_cache_key(sha256, i) if sha256 else None for i in range(pages)]
+    cached = await asyncio.gather(*(_cached(k) for k in keys))
+    results = {i: text for i, text in enumerate(cached) if text is not None}
+    metrics.cache_result("pdf_page", bool(results))
+
+    shard_size = settings.extraction_pdf_shard_pages
+    shards: dict[asyncio.Future, int] = {}
+    start = 0
+    while start < pages:
+        if start in results:
+            start += 1
+            continue
+        end = start
+        while end < pages and end - start < shard_size and end not in results:
+            end += 1
+        shards[asyncio.ensure_future(run_in_pool(file_processor.extract_pdf_pages, source, start, end))] = start
+        start = end
+
+    pending = set(shards)
+    try:
+        for page in range(pages):
+            while page not in results:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for shard in done:
+                    first = shards[shard]
+                    for offset, text in enumerate(shard.result()):
+                        results[first + offset] = text
+                        if sha256:
+                            await cache_service.set(
+                                keys[first + offset], text, ttl=settings.extraction_cache_ttl_seconds
+                            )
+            yield page, results.pop(page)
+    finally:
+        for shard in pending:
+            shard.cancel()
+
+
+async def _extract_pdf(
+    source: bytes | str,
+    sha256: str | None,
+    progress: Callable[[int, int], Awaitable] | None = None,
+) -> str:
+    total = await pdf_page_count(source, sha256)
+    pages = min(total, settings.extraction_max_pages)
+    max_chars = settings.extraction_max_chars
+    parts: list[str] = []
+    chars = done = 0
+    note = None
+    page_iter = iter_pdf_pages(source, pages, sha256)
+    try:
+        async with asyncio.timeout(settings.extraction_timeout_seconds):
+            async for page, text in page_iter:
+                done = page + 1
+                if text:
+                    if chars + len(text) > max_chars:
+                        parts.append(text[: max_chars - chars])
+                        note = f"[Truncated: first {max_chars} characters]"
+                        break
+                    parts.append(text)
+                    chars += len(text)
+                if progress:
+                    await progress(done, pages)
+    except TimeoutError:
+        if not done:
+            raise
+        # Keep what finished in time; the rest is cached per page for the next attempt
+        note = f"[Truncated: extraction timed out after page {done} of {total}]"
+    finally:
+        await page_iter.aclose()
+
+    if note is None and total > pages:
+        note = f"[Truncated: first {pages} of {total} pages]"
+    if note:
+        parts.append(note)
+    return "\n\n".join(parts)
+
+
+async def extract(
+    source: bytes | str,
+    file_type: FileType,
+    sha256: str | None = None,
+    progress: Callable[[int, int], Awaitable] | None = None,
+) -> str | None:
+    """Extract text from a document (bytes or spooled file path) without blocking the event loop.
+
+    When the content hash is given, identical files are served from the cache.
+    PDFs report `progress(pages_done, pages_total)` as pages complete.
+    """
+    if file_type == FileType.image:
+        return None
+
+    if sha256:
+        cached = await cache_service.get(_cache_key(sha256, file_type))
+        metrics.cache_result("extraction", cached is not None)
+        if cached is not None:
+            return cached
+
+    try:
+        with metrics.timer(metrics.EXTRACTION_DURATION, file_type=file_type.value):
+            if file_type == FileType.pdf:
+                text = await _extract_pdf(source, sha256, progress)
+            else:
+                text = await run_in_pool(
+                    file_processor.extract_text,
+                    source,
+                    file_type,
+                    settings.extraction_max_pages,
+                    settings.extraction_max_rows,
+                    settings.spreadsheet_sample_rows,
+                    settings.spreadsheet_max_sheet_chars,
+                )
+    except asyncio.TimeoutError:
+        return f"[Error extracting text: timed out after {settings.extraction_timeout_seconds:g}s]"
+    except Exception as e:  # Includes BrokenProcessPool and unreadable PDFs
+        return f"[Error extracting text: {e}]"
+
+    # A timed-out PDF is partial; its finished pages are cached individually instead
+    complete = "[Truncated: extraction timed out" not in text if text else True
+    if sha256 and text is not None and not text.startswith("[Error extracting text") and complete:
+        await cache_service.set(
+            _cache_key(sha256, file_type), text, ttl=settings.extraction_cache_ttl_seconds
+        )
+    return text
+
+
+def _image_cache_key(sha256: str) -> str:
+    return (
+        f"image:{sha256}:{settings.image_max_long_side}:{settings.image_max_short_side}:"
+        f"{settings.image_low_detail_max_side}:{settings.image_format}:{settings.image_quality}"
+    )
+
+
+async def encode_image(source: bytes | str, sha256: str | None = None) -> tuple[str, str]:
+    """Normalize an image for the model without blocking the event loop.
+
+    Returns (data URL, detail). With the content hash, the normalized variant is
+    served from the cache.
+    """
+    if sha256:
+        cached = await cache_service.get(_image_cache_key(sha256))
+        metrics.cache_result("image", cached is not None)
+        if cached is not None:
+            detail, data_url = cached.split(" ", 1)
+            return data_url, detail
+
+    with metrics.timer(metrics.EXTRACTION_DURATION, file_type=FileType.image.value):
+        data_url, detail = await run_in_pool(
+            file_processor.normalize_image,
+            source,
+            settings.image_max_long_side,
+            settings.image_max_short_side,
+            settings.image_low_detail_max_side,
+            settings.image_format,
+            settings.image_quality,
+        )
+
+    if sha256:
+        await cache_service.set(
+            _image_cache_key(sha256), f"{detail} {data_url}", ttl=settings.extraction_cache_ttl_seconds
+        )
+    return data_url, detail
+
+
+async def run_all(*aws: Awaitable) -> list:
+    """Await jobs concurrently; if one fails (or we're cancelled), cancel the rest."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,87 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from app.services.token_counter import count_tokens
+
+
+class FakeStream:
+    """Async iterator of chunks shaped like the OpenAI SDK's streaming response."""
+
+    def __init__(self, pieces: list[str], usage, token_delay: float):
+        self._pieces = pieces
+        self._usage = usage
+        self._token_delay = token_delay
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for piece in self._pieces:
+            if self._token_delay:
+                await asyncio.sleep(self._token_delay)
+            delta = SimpleNamespace(content=piece, role="assistant")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage)
+
+    async def close(self):
+        pass
+
+
+class FakeProvider:
+    """In-process stand-in for an OpenAI-compatible API, for local runs and tests.
+
+    Replies echo the last user message. `ttft_seconds` delays the first token,
+    `error_rate` is the share of calls that fail with a 503.
+    """
+
+    def __init__(
+        self,
+        reply: str | None = None,
+        ttft_seconds: float = 0.0,
+        token_delay_seconds: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        self.reply = reply
+        self.ttft_seconds = ttft_seconds
+        self.token_delay_seconds = token_delay_seconds
+        self.error_rate = error_rate
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _reply_for(self, model: str, messages: list[dict]) -> str:
+        if self.reply is not None:
+            return self.reply
+        content = messages[-1]["content"] if messages else ""
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+        return f"[{model}] {content}"
+
+    async def _create(self, *, model: str, messages: list[dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.ttft_seconds)
+        if random.random() < self.error_rate:
+            request = httpx.Request("POST", "http://fake/v1/chat/completions")
+            raise openai.InternalServerError(
+                "Fake provider failure",
+                response=httpx.Response(503, request=request),
+                body=None,
+            )
+
+        text = self._reply_for(model, messages)
+        prompt_tokens = sum(count_tokens(str(m["content"])) for m in messages)
+        completion_tokens = count_tokens(text)
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        if stream:
+            pieces = [w + " " for w in text.split(" ")]
+            pieces[-1] = pieces[-1].rstrip(" ")
+            return FakeStream(pieces, usage, self.token_delay_seconds)
+        message = SimpleNamespace(content=text, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
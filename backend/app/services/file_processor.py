@@ -1,13 +1,14 @@
 import io
 import base64
 from pathlib import Path
+from typing import BinaryIO
 
 import pdfplumber
 from docx import Document
-import openpyxl
-from PIL import Image
+from PIL import Image, ImageOps
 
 from app.models.schemas import FileType
+from app.services import spreadsheet
 
 
 def detect_file_type(filename: str, content_type: str) -> FileType:
@@ -18,6 +19,8 @@ def detect_file_type(filename: str, content_type: str) -> FileType:
         return FileType.docx
     elif ext == ".xlsx":
         return FileType.xlsx
+    elif ext == ".csv":
+        return FileType.csv
     elif ext in (".png", ".jpg", ".jpeg", ".webp"):
         return FileType.image
     # Fallback on content_type
@@ -25,57 +28,140 @@ def detect_file_type(filename: str, content_type: str) -> FileType:
         return FileType.pdf
     elif "word" in content_type or "document" in content_type:
         return FileType.docx
+    elif "csv" in content_type:
+        return FileType.csv
     elif "sheet" in content_type or "excel" in content_type:
         return FileType.xlsx
     return FileType.image
 
 
-def extract_pdf_text(file_bytes: bytes) -> str:
+# Leading bytes of each accepted format (DOCX and XLSX are both ZIP containers)
+_MAGIC_BYTES = {
+    FileType.pdf: (b"%PDF-",),
+    FileType.docx: (b"PK\x03\x04",),
+    FileType.xlsx: (b"PK\x03\x04",),
+    FileType.image: (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"RIFF"),
+}
+
+
+def sniff_matches(file_type: FileType, head: bytes) -> bool:
+    """Check the first bytes of an upload against its declared type."""
+    if file_type == FileType.csv:
+        # Plain text has no signature; reject anything binary instead
+        known = tuple(m for magics in _MAGIC_BYTES.values() for m in magics)
+        return b"\x00" not in head and not head.startswith(known)
+    if not head.startswith(_MAGIC_BYTES[file_type]):
+        return False
+    if head.startswith(b"RIFF"):
+        return head[8:12] == b"WEBP"
+    return True
+
+
+def _open_source(source: bytes | str) -> BinaryIO | str:
+    """Extractors accept raw bytes or a path to a spooled upload."""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def extract_pdf_text(source: bytes | str, max_pages: int | None = None) -> str:
     text_parts = []
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
+    with pdfplumber.open(_open_source(source)) as pdf:
+        total_pages = len(pdf.pages)
+        for page in pdf.pages[:max_pages]:
             page_text = page.extract_text()
             if page_text:
                 text_parts.append(page_text)
+            page.close()  # Release cached layout objects as we go
+        if max_pages is not None and total_pages > max_pages:
+            text_parts.append(f"[Truncated: first {max_pages} of {total_pages} pages]")
     return "\n\n".join(text_parts)
 
 
-def extract_docx_text(file_bytes: bytes) -> str:
-    doc = Document(io.BytesIO(file_bytes))
+def pdf_page_count(source: bytes | str) -> int:
+    with pdfplumber.open(_open_source(source)) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages(source: bytes | str, start: int, end: int) -> list[str]:
+    """Text of pages [start, end), one entry per page; a shard of a parallel extraction."""
+    texts = []
+    with pdfplumber.open(_open_source(source)) as pdf:
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text() or "")
+            page.close()
+    return texts
+
+
+def extract_docx_text(source: bytes | str) -> str:
+    doc = Document(_open_source(source))
     return "\n\n".join(p.text for p in doc.paragraphs if p.text.strip())
 
 
-def extract_xlsx_text(file_bytes: bytes) -> str:
-    wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
-    text_parts = []
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-        rows = []
-        for row in ws.iter_rows(values_only=True):
-            cells = [str(c) if c is not None else "" for c in row]
-            rows.append(" | ".join(cells))
-        if rows:
-            text_parts.append(f"Sheet: {sheet_name}\n" + "\n".join(rows))
-    wb.close()
-    return "\n\n".join(text_parts)
+def _fit(width: int, height: int, max_long: int, max_short: int) -> tuple[int, int]:
+    """Largest size within both bounds, keeping the aspect ratio; never upscales."""
+    scale = min(1.0, max_long / max(width, height), max_short / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def normalize_image(
+    source: bytes | str,
+    max_long_side: int = 2048,
+    max_short_side: int = 768,
+    low_detail_max_side: int = 512,
+    image_format: str = "webp",
+    quality: int = 85,
+) -> tuple[str, str]:
+    """Resize and recompress an image for the vision model.
+
+    The model tiles high-detail images after fitting them in 2048px and scaling
+    the short side to 768px, so larger pixels are only upload cost. EXIF
+    orientation is applied, then all metadata is dropped. Returns the data URL
+    and the `detail` to request: "low" when the image is small enough that
+    high detail would add nothing.
+    """
+    img = Image.open(_open_source(source))
+    target = _fit(*img.size, max_long_side, max_short_side)
+    # Let the JPEG decoder downscale by DCT while decoding; much cheaper for phone photos
+    img.draft("RGB", target)
+    img = ImageOps.exif_transpose(img)
+    target = _fit(*img.size, max_long_side, max_short_side)
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.LANCZOS)
 
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if image_format == "webp":
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        mime, save_args = "image/webp", {"format": "WEBP", "quality": quality, "method": 4}
+    else:
+        if has_alpha:
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = img.convert("RGB")
+        mime, save_args = "image/jpeg", {"format": "JPEG", "quality": quality, "optimize": True}
 
-def image_to_base64(file_bytes: bytes, content_type: str) -> str:
-    # Validate it's a real image
-    img = Image.open(io.BytesIO(file_bytes))
-    img.verify()
-    b64 = base64.b64encode(file_bytes).decode("utf-8")
-    return f"data:{content_type};base64,{b64}"
+    buf = io.BytesIO()
+    img.save(buf, **save_args)  # Nothing from img.info is passed on, so EXIF/XMP/GPS are gone
+    detail = "low" if max(img.size) <= low_detail_max_side else "high"
+    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+    return f"data:{mime};base64,{b64}", detail
 
 
-def extract_text(file_bytes: bytes, file_type: FileType) -> str | None:
+def extract_text(
+    source: bytes | str,
+    file_type: FileType,
+    max_pages: int | None = None,
+    max_rows: int = 50_000,
+    sample_rows: int = 20,
+    max_sheet_chars: int = 8000,
+) -> str | None:
     try:
         if file_type == FileType.pdf:
-            return extract_pdf_text(file_bytes)
+            return extract_pdf_text(source, max_pages)
         elif file_type == FileType.docx:
-            return extract_docx_text(file_bytes)
-        elif file_type == FileType.xlsx:
-            return extract_xlsx_text(file_bytes)
+            return extract_docx_text(source)
+        elif file_type in (FileType.xlsx, FileType.csv):
+            return spreadsheet.summarize(source, file_type, max_rows, sample_rows, max_sheet_chars)
         return None  # Images don't have extracted text
     except Exception as e:
         return f"[Error extracting text: {e}]"
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from app.config import get_settings
+from app.models.schemas import FileType
+from app.services import extraction_service, mongo_service, retrieval_service
+from app.services.upload_service import IngestedFile
+
+settings = get_settings()
+
+# Files uploaded ahead of the message that uses them are stored at once and then
+# prepared in the background: text extracted and chunked into the retrieval
+# index, images normalized for the model. By the time the message is sent the
+# send path only links the prepared file to the conversation. Files that are
+# never sent are swept after `preupload_ttl_seconds`.
+
+_tasks: set[asyncio.Task] = set()
+_sweep_task: asyncio.Task | None = None
+
+
+class FileNotUsable(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def accept(upload: IngestedFile, conversation_id: str | None = None) -> str:
+    """Store an ingested upload and start preparing it; returns the file id.
+
+    Takes ownership of the spool file, which is removed once processing ends.
+    """
+    try:
+        [file_id] = await mongo_service.store_files(conversation_id, [{
+            "filename": upload.filename,
+            "content_type": upload.content_type,
+            "size": upload.size,
+            "file_type": upload.file_type.value,
+            "file_path": upload.path,
+            "sha256": upload.sha256,
+            "status": "processing",
+        }])
+    except BaseException:
+        upload.cleanup()
+        raise
+    task = asyncio.create_task(_process(file_id, upload, conversation_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return file_id
+
+
+async def _process(file_id: str, upload: IngestedFile, conversation_id: str | None):
+    try:
+        if upload.file_type == FileType.image:
+            url, detail = await extraction_service.encode_image(upload.path, upload.sha256)
+            fields = {"model_image": {"url": url, "detail": detail}}
+        else:
+            text = await extraction_service.extract(
+                upload.path, upload.file_type, upload.sha256, progress=_progress_reporter(file_id)
+            )
+            if text:
+                await retrieval_service.index_files(conversation_id, [(file_id, upload.filename, text)])
+            fields = {"extracted_text": text}
+        fields["status"] = "ready"
+    except Exception as e:
+        fields = {"status": "failed", "error": str(e) or type(e).__name__}
+    finally:
+        upload.cleanup()
+    await mongo_service.update_file(file_id, fields)
+
+
+def _progress_reporter(file_id: str):
+    """Record page progress on the file, at most a few times a second."""
+    last = 0.0
+
+    async def report(done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if now - last >= 0.5 or done == total:
+            last = now
+            await mongo_service.update_file(file_id, {"progress": {"pages_done": done, "pages_total": total}})
+
+    return report
+
+
+async def wait_ready(file_ids: list[str], conversation_id: str) -> list[dict]:
+    """Prepared files for a message, in the given order, waiting for any still processing.
+
+    Raises FileNotUsable for unknown, failed, foreign or (after the extraction
+    timeout) still unfinished files.
+    """
+    if not all(ObjectId.is_valid(i) for i in file_ids):
+        raise FileNotUsable(400, "Invalid file id")
+    deadline = time.monotonic() + settings.extraction_timeout_seconds
+    while True:
+        docs = {str(d["_id"]): d for d in await mongo_service.get_files(file_ids)}
+        missing = [i for i in file_ids if i not in docs]
+        if missing:
+            raise FileNotUsable(404, f"File {missing[0]} not found")
+        for doc in docs.values():
+            if doc.get("conversation_id") not in (None, conversation_id):
+                raise FileNotUsable(400, f"File {doc['filename']} belongs to another conversation")
+            if doc.get("status") == "failed":
+                raise FileNotUsable(422, f"File {doc['filename']} could not be processed: {doc.get('error')}")
+        if all(d.get("status", "ready") == "ready" for d in docs.values()):
+            return [docs[i] for i in file_ids]
+        if time.monotonic() >= deadline:
+            raise FileNotUsable(409, "Files are still being processed")
+        await asyncio.sleep(0.2)
+
+
+async def sweep_unattached() -> int:
+    """Delete pre-uploaded files that were never attached to a conversation in time."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.preupload_ttl_seconds)
+    return await mongo_service.delete_unattached_files(cutoff)
+
+
+async def _sweep_periodically():
+    while True:
+        await asyncio.sleep(settings.preupload_sweep_interval_seconds)
+        try:
+            await sweep_unattached()
+        except Exception:
+            pass  # Tried again on the next sweep
+
+
+def start_sweeper():
+    global _sweep_task
+    _sweep_task = asyncio.create_task(_sweep_periodically())
+
+
+async def drain(timeout: float = 30.0):
+    """Let in-flight processing finish on shutdown so files don't stay 'processing'."""
+    global _sweep_task
+    if _sweep_task:
+        _sweep_task.cancel()
+        _sweep_task = None
+    if not _tasks:
+        return
+    _, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
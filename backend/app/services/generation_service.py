@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
+
+from app.config import get_settings
+from app.services import redis_service, sse
+
+settings = get_settings()
+
+# Generations run as background tasks that append events to a log per message.
+# SSE requests are readers of that log, so a dropped connection neither stops
+# the answer nor loses it, and any number of viewers can follow along or resume
+# from their Last-Event-ID. The log lives in this process (serving the viewers
+# here without Redis round trips) and, when Redis is up, in a Redis Stream that
+# viewers on other workers read.
+
+_FINAL_EVENTS = ("done", "error")
+
+
+def _stream_key(message_id: str) -> str:
+    return f"generation:{message_id}"
+
+
+def _cancel_key(message_id: str) -> str:
+    return f"generation:{message_id}:cancel"
+
+
+class _Log:
+    """In-process event log with wakeups for waiting readers."""
+
+    def __init__(self):
+        self.events: list[tuple[int, str, str]] = []  # (seq, event, data)
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def append(self, seq: int, event: str, data: str):
+        self.events.append((seq, event, data))
+        self.finished = event in _FINAL_EVENTS
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class Generation:
+    """Handle a running generation uses to publish events and check for cancellation."""
+
+    def __init__(self, message_id: str):
+        self.message_id = message_id
+        self._seq = 0
+        self._log = _Log()
+        self._use_redis = True
+        self._cancelled = False
+        self._cancel_checked_at = 0.0
+
+    async def emit(self, event: str, payload: dict):
+        self._seq += 1
+        data = sse.dumps(payload)
+        self._log.append(self._seq, event, data)
+        if self._use_redis:
+            try:
+                await redis_service.stream_append(
+                    _stream_key(self.message_id),
+                    f"{self._seq}-0",
+                    {"event": event, "data": data},
+                    settings.generation_stream_ttl_seconds,
+                )
+            except Exception:
+                # Viewers on this worker still get everything; remote ones time out
+                self._use_redis = False
+
+    async def should_stop(self) -> bool:
+        """True once a cancel was requested, here or (checked at most once a second) via Redis."""
+        if self._cancelled:
+            return True
+        now = time.monotonic()
+        if now - self._cancel_checked_at >= 1.0:
+            self._cancel_checked_at = now
+            try:
+                self._cancelled = await redis_service.key_exists(_cancel_key(self.message_id))
+            except Exception:
+                pass
+        return self._cancelled
+
+
+_running: dict[str, Generation] = {}
+_logs: dict[str, _Log] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def start(generation: Generation, fn: Callable[..., Awaitable], *args) -> asyncio.Task:
+    """Run `fn(generation, *args)` in the background, independent of any request."""
+    message_id = generation.message_id
+    _running[message_id] = generation
+    _logs[message_id] = generation._log
+
+    async def run():
+        try:
+            await fn(generation, *args)
+        except Exception as e:
+            # Readers wait for a final event; never leave them hanging
+            if not generation._log.finished:
+                await generation.emit("error", {"error": str(e)})
+        finally:
+            _running.pop(message_id, None)
+            # Keep the local log a little longer for viewers that are just catching up
+            asyncio.get_running_loop().call_later(
+                settings.generation_local_retention_seconds, _logs.pop, message_id, None
+            )
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def cancel(message_id: str) -> bool:
+    """Ask a generation to stop (on any worker). Returns False if it is not running."""
+    generation = _running.get(message_id)
+    if generation:
+        generation._cancelled = True
+        return True
+    key = _stream_key(message_id)
+    try:
+        if not await redis_service.key_exists(key):
+            return False
+        await redis_service.cache_set(_cancel_key(message_id), "1", ttl=settings.generation_stream_ttl_seconds)
+    except Exception:
+        return False
+    return True
+
+
+async def exists(message_id: str) -> bool:
+    if message_id in _logs:
+        return True
+    try:
+        return await redis_service.key_exists(_stream_key(message_id))
+    except Exception:
+        return False
+
+
+def _sse(seq: int | str, event: str, data: str) -> dict:
+    return {"id": str(seq), "event": event, "data": data}
+
+
+async def _read_local(log: _Log, after: int) -> AsyncGenerator[dict, None]:
+    while True:
+        pending = log.events[after:]  # seq == index + 1
+        for seq, event, data in pending:
+            after = seq
+            yield _sse(seq, event, data)
+            if event in _FINAL_EVENTS:
+                return
+        if log.finished:
+            return
+        await log.wait()
+
+
+async def _read_redis(message_id: str, after: int) -> AsyncGenerator[dict, None]:
+    key = _stream_key(message_id)
+    last_id = f"{after}-0"
+    while True:
+        entries = await redis_service.stream_read(key, last_id, block_ms=5000)
+        if not entries:
+            if not await redis_service.key_exists(key):
+                yield _sse(last_id.split("-")[0], "error", sse.dumps({"error": "Generation expired"}))
+                return
+            continue
+        for entry_id, fields in entries:
+            last_id = entry_id
+            yield _sse(entry_id.split("-")[0], fields["event"], fields["data"])
+            if fields["event"] in _FINAL_EVENTS:
+                return
+
+
+def events(message_id: str, last_event_id: str | None = None) -> AsyncGenerator[dict, None]:
+    """SSE events of a generation after `last_event_id`, until it finishes."""
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    log = _logs.get(message_id)
+    if log is not None:
+        return _read_local(log, after)
+    return _read_redis(message_id, after)
+
+
+async def drain(timeout: float = 30.0):
+    """Let running generations finish (and persist) on shutdown, then cancel the rest."""
+    if not _tasks:
+        return
+    _, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
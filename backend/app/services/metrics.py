@@ -0,0 +1,87 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+
+# Buckets for sub-millisecond cache/DB calls up to slow model responses
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 20.0, 30.0, 60.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request duration, including streamed bodies",
+    ["method", "route"], buckets=_SLOW_BUCKETS,
+)
+ACTIVE_STREAMS = Gauge("chat_active_streams", "SSE chat streams currently open")
+TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_time_to_first_token_seconds", "Time from request to the first model token",
+    ["backend", "model"], buckets=_SLOW_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "chat_tokens_per_second", "Completion tokens per second after the first token",
+    ["backend", "model"], buckets=(5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 400),
+)
+EXTRACTION_DURATION = Histogram(
+    "extraction_duration_seconds", "Text extraction time per file, including pool wait",
+    ["file_type"], buckets=_SLOW_BUCKETS,
+)
+DB_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency",
+    ["command", "collection"], buckets=_FAST_BUCKETS,
+)
+REDIS_DURATION = Histogram(
+    "redis_operation_duration_seconds", "Redis operation latency",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"]
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    "upstream_queue_wait_seconds", "Wait for an upstream concurrency slot", buckets=_FAST_BUCKETS
+)
+UPSTREAM_IN_FLIGHT = Gauge("upstream_in_flight", "Upstream model calls in flight")
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    """Observe the duration of the block, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every MongoDB command the driver sends (register on the client)."""
+
+    def __init__(self):
+        self._collections: dict[int, tuple[str, str]] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):  # e.g. getMore carries a cursor id
+            collection = event.command.get("collection", "")
+        self._collections[event.request_id] = (event.command_name, str(collection))
+
+    def _finish(self, event):
+        command, collection = self._collections.pop(event.request_id, (event.command_name, ""))
+        DB_DURATION.labels(command=command, collection=collection).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+def render() -> tuple[bytes, str]:
+    """The exposition payload and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,209 @@
+import asyncio
+import statistics
+import time
+from collections import deque
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+
+from app.config import ModelBackend, get_settings
+from app.services import upstream
+from app.services.fake_provider import FakeProvider
+from app.services.token_counter import content_tokens
+
+settings = get_settings()
+
+
+class Backend:
+    """A routable model endpoint with rolling latency and error stats."""
+
+    def __init__(self, config: ModelBackend):
+        self.name = config.name
+        self.model = config.model
+        self.tier = config.tier
+        if config.provider == "fake":
+            self.api = FakeProvider(**config.options)
+        else:
+            self.api = upstream.get_client(config.base_url, config.api_key)
+        self.ttfts: deque[float] = deque(maxlen=settings.router_window)
+        self.outcomes: deque[bool] = deque(maxlen=settings.router_window)
+
+    def record(self, ok: bool):
+        self.outcomes.append(ok)
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def healthy(self) -> bool:
+        # A handful of samples before judging, so one blip doesn't demote a backend
+        return len(self.outcomes) < 5 or self.error_rate < settings.router_error_threshold
+
+    @property
+    def ttft_p50(self) -> float:
+        return statistics.median(self.ttfts) if self.ttfts else 0.0
+
+    def stats(self) -> dict:
+        ttfts = sorted(self.ttfts)
+        return {
+            "name": self.name,
+            "model": self.model,
+            "tier": self.tier,
+            "healthy": self.healthy,
+            "error_rate": round(self.error_rate, 4),
+            "ttft_p50_ms": round(self.ttft_p50 * 1000, 1),
+            "ttft_p95_ms": round(ttfts[int(len(ttfts) * 0.95)] * 1000, 1) if ttfts else 0.0,
+            "samples": len(self.outcomes),
+        }
+
+
+_backends: list[Backend] | None = None
+
+
+def backends() -> list[Backend]:
+    global _backends
+    if _backends is None:
+        configs = settings.model_backends or [
+            ModelBackend(name="openai", model=settings.openai_model, base_url=settings.openai_base_url),
+            ModelBackend(
+                name="openai-fast", model=settings.fast_model, tier="fast", base_url=settings.openai_base_url
+            ),
+        ]
+        _backends = [Backend(c) for c in configs]
+    return _backends
+
+
+def configure(configs: list[ModelBackend]):
+    """Replace the routing table (stats start over)."""
+    global _backends
+    _backends = [Backend(c) for c in configs]
+
+
+def is_simple(messages: list[dict]) -> bool:
+    """Short, text-only prompts that a fast model handles as well as the primary one."""
+    if not settings.fast_route_max_prompt_tokens:
+        return False
+    content = messages[-1]["content"]
+    if isinstance(content, list) and len(content) > 1:
+        return False  # Files or images attached
+    return sum(content_tokens(m["content"]) for m in messages) <= settings.fast_route_max_prompt_tokens
+
+
+def _preferred_tier(reason: str) -> str:
+    return "fast" if reason == "simple_prompt" else "primary"
+
+
+def cache_scope(messages: list[dict]) -> tuple[str, list[str]]:
+    """The tier `plan` prefers for these messages and the models it picks from there.
+
+    Answers are cached per scope, so a prompt routed to another tier or a
+    reconfigured routing table doesn't replay another model's answer.
+    """
+    tier = _preferred_tier("simple_prompt" if is_simple(messages) else "default")
+    return tier, sorted({b.model for b in backends() if b.tier == tier})
+
+
+def plan(messages: list[dict]) -> tuple[list[Backend], str]:
+    """Backends to try in order, and why the first tier was chosen.
+
+    The preferred tier comes first, then the other as a fallback. Within a tier
+    healthy backends lead, fastest recent time-to-first-token first.
+    """
+    reason = "simple_prompt" if is_simple(messages) else "default"
+    preferred = _preferred_tier(reason)
+    ordered = sorted(
+        backends(),
+        key=lambda b: (b.tier != preferred, not b.healthy, b.ttft_p50),
+    )
+    return ordered, reason
+
+
+def _decision(backend: Backend, reason: str, failovers: list[str]) -> dict:
+    return {
+        "backend": backend.name,
+        "model": backend.model,
+        "tier": backend.tier,
+        "reason": reason,
+        "failovers": failovers,
+    }
+
+
+async def stream(messages: list[dict], meta: dict, **params) -> AsyncGenerator:
+    """Stream chunks from the best available backend.
+
+    Until a backend produces its first chunk, errors and slow starts move on to
+    the next candidate; after that the stream is committed. The routing
+    decision is written to meta["route"].
+    """
+    candidates, reason = plan(messages)
+    failovers: list[str] = []
+    for i, backend in enumerate(candidates):
+        last = i == len(candidates) - 1
+        start = time.perf_counter()
+        chunks = upstream.stream(
+            api=backend.api,
+            model=backend.model,
+            messages=messages,
+            max_retries=None if last else 0,  # Fail over instead of retrying in place
+            **params,
+        )
+        async with aclosing(chunks):
+            try:
+                first = await asyncio.wait_for(
+                    anext(chunks, None), None if last else settings.router_first_token_timeout_seconds
+                )
+            except Exception:
+                backend.record(False)
+                if last:
+                    raise
+                failovers.append(backend.name)
+                continue
+
+            backend.ttfts.append(time.perf_counter() - start)
+            meta["route"] = _decision(backend, reason, failovers)
+            try:
+                if first is not None:
+                    yield first
+                    async for chunk in chunks:
+                        yield chunk
+            except Exception:
+                backend.record(False)
+                raise
+            backend.record(True)
+            return
+
+
+async def complete(messages: list[dict], meta: dict | None = None, tier: str | None = None, **params):
+    """A non-streamed completion from the best available backend, failing over on errors.
+
+    `tier` pins the preferred tier instead of judging the prompt.
+    """
+    candidates, reason = plan(messages)
+    if tier:
+        candidates.sort(key=lambda b: b.tier != tier)
+        reason = f"{tier}_requested"
+    failovers: list[str] = []
+    for i, backend in enumerate(candidates):
+        last = i == len(candidates) - 1
+        try:
+            response = await upstream.complete(
+                api=backend.api,
+                model=backend.model,
+                messages=messages,
+                max_retries=None if last else 0,
+                **params,
+            )
+        except Exception:
+            backend.record(False)
+            if last:
+                raise
+            failovers.append(backend.name)
+            continue
+        backend.record(True)
+        if meta is not None:
+            meta["route"] = _decision(backend, reason, failovers)
+        return response
+
+
+def stats() -> list[dict]:
+    return [b.stats() for b in backends()]
@@ -1,28 +1,55 @@
+import asyncio
+import base64
+
 import certifi
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from datetime import datetime, timezone
 from bson import ObjectId
 
 from app.config import get_settings
+from app.services import conversation_cache, metrics, storage_service
+from app.services.token_counter import count_tokens
 
 settings = get_settings()
 
 _client: AsyncIOMotorClient | None = None
 _db: AsyncIOMotorDatabase | None = None
+_flush_task: asyncio.Task | None = None
 
 
 async def connect_db():
-    global _client, _db
-    _client = AsyncIOMotorClient(settings.mongodb_uri, tlsCAFile=certifi.where())
+    global _client, _db, _flush_task
+    _client = AsyncIOMotorClient(
+        settings.mongodb_uri,
+        tlsCAFile=certifi.where(),
+        event_listeners=[metrics.MongoCommandListener()],
+    )
     _db = _client[settings.mongodb_db_name]
+    storage_service.init_storage(_db)
     # Create indexes
     await _db.conversations.create_index("created_at")
-    await _db.messages.create_index([("conversation_id", 1), ("created_at", 1)])
+    await _db.conversations.create_index([("updated_at", -1), ("_id", -1)])
+    await _db.messages.create_index([("conversation_id", 1), ("created_at", 1), ("_id", 1)])
+    await _db.message_buckets.create_index([("conversation_id", 1), ("seq", 1)], unique=True)
+    await _db.message_buckets.create_index("messages._id")
+    await _db.chunks.create_index([("conversation_id", 1), ("file_id", 1), ("index", 1)])
+    await _db.chunks.create_index("file_id")
+    await _db.usage_daily.create_index("day")
+    _flush_task = asyncio.create_task(_flush_periodically())
 
 
 async def close_db():
-    global _client
+    global _client, _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        _flush_task = None
     if _client:
+        try:
+            await flush_writes()
+        except Exception:
+            pass  # Nothing more we can do with the writes at shutdown
         _client.close()
 
 
@@ -42,6 +69,198 @@ async def ping_db() -> bool:
         return False
 
 
+# --- Write-behind buffer ---
+# Assistant messages and conversation counters are written in periodic batches
+# instead of costing round trips on the request path. Reads of a conversation
+# with pending writes flush first, so this worker always sees its own writes.
+#
+# Counter increments aren't idempotent, so each flush tags its updates with a
+# flush id that the updated document records: an update whose outcome is
+# unknown (a partly applied bulk write, a network error after the server
+# applied it) is resent unchanged, and skips documents that already have it.
+
+_pending_messages: list[dict] = []
+_pending_updates: dict[str, dict] = {}  # conversation_id -> {"$inc": {...}, "$max": {...}}
+_pending_usage: dict[str, dict] = {}  # "day:model" -> counters to $inc into usage_daily
+_pending_retries: list[tuple[str, UpdateOne]] = []  # (collection, tagged update) from failed flushes
+_flush_lock = asyncio.Lock()
+
+_FLUSH_MARKERS = 16  # Flush ids kept per document; a retry comes a tick or two later
+
+
+def _queue_conversation_update(conversation_id: str, inc: dict, updated_at: datetime | None = None):
+    update = _pending_updates.setdefault(conversation_id, {"$inc": {}, "$max": {}})
+    for field, n in inc.items():
+        update["$inc"][field] = update["$inc"].get(field, 0) + n
+    if updated_at:
+        current = update["$max"].get("updated_at")
+        update["$max"]["updated_at"] = max(current, updated_at) if current else updated_at
+
+
+def _queue_usage(day: str, model: str, inc: dict):
+    counters = _pending_usage.setdefault(f"{day}:{model}", {})
+    for field, n in inc.items():
+        counters[field] = counters.get(field, 0) + n
+
+
+async def _ensure_flushed(conversation_id: str):
+    if conversation_id in _pending_updates or _pending_retries or any(
+        m["conversation_id"] == conversation_id for m in _pending_messages
+    ):
+        await flush_writes()
+
+
+def _tagged(query: dict, update: dict, flush_id: ObjectId, upsert: bool = False) -> UpdateOne:
+    """`update` applied at most once per document: it records `flush_id` and skips documents that have it."""
+    return UpdateOne(
+        {**query, "flushes": {"$ne": flush_id}},
+        {**update, "$push": {"flushes": {"$each": [flush_id], "$slice": -_FLUSH_MARKERS}}},
+        upsert=upsert,
+    )
+
+
+async def _bulk_update(collection, ops: list[UpdateOne]):
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(err["code"] != 11000 for err in errors):
+            raise
+        # A tagged upsert raises a duplicate key error both when its document was
+        # created concurrently and when it was already applied; resending tells them apart
+        retry = [ops[err["index"]] for err in errors]
+        try:
+            await collection.bulk_write(retry, ordered=False)
+        except BulkWriteError as again:
+            if any(err["code"] != 11000 for err in again.details["writeErrors"]):
+                raise
+
+
+async def flush_writes():
+    """Write out buffered messages and counters; on failure they stay queued for the next flush."""
+    global _pending_messages, _pending_updates, _pending_usage, _pending_retries
+    async with _flush_lock:
+        messages, updates, usage, retries = _pending_messages, _pending_updates, _pending_usage, _pending_retries
+        _pending_messages, _pending_updates, _pending_usage, _pending_retries = [], {}, {}, []
+        if not messages and not updates and not usage and not retries:
+            return
+        db = get_db()
+        flush_id = ObjectId()
+        ops = retries + [
+            ("conversations", _tagged(
+                {"_id": ObjectId(cid)}, {op: fields for op, fields in update.items() if fields}, flush_id
+            ))
+            for cid, update in updates.items()
+        ] + [
+            ("usage_daily", _tagged(
+                {"_id": key},
+                {"$inc": inc, "$setOnInsert": dict(zip(("day", "model"), key.split(":", 1)))},
+                flush_id,
+                upsert=True,
+            ))
+            for key, inc in usage.items()
+        ]
+        try:
+            if messages and _bucketed():
+                # One at a time, in order, so a failure re-queues exactly the unwritten tail
+                while messages:
+                    await _push_message(db, messages[0])
+                    messages.pop(0)
+            elif messages:
+                try:
+                    await db.messages.insert_many(messages, ordered=False)
+                except BulkWriteError as e:
+                    # Duplicates are rows a previous, partially failed flush already wrote
+                    if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                        raise
+                messages = []
+            for name in ("conversations", "usage_daily"):
+                batch = [op for collection, op in ops if collection == name]
+                if batch:
+                    await _bulk_update(db[name], batch)
+                ops = [(collection, op) for collection, op in ops if collection != name]
+        except Exception:
+            _pending_messages[:0] = messages
+            _pending_retries[:0] = ops
+            raise
+
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(settings.write_behind_interval_seconds)
+        try:
+            await flush_writes()
+        except Exception:
+            pass  # Still queued; retried on the next tick
+
+
+# --- Keyset pagination ---
+# Pages are addressed by an opaque cursor over (sort field, _id) instead of an
+# offset, so every page is an index range scan no matter how deep it is.
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)  # BSON datetimes are UTC
+
+
+def _encode_cursor(doc: dict, field: str) -> str:
+    value = _utc(doc[field])
+    raw = f"{int(value.timestamp() * 1000)}:{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """Raises ValueError for cursors this module did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        millis, oid = raw.split(":")
+        return datetime.fromtimestamp(int(millis) / 1000, timezone.utc), ObjectId(oid)
+    except Exception:
+        raise ValueError("Invalid cursor") from None
+
+
+async def _keyset_page(
+    collection, query: dict, field: str, limit: int, before: str | None, after: str | None
+) -> dict:
+    """Up to `limit` documents newest-first by (field, _id), optionally before/after a cursor.
+
+    Returns {"items", "older_cursor", "newer_cursor", "has_older", "has_newer"}.
+    The cursors are returned even at either end so clients can poll for newer items.
+    """
+    if before and after:
+        raise ValueError("Pass either before or after, not both")
+    cursor = before or after
+    if cursor:
+        value, oid = _decode_cursor(cursor)
+        op = "$lt" if before else "$gt"
+        query = {**query, "$or": [{field: {op: value}}, {field: value, "_id": {op: oid}}]}
+
+    # Walk away from the cursor, then put the page back in newest-first order
+    direction = 1 if after else -1
+    docs = await (
+        collection.find(query)
+        .sort([(field, direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    return _page(docs, field, limit, before, after)
+
+
+def _page(docs: list[dict], field: str, limit: int, before: str | None, after: str | None) -> dict:
+    """Shape up to `limit` + 1 documents, walked away from the cursor, into a page."""
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if after:
+        docs.reverse()
+
+    return {
+        "items": docs,
+        "older_cursor": _encode_cursor(docs[-1], field) if docs else before,
+        "newer_cursor": _encode_cursor(docs[0], field) if docs else after,
+        "has_older": True if after else has_more,
+        "has_newer": has_more if after else bool(before),
+    }
+
+
 # --- Conversations ---
 
 async def create_conversation(title: str | None = None) -> dict:
@@ -55,20 +274,66 @@ async def create_conversation(title: str | None = None) -> dict:
     }
     result = await db.conversations.insert_one(doc)
     doc["_id"] = result.inserted_id
+    await conversation_cache.put(doc, [])
     return doc
 
 
 async def get_conversation(conversation_id: str) -> dict | None:
+    """Read-through: served from Redis when cached (see conversation_cache)."""
+    convo, _ = await conversation_cache.get(conversation_id)
+    if convo:
+        return convo
+    await _ensure_flushed(conversation_id)
     db = get_db()
-    return await db.conversations.find_one({"_id": ObjectId(conversation_id)})
-
+    convo = await db.conversations.find_one({"_id": ObjectId(conversation_id)})
+    if convo:
+        await conversation_cache.put(convo)
+    return convo
+
+
+async def get_conversation_with_history(conversation_id: str, limit: int) -> tuple[dict | None, list[dict]]:
+    """A conversation plus its newest `limit` messages after the rolling summary.
+
+    Served from the conversation cache when it holds both; otherwise both reads
+    are issued concurrently (one round trip of latency) and the cache is refilled.
+    """
+    convo, messages = await conversation_cache.get(conversation_id, limit)
+    if convo is None or messages is None:
+        await _ensure_flushed(conversation_id)
+        db = get_db()
+        fetch = max(limit, conversation_cache.recent_cap())
+        convo, messages = await asyncio.gather(
+            db.conversations.find_one({"_id": ObjectId(conversation_id)}),
+            _fetch_recent(db, conversation_id, fetch),
+        )
+        if not convo:
+            return None, []
+        await _backfill_token_counts(messages)
+        await conversation_cache.put(convo, messages)
+        messages = messages[-limit:]
+    summary_until = convo.get("summary_until")
+    if summary_until:
+        messages = [m for m in messages if m["created_at"] > summary_until]
+    return convo, messages
+
+
+async def list_conversations(
+    limit: int = 50,
+    before: str | None = None,
+    after: str | None = None,
+    exact_total: bool = False,
+) -> dict:
+    """A page of conversations, most recently updated first (see `_keyset_page`).
 
-async def list_conversations(skip: int = 0, limit: int = 50) -> tuple[list[dict], int]:
+    The total comes from collection metadata unless `exact_total` is set.
+    """
     db = get_db()
-    total = await db.conversations.count_documents({})
-    cursor = db.conversations.find().sort("updated_at", -1).skip(skip).limit(limit)
-    convos = await cursor.to_list(length=limit)
-    return convos, total
+    page, total = await asyncio.gather(
+        _keyset_page(db.conversations, {}, "updated_at", limit, before, after),
+        db.conversations.count_documents({}) if exact_total else db.conversations.estimated_document_count(),
+    )
+    page["total"] = total
+    return page
 
 
 async def update_conversation_title(conversation_id: str, title: str):
@@ -77,13 +342,46 @@ async def update_conversation_title(conversation_id: str, title: str):
         {"_id": ObjectId(conversation_id)},
         {"$set": {"title": title, "updated_at": datetime.now(timezone.utc)}},
     )
+    await conversation_cache.invalidate(conversation_id)
+
+
+async def update_conversation_summary(
+    conversation_id: str,
+    summary: str,
+    summary_until: datetime,
+    previous_until: datetime | None,
+) -> bool:
+    """Store a new rolling summary, unless another writer already advanced it."""
+    db = get_db()
+    result = await db.conversations.update_one(
+        {"_id": ObjectId(conversation_id), "summary_until": previous_until},
+        {"$set": {"summary": summary, "summary_until": summary_until}},
+    )
+    await conversation_cache.invalidate(conversation_id)
+    return result.modified_count == 1
 
 
 async def delete_conversation(conversation_id: str):
+    await _ensure_flushed(conversation_id)
     db = get_db()
     oid = ObjectId(conversation_id)
+    if _bucketed():
+        await db.message_buckets.delete_many({"conversation_id": oid})
+    # Also in buckets mode: the source copies of migrated messages may still be there
     await db.messages.delete_many({"conversation_id": str(oid)})
+
+    # Drop the conversation's files and release the blobs they reference
+    refs = await db.files.aggregate([
+        {"$match": {"conversation_id": str(oid), "sha256": {"$ne": None}}},
+        {"$group": {"_id": "$sha256", "n": {"$sum": 1}}},
+    ]).to_list(length=None)
+    if refs:
+        await _release_blobs({r["_id"]: r["n"] for r in refs})
+    await db.files.delete_many({"conversation_id": str(oid)})
+    await db.chunks.delete_many({"conversation_id": str(oid)})
+
     await db.conversations.delete_one({"_id": oid})
+    await conversation_cache.invalidate(conversation_id)
 
 
 # --- Messages ---
@@ -94,40 +392,378 @@ async def add_message(
     content: str,
     files: list[dict] | None = None,
     token_count: int = 0,
+    buffered: bool = False,
+    message_id: str | None = None,
+    usage: dict | None = None,
 ) -> dict:
-    db = get_db()
+    """Insert a message; the conversation's counters are updated write-behind.
+
+    With `buffered=True` the message itself is written write-behind as well;
+    until the next flush only this process sees it, so don't buffer anything
+    a client may read back right away (another worker would miss it).
+    `message_id` lets callers hand out the id before the message exists.
+    `usage` (model, prompt/completion tokens, timings) is stored on the message
+    and added to the daily usage counters.
+    """
     now = datetime.now(timezone.utc)
     doc = {
+        "_id": ObjectId(message_id) if message_id else ObjectId(),
         "conversation_id": conversation_id,
         "role": role,
         "content": content,
         "files": files or [],
         "token_count": token_count,
+        "content_tokens": count_tokens(content),
         "created_at": now,
     }
-    result = await db.messages.insert_one(doc)
-    doc["_id"] = result.inserted_id
-
-    # Update conversation
-    await db.conversations.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {"$inc": {"message_count": 1}, "$set": {"updated_at": now}},
-    )
+    if usage:
+        doc["usage"] = usage
+        _queue_usage(now.strftime("%Y-%m-%d"), usage.get("model") or "unknown", _usage_counters(usage, token_count))
+    if buffered:
+        _pending_messages.append(doc)
+        if len(_pending_messages) >= settings.write_behind_max_messages:
+            await flush_writes()
+    elif _bucketed():
+        # Buckets keep messages in the order they're appended, so buffered ones go first
+        if any(m["conversation_id"] == conversation_id for m in _pending_messages):
+            await flush_writes()
+        await _push_message(get_db(), doc)
+    else:
+        db = get_db()
+        await db.messages.insert_one(doc)
+
+    _queue_conversation_update(conversation_id, {"message_count": 1}, now)
+    await conversation_cache.update(conversation_id, {"message_count": 1}, now, doc)
     return doc
 
 
-async def get_messages(conversation_id: str, limit: int = 50) -> list[dict]:
+def _usage_counters(usage: dict, total_tokens: int) -> dict:
+    counters = {
+        "messages": 1,
+        "cached": int(bool(usage.get("cached"))),
+        "errors": int(bool(usage.get("error"))),
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "total_tokens": total_tokens,
+        "generation_ms_sum": usage.get("generation_ms") or 0,
+    }
+    if usage.get("ttft_ms") is not None:
+        counters["ttft_ms_sum"] = usage["ttft_ms"]
+        counters["ttft_count"] = 1
+    return counters
+
+
+async def get_message(message_id: str) -> dict | None:
+    """A single message, including one still waiting in the write-behind buffer."""
+    oid = ObjectId(message_id)
+    for doc in _pending_messages:
+        if doc["_id"] == oid:
+            return doc
+    db = get_db()
+    if _bucketed():
+        bucket = await db.message_buckets.find_one(
+            {"messages._id": oid}, {"conversation_id": 1, "messages": {"$elemMatch": {"_id": oid}}}
+        )
+        return _unbucket(bucket)[0] if bucket else None
+    return await db.messages.find_one({"_id": oid})
+
+
+async def get_messages(
+    conversation_id: str,
+    limit: int = 50,
+    before: str | None = None,
+    after: str | None = None,
+) -> dict:
+    """A page of messages in chronological order; the newest page without a cursor."""
+    await _ensure_flushed(conversation_id)
     db = get_db()
+    if _bucketed():
+        page = await _bucket_page(db, conversation_id, limit, before, after)
+    else:
+        page = await _keyset_page(
+            db.messages, {"conversation_id": conversation_id}, "created_at", limit, before, after
+        )
+    page["items"].reverse()
+    return page
+
+
+async def _backfill_token_counts(messages: list[dict]):
+    """Cache token counts on messages stored before they were recorded."""
+    backfill = []
+    for msg in messages:
+        if "content_tokens" not in msg:
+            msg["content_tokens"] = count_tokens(msg["content"])
+            if _bucketed():
+                backfill.append(UpdateOne(
+                    {"messages._id": msg["_id"]}, {"$set": {"messages.$.content_tokens": msg["content_tokens"]}}
+                ))
+            else:
+                backfill.append(
+                    UpdateOne({"_id": msg["_id"]}, {"$set": {"content_tokens": msg["content_tokens"]}})
+                )
+    if backfill:
+        db = get_db()
+        await (db.message_buckets if _bucketed() else db.messages).bulk_write(backfill, ordered=False)
+
+
+async def get_recent_messages(
+    conversation_id: str, limit: int, after: datetime | None = None
+) -> list[dict]:
+    """The newest `limit` messages (newer than `after`) in chronological order, with token counts cached."""
+    await _ensure_flushed(conversation_id)
+    messages = await _fetch_recent(get_db(), conversation_id, limit, after)
+    await _backfill_token_counts(messages)
+    return messages
+
+
+async def _fetch_recent(
+    db: AsyncIOMotorDatabase, conversation_id: str, limit: int, after: datetime | None = None
+) -> list[dict]:
+    """The newest `limit` messages (newer than `after`), oldest first."""
+    if _bucketed():
+        return await _recent_from_buckets(db, conversation_id, limit, after)
+    query = {"conversation_id": conversation_id}
+    if after:
+        query["created_at"] = {"$gt": after}
     cursor = (
-        db.messages.find({"conversation_id": conversation_id})
-        .sort("created_at", 1)
+        db.messages.find(query)
+        .sort([("created_at", -1), ("_id", -1)])
         .limit(limit)
     )
-    return await cursor.to_list(length=limit)
+    messages = await cursor.to_list(length=limit)
+    messages.reverse()
+    return messages
+
+
+async def get_messages_after(conversation_id: str, after: datetime | None) -> list[dict]:
+    """All messages newer than `after`, in chronological order."""
+    await _ensure_flushed(conversation_id)
+    db = get_db()
+    if _bucketed():
+        query = {"conversation_id": ObjectId(conversation_id)}
+        if after:
+            query["last_at"] = {"$gt": after}
+        buckets = await db.message_buckets.find(query, _HISTORY_PROJECTION).sort("seq", 1).to_list(length=None)
+        messages = [m for bucket in buckets for m in _unbucket(bucket) if not after or m["created_at"] > after]
+        return sorted(messages, key=_position)
+    query = {"conversation_id": conversation_id}
+    if after:
+        query["created_at"] = {"$gt": after}
+    cursor = db.messages.find(query).sort([("created_at", 1), ("_id", 1)])
+    return await cursor.to_list(length=None)
+
+
+# --- Message buckets ---
+# With `message_storage = "buckets"` a conversation's messages are stored in
+# `message_buckets` documents of up to `message_bucket_size` messages, keyed by
+# the conversation's ObjectId and a sequence number. Recent history is then one
+# or two document reads instead of an index scan plus a fetch per message, and
+# deleting a conversation removes a handful of documents. Messages already
+# stored one per document are moved over by scripts/migrate_messages.py.
+
+# Prompts are built from role and content; attachments and usage stay behind
+_HISTORY_PROJECTION = {"messages.files": 0, "messages.usage": 0}
+
+
+def _bucketed() -> bool:
+    return settings.message_storage == "buckets"
+
+
+def _unbucket(bucket: dict) -> list[dict]:
+    conversation_id = str(bucket["conversation_id"])
+    return [{**msg, "conversation_id": conversation_id} for msg in bucket.get("messages", [])]
+
+
+def _position(msg: dict) -> tuple[datetime, ObjectId]:
+    return _utc(msg["created_at"]), msg["_id"]
+
+
+async def _push_message(db: AsyncIOMotorDatabase, doc: dict):
+    """Append a message to its conversation's newest bucket, starting the next one when it is full."""
+    conversation_id = ObjectId(doc["conversation_id"])
+    msg = {k: v for k, v in doc.items() if k != "conversation_id"}
+    while True:
+        result = await db.message_buckets.update_one(
+            # The $ne guard keeps a retried flush from appending a message twice
+            {
+                "conversation_id": conversation_id,
+                "count": {"$lt": settings.message_bucket_size},
+                "messages._id": {"$ne": doc["_id"]},
+            },
+            {
+                "$push": {"messages": msg},
+                "$inc": {"count": 1},
+                "$min": {"first_at": doc["created_at"]},
+                "$max": {"last_at": doc["created_at"]},
+            },
+        )
+        if result.matched_count:
+            return
+        newest = await db.message_buckets.find_one(
+            {"conversation_id": conversation_id},
+            {"seq": 1, "messages": {"$elemMatch": {"_id": doc["_id"]}}},
+            sort=[("seq", -1)],
+        )
+        if newest and newest.get("messages"):
+            return  # Already stored
+        try:
+            await db.message_buckets.insert_one({
+                "conversation_id": conversation_id,
+                "seq": newest["seq"] + 1 if newest else 0,
+                "count": 1,
+                "first_at": doc["created_at"],
+                "last_at": doc["created_at"],
+                "messages": [msg],
+            })
+            return
+        except DuplicateKeyError:
+            continue  # Another writer started that bucket first; append to it
+
+
+async def _recent_from_buckets(
+    db: AsyncIOMotorDatabase, conversation_id: str, limit: int, after: datetime | None
+) -> list[dict]:
+    query = {"conversation_id": ObjectId(conversation_id)}
+    if after:
+        query["last_at"] = {"$gt": after}
+    # Only the newest bucket is partly filled, so this is usually the only batch needed
+    cursor = db.message_buckets.find(query, _HISTORY_PROJECTION).sort("seq", -1).batch_size(
+        -(-limit // settings.message_bucket_size) + 1
+    )
+    messages = []
+    async for bucket in cursor:
+        messages[:0] = [m for m in _unbucket(bucket) if not after or m["created_at"] > after]
+        if len(messages) >= limit:
+            break
+    # Other workers' writes can land slightly out of order
+    messages.sort(key=_position)
+    return messages[-limit:]
+
+
+async def _bucket_page(
+    db: AsyncIOMotorDatabase, conversation_id: str, limit: int, before: str | None, after: str | None
+) -> dict:
+    """`_keyset_page` for bucketed messages: walks buckets away from the cursor until the page is full."""
+    if before and after:
+        raise ValueError("Pass either before or after, not both")
+    query = {"conversation_id": ObjectId(conversation_id)}
+    key = None
+    if before or after:
+        value, oid = _decode_cursor(before or after)
+        key = (value, oid)
+        query.update({"first_at": {"$lte": value}} if before else {"last_at": {"$gte": value}})
+
+    direction = 1 if after else -1
+    docs = []
+    cursor = db.message_buckets.find(query).sort("seq", direction).batch_size(
+        -(-(limit + 1) // settings.message_bucket_size) + 1
+    )
+    async for bucket in cursor:
+        docs.extend(
+            msg for msg in _unbucket(bucket)
+            if key is None or (_position(msg) < key if before else _position(msg) > key)
+        )
+        if len(docs) > limit:
+            break
+    docs.sort(key=_position, reverse=not after)
+    return _page(docs[: limit + 1], "created_at", limit, before, after)
 
 
 # --- Files ---
 
+async def _retain_blobs(blobs: dict[str, tuple[str, int, int]]):
+    """Store bytes once per content hash; repeat uploads only bump the ref count.
+
+    `blobs` maps sha256 -> (spool path, size, references to add).
+    """
+    db = get_db()
+    existing = set(await db.blobs.distinct("_id", {"_id": {"$in": list(blobs)}}))
+    new = [sha for sha in blobs if sha not in existing]
+
+    # Write binaries first so a blob document never points at missing data
+    await asyncio.gather(*(storage_service.get_storage().put(sha, blobs[sha][0]) for sha in new))
+    if new:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.blobs.insert_many([
+                {
+                    "_id": sha,
+                    "size": blobs[sha][1],
+                    "storage": settings.storage_backend,
+                    "ref_count": blobs[sha][2],
+                    "created_at": now,
+                }
+                for sha in new
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Lost the race with a concurrent upload of the same file - count our references instead
+            existing.update(err["op"]["_id"] for err in e.details["writeErrors"] if err["code"] == 11000)
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+    existing = list(existing)
+    results = await asyncio.gather(*(
+        db.blobs.update_one({"_id": sha}, {"$inc": {"ref_count": blobs[sha][2]}}) for sha in existing
+    ))
+    # A blob released to zero and deleted since we looked is stored again
+    gone = {sha: blobs[sha] for sha, result in zip(existing, results) if not result.matched_count}
+    if gone:
+        await _retain_blobs(gone)
+
+
+async def _release_blobs(ref_counts: dict[str, int]):
+    db = get_db()
+    await db.blobs.bulk_write([
+        UpdateOne({"_id": sha}, {"$inc": {"ref_count": -n}}) for sha, n in ref_counts.items()
+    ])
+    # Claim each orphan atomically: a concurrent _retain_blobs either bumps the
+    # count first (the blob survives) or finds the document gone and stores it again
+    claimed = await asyncio.gather(*(
+        db.blobs.find_one_and_delete({"_id": sha, "ref_count": {"$lte": 0}}, {"_id": 1}) for sha in ref_counts
+    ))
+    for doc in claimed:
+        if doc:
+            await storage_service.get_storage().delete(doc["_id"])
+
+
+async def store_files(conversation_id: str | None, files: list[dict]) -> list[str]:
+    """Store metadata for a batch of uploads in one insert; returns their ids.
+
+    Each entry has filename, content_type, size, file_type and optionally
+    extracted_text, file_path, sha256 and status. `conversation_id` is None for
+    files uploaded ahead of the message that uses them.
+    """
+    if not files:
+        return []
+    db = get_db()
+    blobs: dict[str, tuple[str, int, int]] = {}
+    for f in files:
+        if f.get("file_path") and f.get("sha256"):
+            path, size, refs = blobs.get(f["sha256"], (f["file_path"], f["size"], 0))
+            blobs[f["sha256"]] = (path, size, refs + 1)
+    if blobs:
+        await _retain_blobs(blobs)
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for f in files:
+        doc = {
+            "conversation_id": conversation_id,
+            "filename": f["filename"],
+            "content_type": f["content_type"],
+            "size": f["size"],
+            "file_type": f["file_type"],
+            "extracted_text": f.get("extracted_text"),
+            "created_at": now,
+        }
+        if f.get("sha256") in blobs:
+            doc["sha256"] = f["sha256"]
+        if f.get("status"):
+            doc["status"] = f["status"]
+        docs.append(doc)
+    result = await db.files.insert_many(docs)
+    return [str(i) for i in result.inserted_ids]
+
+
 async def store_file_metadata(
     conversation_id: str,
     filename: str,
@@ -135,24 +771,199 @@ async def store_file_metadata(
     size: int,
     file_type: str,
     extracted_text: str | None = None,
-    file_data: bytes | None = None,
+    file_path: str | None = None,
+    sha256: str | None = None,
 ) -> str:
-    db = get_db()
-    doc = {
-        "conversation_id": conversation_id,
+    file_ids = await store_files(conversation_id, [{
         "filename": filename,
         "content_type": content_type,
         "size": size,
         "file_type": file_type,
         "extracted_text": extracted_text,
-        "created_at": datetime.now(timezone.utc),
-    }
-    if file_data:
-        doc["file_data"] = file_data
-    result = await db.files.insert_one(doc)
-    return str(result.inserted_id)
+        "file_path": file_path,
+        "sha256": sha256,
+    }])
+    return file_ids[0]
+
+
+# Everything a metadata lookup needs - never the binary or the full extracted text
+_FILE_METADATA_PROJECTION = {
+    "conversation_id": 1,
+    "filename": 1,
+    "content_type": 1,
+    "size": 1,
+    "file_type": 1,
+    "sha256": 1,
+    "status": 1,
+    "error": 1,
+    "progress": 1,
+    "created_at": 1,
+    "has_extracted_text": {"$gt": [{"$strLenCP": {"$ifNull": ["$extracted_text", ""]}}, 0]},
+}
 
 
 async def get_file(file_id: str) -> dict | None:
     db = get_db()
-    return await db.files.find_one({"_id": ObjectId(file_id)})
+    return await db.files.find_one({"_id": ObjectId(file_id)}, _FILE_METADATA_PROJECTION)
+
+
+async def get_files(file_ids: list[str]) -> list[dict]:
+    """Metadata of several files, plus the model-ready image of pre-uploaded ones."""
+    db = get_db()
+    cursor = db.files.find(
+        {"_id": {"$in": [ObjectId(i) for i in file_ids]}},
+        {field: 1 for field in _FILE_METADATA_PROJECTION if field != "has_extracted_text"} | {"model_image": 1},
+    )
+    return await cursor.to_list(length=None)
+
+
+async def update_file(file_id: str, fields: dict):
+    db = get_db()
+    await db.files.update_one({"_id": ObjectId(file_id)}, {"$set": fields})
+
+
+async def attach_files(conversation_id: str, file_ids: list[str]) -> int:
+    """Move pre-uploaded files and their chunks into a conversation; returns the chunks added."""
+    db = get_db()
+    await db.files.update_many(
+        {"_id": {"$in": [ObjectId(i) for i in file_ids]}, "conversation_id": None},
+        {"$set": {"conversation_id": conversation_id}},
+    )
+    result = await db.chunks.update_many(
+        {"file_id": {"$in": file_ids}, "conversation_id": None},
+        {"$set": {"conversation_id": conversation_id}},
+    )
+    if result.modified_count:
+        _queue_conversation_update(conversation_id, {"document_chunks": result.modified_count})
+        await conversation_cache.update(conversation_id, {"document_chunks": result.modified_count})
+    return result.modified_count
+
+
+async def delete_unattached_files(created_before: datetime) -> int:
+    """Delete files uploaded ahead of a message that never came, releasing their blobs."""
+    db = get_db()
+    query = {"conversation_id": None, "created_at": {"$lt": created_before}}
+    ids = await db.files.distinct("_id", query)
+    # Claim each file atomically so one being attached right now is left alone
+    claimed = [
+        doc for doc in await asyncio.gather(*(
+            db.files.find_one_and_delete({**query, "_id": oid}, {"sha256": 1}) for oid in ids
+        ))
+        if doc
+    ]
+    if not claimed:
+        return 0
+    refs: dict[str, int] = {}
+    for doc in claimed:
+        if doc.get("sha256"):
+            refs[doc["sha256"]] = refs.get(doc["sha256"], 0) + 1
+    if refs:
+        await _release_blobs(refs)
+    await db.chunks.delete_many({"conversation_id": None, "file_id": {"$in": [str(d["_id"]) for d in claimed]}})
+    return len(claimed)
+
+
+async def get_file_text(file_id: str) -> dict | None:
+    db = get_db()
+    return await db.files.find_one(
+        {"_id": ObjectId(file_id)}, {"filename": 1, "extracted_text": 1}
+    )
+
+
+async def get_inline_file_data(file_id: str) -> bytes | None:
+    """Bytes of files stored before blobs moved out of the `files` collection."""
+    db = get_db()
+    doc = await db.files.find_one({"_id": ObjectId(file_id)}, {"file_data": 1})
+    return doc.get("file_data") if doc else None
+
+
+# --- Document chunks (lexical retrieval index) ---
+
+async def store_chunks(conversation_id: str | None, chunks: list[dict]):
+    """Store chunk documents (each with file_id, filename and index) for a conversation.
+
+    Chunks of pre-uploaded files are stored without one until attach_files.
+    """
+    if not chunks:
+        return
+    db = get_db()
+    await db.chunks.insert_many([{"conversation_id": conversation_id, **chunk} for chunk in chunks])
+    if conversation_id is None:
+        return
+    _queue_conversation_update(conversation_id, {"document_chunks": len(chunks)})
+    await conversation_cache.update(conversation_id, {"document_chunks": len(chunks)})
+
+
+async def get_chunk_index(conversation_id: str) -> list[dict]:
+    """Term statistics for every chunk in a conversation - without the chunk text."""
+    db = get_db()
+    cursor = db.chunks.find({"conversation_id": conversation_id}, {"text": 0})
+    return await cursor.to_list(length=None)
+
+
+async def get_chunk_texts(chunk_ids: list[ObjectId]) -> dict[ObjectId, str]:
+    db = get_db()
+    cursor = db.chunks.find({"_id": {"$in": chunk_ids}}, {"text": 1})
+    return {doc["_id"]: doc["text"] async for doc in cursor}
+
+
+# --- Usage rollups ---
+# Per-conversation figures are aggregated from the messages on demand (an index
+# range over one conversation); per-day figures come from counters maintained
+# at write time, so reporting never scans the messages collection.
+
+
+async def get_conversation_usage(conversation_id: str) -> list[dict]:
+    """Usage of a conversation's assistant messages, one row per model."""
+    await _ensure_flushed(conversation_id)
+    db = get_db()
+    if _bucketed():
+        collection, stages = db.message_buckets, [
+            {"$match": {"conversation_id": ObjectId(conversation_id)}},
+            {"$unwind": "$messages"},
+            {"$replaceRoot": {"newRoot": "$messages"}},
+            {"$match": {"role": "assistant"}},
+        ]
+    else:
+        collection, stages = db.messages, [{"$match": {"conversation_id": conversation_id, "role": "assistant"}}]
+    cursor = collection.aggregate([
+        *stages,
+        {"$group": {
+            "_id": "$usage.model",
+            "messages": {"$sum": 1},
+            "cached": {"$sum": {"$cond": ["$usage.cached", 1, 0]}},
+            "errors": {"$sum": {"$cond": ["$usage.error", 1, 0]}},
+            "prompt_tokens": {"$sum": "$usage.prompt_tokens"},
+            "completion_tokens": {"$sum": "$usage.completion_tokens"},
+            "total_tokens": {"$sum": "$token_count"},
+            "avg_ttft_ms": {"$avg": "$usage.ttft_ms"},
+            "avg_generation_ms": {"$avg": "$usage.generation_ms"},
+        }},
+    ])
+    rows = [{**row, "model": row.pop("_id") or "unknown"} async for row in cursor]
+    return sorted(rows, key=lambda r: r["model"])
+
+
+async def get_daily_usage(since: str) -> list[dict]:
+    """Daily usage per model from `since` (YYYY-MM-DD) on, oldest first."""
+    if _pending_usage or _pending_retries:
+        await flush_writes()
+    db = get_db()
+    cursor = db.usage_daily.find({"day": {"$gte": since}}).sort([("day", 1), ("model", 1)])
+    rows = []
+    async for doc in cursor:
+        ttft_count = doc.get("ttft_count", 0)
+        messages = doc.get("messages", 0)
+        rows.append({
+            "day": doc["day"],
+            "model": doc["model"],
+            "messages": messages,
+            "cached": doc.get("cached", 0),
+            "errors": doc.get("errors", 0),
+            "prompt_tokens": doc.get("prompt_tokens", 0),
+            "completion_tokens": doc.get("completion_tokens", 0),
+            "total_tokens": doc.get("total_tokens", 0),
+            "avg_ttft_ms": doc.get("ttft_ms_sum", 0) / ttft_count if ttft_count else None,
+            "avg_generation_ms": doc.get("generation_ms_sum", 0) / messages if messages else None,
+        })
+    return rows
@@ -1,22 +1,29 @@
+import time
 from collections.abc import AsyncGenerator
-from openai import AsyncOpenAI
+from contextlib import aclosing
 
 from app.config import get_settings
 from app.models.schemas import FileType
-from app.services.file_processor import image_to_base64
+from app.services import metrics, model_router, response_cache, upstream
+from app.services.context_builder import pack_history
+from app.services.token_counter import MESSAGE_OVERHEAD_TOKENS, content_tokens
 
 settings = get_settings()
-client = AsyncOpenAI(api_key=settings.openai_api_key)
 
 SYSTEM_PROMPT = """You are a helpful AI assistant. You can discuss text, analyze documents, \
 describe images, and answer questions about uploaded files. Be concise, accurate, and helpful. \
 When analyzing files, reference specific content from them."""
 
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI \
+assistant. Merge the existing summary with the new messages into one updated summary. Keep facts, \
+decisions, names, numbers, file names and open questions; drop pleasantries. Write compact prose \
+or bullet points, with no preamble."""
+
 
 def _build_user_content(
     message: str,
     file_texts: list[tuple[str, str]] | None = None,
-    image_data: list[tuple[str, str]] | None = None,
+    image_data: list[tuple[str, str, str]] | None = None,
 ) -> list[dict]:
     """Build multimodal content array for OpenAI API."""
     content = []
@@ -31,10 +38,10 @@ def _build_user_content(
 
     # Add images
     if image_data:
-        for _filename, b64_data in image_data:
+        for _filename, data_url, detail in image_data:
             content.append({
                 "type": "image_url",
-                "image_url": {"url": b64_data, "detail": "auto"},
+                "image_url": {"url": data_url, "detail": detail},
             })
 
     # Add user message
@@ -46,17 +53,31 @@ def build_messages(
     conversation_history: list[dict],
     user_message: str,
     file_texts: list[tuple[str, str]] | None = None,
-    image_data: list[tuple[str, str]] | None = None,
+    image_data: list[tuple[str, str, str]] | None = None,
+    token_budget: int | None = None,
+    summary: str | None = None,
 ) -> list[dict]:
-    """Build the full messages array for OpenAI."""
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    """Build the full messages array for OpenAI, fitting history into the token budget.
 
-    # Add conversation history (last 20 messages for context window)
-    for msg in conversation_history[-20:]:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    A rolling summary of older turns, when there is one, stands in for the history it covers.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
 
     # Build current user message with files
     user_content = _build_user_content(user_message, file_texts, image_data)
+
+    # Add as much recent conversation history as the remaining budget allows
+    history_budget = (
+        (token_budget or settings.context_token_budget)
+        - sum(content_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        - content_tokens(user_content)
+        - MESSAGE_OVERHEAD_TOKENS
+    )
+    for msg in pack_history(conversation_history, history_budget):
+        messages.append({"role": msg["role"], "content": msg["content"]})
+
     messages.append({"role": "user", "content": user_content})
     return messages
 
@@ -65,50 +86,156 @@ async def chat_stream(
     conversation_history: list[dict],
     user_message: str,
     file_texts: list[tuple[str, str]] | None = None,
-    image_data: list[tuple[str, str]] | None = None,
+    image_data: list[tuple[str, str, str]] | None = None,
+    summary: str | None = None,
+    use_cache: bool = True,
+    meta: dict | None = None,
 ) -> AsyncGenerator[str, None]:
-    """Stream chat completion tokens."""
-    messages = build_messages(conversation_history, user_message, file_texts, image_data)
+    """Stream chat completion tokens.
 
-    stream = await client.chat.completions.create(
-        model=settings.openai_model,
-        messages=messages,
-        stream=True,
-        max_tokens=4096,
-        temperature=0.7,
+    Identical prompts are replayed from the response cache; otherwise the model
+    router picks the backend. Details about how the response was produced (cache
+    hit, routing decision, token usage) and the full text are written into `meta`
+    for the caller.
+    """
+    meta = meta if meta is not None else {}
+    messages = build_messages(
+        conversation_history, user_message, file_texts, image_data, summary=summary
     )
+    scope = model_router.cache_scope(messages)
+    cache_key = response_cache.cache_key(scope, messages)
+
+    start = time.perf_counter()
+    first_token_at = None
+    meta["cached"] = False
+    try:
+        if use_cache:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                meta["cached"] = True
+                meta["text"] = cached
+                async for piece in response_cache.replay(cached):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield piece
+                return
+        else:
+            response_cache.record_bypass()
+
+        requested_at = time.perf_counter()
+        stream = model_router.stream(
+            messages,
+            meta,
+            stream_options={"include_usage": True},
+            max_tokens=4096,
+            temperature=0.7,
+        )
+
+        parts = []
+        async with aclosing(stream):
+            async for chunk in stream:
+                # With include_usage the final chunk carries usage and no choices
+                if chunk.usage:
+                    meta["usage"] = {
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "completion_tokens": chunk.usage.completion_tokens,
+                        "total_tokens": chunk.usage.total_tokens,
+                    }
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(delta.content)
+                    yield delta.content
 
-    async for chunk in stream:
-        delta = chunk.choices[0].delta
-        if delta.content:
-            yield delta.content
+        route = meta.get("route") or {}
+        labels = {"backend": route.get("backend", ""), "model": route.get("model", "")}
+        if first_token_at is not None:
+            metrics.TIME_TO_FIRST_TOKEN.labels(**labels).observe(first_token_at - requested_at)
+            completion_tokens = meta.get("usage", {}).get("completion_tokens")
+            elapsed = time.perf_counter() - first_token_at
+            if completion_tokens and elapsed > 0:
+                metrics.TOKENS_PER_SECOND.labels(**labels).observe(completion_tokens / elapsed)
+
+        meta["text"] = "".join(parts)
+        if _in_scope(meta, scope):
+            await response_cache.put(cache_key, meta["text"])
+    finally:
+        # Also set when the stream is closed early, so cancelled answers keep their timings
+        _record_timings(meta, start, first_token_at)
+
+
+def _in_scope(meta: dict, scope: tuple[str, list[str]]) -> bool:
+    """Whether the answer came from the scope it is cached under (not a failover to the other tier)."""
+    return meta.get("route", {}).get("model") in scope[1]
+
+
+def _record_timings(meta: dict, start: float, first_token_at: float | None):
+    meta["generation_ms"] = round((time.perf_counter() - start) * 1000)
+    if first_token_at is not None:
+        meta["ttft_ms"] = round((first_token_at - start) * 1000)
 
 
 async def chat_complete(
     conversation_history: list[dict],
     user_message: str,
     file_texts: list[tuple[str, str]] | None = None,
-    image_data: list[tuple[str, str]] | None = None,
+    image_data: list[tuple[str, str, str]] | None = None,
+    summary: str | None = None,
+    use_cache: bool = True,
+    meta: dict | None = None,
 ) -> tuple[str, int]:
-    """Non-streaming chat completion. Returns (content, total_tokens)."""
-    messages = build_messages(conversation_history, user_message, file_texts, image_data)
+    """Non-streaming chat completion. Returns (content, total_tokens); cache hits cost 0 tokens.
+
+    As in chat_stream, the routing decision, usage and timings are written to `meta`.
+    """
+    meta = meta if meta is not None else {}
+    messages = build_messages(
+        conversation_history, user_message, file_texts, image_data, summary=summary
+    )
+    scope = model_router.cache_scope(messages)
+    cache_key = response_cache.cache_key(scope, messages)
 
-    response = await client.chat.completions.create(
-        model=settings.openai_model,
-        messages=messages,
+    start = time.perf_counter()
+    meta["cached"] = False
+    if use_cache:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            meta["cached"] = True
+            _record_timings(meta, start, None)
+            return cached, 0
+    else:
+        response_cache.record_bypass()
+
+    response = await model_router.complete(
+        messages,
+        meta,
         max_tokens=4096,
         temperature=0.7,
     )
 
+    _record_timings(meta, start, None)
     content = response.choices[0].message.content or ""
     total_tokens = response.usage.total_tokens if response.usage else 0
+    if response.usage:
+        meta["usage"] = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": total_tokens,
+        }
+    if _in_scope(meta, scope):
+        await response_cache.put(cache_key, content)
     return content, total_tokens
 
 
 async def generate_title(first_message: str) -> str:
     """Generate a short title for a conversation based on the first message."""
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
+    response = await upstream.hedged(
+        settings.title_hedge_delay_seconds,
+        model=settings.title_model,
+        timeout=settings.title_timeout_seconds,
         messages=[
             {"role": "system", "content": "Generate a short title (max 6 words) for a conversation that starts with the following message. Reply with only the title, no quotes."},
             {"role": "user", "content": first_message[:500]},
@@ -117,3 +244,21 @@ async def generate_title(first_message: str) -> str:
         temperature=0.5,
     )
     return response.choices[0].message.content or "New Chat"
+
+
+async def summarize(previous_summary: str | None, messages: list[dict]) -> str:
+    """Fold a batch of messages into the conversation's rolling summary."""
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    response = await upstream.complete(
+        model=settings.summary_model,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}",
+            },
+        ],
+        max_tokens=settings.summary_max_tokens,
+        temperature=0.2,
+    )
+    return response.choices[0].message.content or previous_summary or ""
@@ -1,17 +1,46 @@
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
 import redis.asyncio as redis
+from redis.commands.core import AsyncScript
 
 from app.config import get_settings
+from app.services import metrics
 
 settings = get_settings()
 
 _redis: redis.Redis | None = None
+_rate_limit_script: AsyncScript | None = None
+_scripts: dict[str, AsyncScript] = {}
+
+# Sliding-window log: drop entries older than the window, count, admit if under the limit.
+# One atomic round trip per check.
+_SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+if redis.call('ZCARD', key) >= limit then
+  return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('PEXPIRE', key, window)
+return 1
+"""
+
+_WINDOW_MS = 60_000
+_LOCAL_MAX_CLIENTS = 10_000
 
 
 async def connect_redis():
-    global _redis
+    global _redis, _rate_limit_script
     try:
         _redis = redis.from_url(settings.redis_url, decode_responses=True)
         await _redis.ping()
+        _rate_limit_script = _redis.register_script(_SLIDING_WINDOW_LUA)
     except Exception:
         _redis = None
 
@@ -20,6 +49,7 @@ async def close_redis():
     global _redis
     if _redis:
         await _redis.aclose()
+    _scripts.clear()
 
 
 async def ping_redis() -> bool:
@@ -31,30 +61,135 @@ async def ping_redis() -> bool:
         return False
 
 
+# --- Local fallback (used while Redis is unavailable) ---
+# Limits are per worker process rather than global, but they still hold.
+
+_local_buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # client -> (tokens, last refill)
+_local_usage: dict[tuple[str, str], int] = {}  # (client, day) -> tokens used
+
+
+def _local_rate_limit(client_ip: str) -> bool:
+    """Token bucket refilling `rate_limit_per_minute` tokens per minute."""
+    capacity = settings.rate_limit_per_minute
+    now = time.monotonic()
+    tokens, last = _local_buckets.pop(client_ip, (capacity, now))
+    tokens = min(capacity, tokens + (now - last) * capacity / 60)
+    allowed = tokens >= 1
+    _local_buckets[client_ip] = (tokens - 1 if allowed else tokens, now)
+    if len(_local_buckets) > _LOCAL_MAX_CLIENTS:
+        _local_buckets.popitem(last=False)  # Least recently seen client
+    return allowed
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%d")
+
+
+def _budget_key(client_id: str, day: str) -> str:
+    return f"budget:{client_id}:{day}"
+
+
 async def check_rate_limit(client_ip: str) -> bool:
     """Returns True if request is allowed, False if rate limited."""
+    if _redis is None or _rate_limit_script is None:
+        return _local_rate_limit(client_ip)
+    now_ms = int(time.time() * 1000)
+    try:
+        with metrics.timer(metrics.REDIS_DURATION, operation="rate_limit"):
+            allowed = await _rate_limit_script(
+                keys=[f"rate:{client_ip}"],
+                args=[now_ms, _WINDOW_MS, settings.rate_limit_per_minute, f"{now_ms}-{uuid.uuid4().hex[:8]}"],
+            )
+    except redis.RedisError:
+        return _local_rate_limit(client_ip)
+    return allowed == 1
+
+
+async def check_token_budget(client_id: str) -> bool:
+    """Returns True while the client is under its daily token budget."""
+    day = _today()
+    used = _local_usage.get((client_id, day), 0)
+    if _redis is not None:
+        try:
+            with metrics.timer(metrics.REDIS_DURATION, operation="token_budget"):
+                used = int(await _redis.get(_budget_key(client_id, day)) or 0)
+        except redis.RedisError:
+            pass
+    return used < settings.daily_token_budget
+
+
+async def record_token_usage(client_id: str, tokens: int):
+    """Debit actual model usage from the client's daily budget."""
+    if tokens <= 0:
+        return
+    day = _today()
+    for key in [k for k in _local_usage if k[1] != day]:
+        del _local_usage[key]
+    _local_usage[(client_id, day)] = _local_usage.get((client_id, day), 0) + tokens
     if _redis is None:
-        return True  # Skip rate limiting if Redis unavailable
-
-    key = f"rate:{client_ip}"
-    count = await _redis.get(key)
-    if count and int(count) >= settings.rate_limit_per_minute:
-        return False
-
-    pipe = _redis.pipeline()
-    pipe.incr(key)
-    pipe.expire(key, 60)
-    await pipe.execute()
-    return True
+        return
+    try:
+        pipe = _redis.pipeline()
+        pipe.incrby(_budget_key(client_id, day), tokens)
+        pipe.expire(_budget_key(client_id, day), 2 * 24 * 3600)
+        with metrics.timer(metrics.REDIS_DURATION, operation="record_usage"):
+            await pipe.execute()
+    except redis.RedisError:
+        pass
 
 
 async def cache_get(key: str) -> str | None:
     if _redis is None:
         return None
-    return await _redis.get(key)
+    with metrics.timer(metrics.REDIS_DURATION, operation="cache_get"):
+        return await _redis.get(key)
 
 
 async def cache_set(key: str, value: str, ttl: int = 300):
     if _redis is None:
         return
-    await _redis.set(key, value, ex=ttl)
+    with metrics.timer(metrics.REDIS_DURATION, operation="cache_set"):
+        await _redis.set(key, value, ex=ttl)
+
+
+async def cache_delete(*keys: str):
+    if _redis is None or not keys:
+        return
+    with metrics.timer(metrics.REDIS_DURATION, operation="cache_delete"):
+        await _redis.delete(*keys)
+
+
+async def run_script(source: str, keys: list[str], args: list):
+    """Run a Lua script atomically (EVALSHA, loading it on first use)."""
+    if _redis is None:
+        return None
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = _redis.register_script(source)
+    with metrics.timer(metrics.REDIS_DURATION, operation="script"):
+        return await script(keys=keys, args=args)
+
+
+async def stream_append(key: str, entry_id: str, fields: dict, ttl: int):
+    """XADD with an explicit id, refreshing the stream's expiry."""
+    if _redis is None:
+        return
+    pipe = _redis.pipeline(transaction=False)
+    pipe.xadd(key, fields, id=entry_id)
+    pipe.expire(key, ttl)
+    with metrics.timer(metrics.REDIS_DURATION, operation="stream_append"):
+        await pipe.execute()
+
+
+async def stream_read(key: str, after_id: str, block_ms: int, count: int = 200) -> list[tuple[str, dict]] | None:
+    """Entries after `after_id`, waiting up to `block_ms` for new ones; None without Redis."""
+    if _redis is None:
+        return None
+    result = await _redis.xread({key: after_id}, block=block_ms, count=count)
+    return result[0][1] if result else []
+
+
+async def key_exists(key: str) -> bool:
+    if _redis is None:
+        return False
+    return bool(await _redis.exists(key))
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import re
+from collections.abc import AsyncGenerator
+
+from app.config import get_settings
+from app.services import cache_service, metrics
+
+settings = get_settings()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Replay cached answers a few words per SSE event, like a live stream
+_REPLAY_RE = re.compile(r"(?:\S+\s*){1,4}|\s+")
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+
+def _normalize(value):
+    """Collapse insignificant whitespace so trivially different prompts share an entry."""
+    if isinstance(value, str):
+        return _WHITESPACE_RE.sub(" ", value).strip()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def cache_key(scope, messages: list[dict]) -> str:
+    """Key over the models that may answer (see model_router.cache_scope) and the fully built messages."""
+    payload = json.dumps([scope, _normalize(messages)], sort_keys=True, separators=(",", ":"))
+    return f"resp:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+async def get(key: str) -> str | None:
+    value = await cache_service.get(key)
+    _stats["hits" if value is not None else "misses"] += 1
+    metrics.cache_result("response", value is not None)
+    return value
+
+
+async def put(key: str, response: str):
+    if not response or len(response) > settings.response_cache_max_chars:
+        return
+    _stats["stores"] += 1
+    await cache_service.set(key, response, ttl=settings.response_cache_ttl_seconds)
+
+
+def record_bypass():
+    _stats["bypassed"] += 1
+
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else 0.0}
+
+
+async def replay(response: str) -> AsyncGenerator[str, None]:
+    for match in _REPLAY_RE.finditer(response):
+        yield match.group(0)
@@ -0,0 +1,151 @@
+import math
+import re
+from collections import Counter
+
+from app.config import get_settings
+from app.services import extraction_service, mongo_service
+from app.services.token_counter import count_tokens
+
+settings = get_settings()
+
+# BM25 parameters (standard defaults)
+_K1 = 1.5
+_B = 0.75
+
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its me my of on or "
+    "our so that the their them then there these they this to was we were what when where which "
+    "who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms for lexical matching, without stopwords."""
+    return [t for t in _WORD_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def build_chunks(text: str, chunk_tokens: int, overlap_tokens: int) -> list[dict]:
+    """Split text into ~chunk_tokens pieces on paragraph/word boundaries, with term stats.
+
+    CPU-bound, so it runs in the extraction pool.
+    """
+    words: list[tuple[str, int]] = []  # (word, tokens), with paragraph breaks kept as "\n\n"
+    for paragraph in re.split(r"\n\s*\n", text):
+        for word in paragraph.split():
+            words.append((word, count_tokens(word)))
+        words.append(("\n\n", 0))
+
+    chunks = []
+    start = 0
+    while start < len(words):
+        end, size = start, 0
+        while end < len(words) and (size < chunk_tokens or end == start):
+            size += words[end][1]
+            end += 1
+        chunk = " ".join(w for w, _ in words[start:end]).replace(" \n\n ", "\n\n").strip()
+        if chunk:
+            terms = tokenize(chunk)
+            chunks.append({
+                "text": chunk,
+                "tokens": size,
+                "length": len(terms),
+                "terms": dict(Counter(terms)),
+            })
+        if end >= len(words):
+            break
+        # Step back so consecutive chunks share ~overlap_tokens of context
+        back, overlap = end, 0
+        while back > start + 1 and overlap < overlap_tokens:
+            back -= 1
+            overlap += words[back][1]
+        start = back
+    return chunks
+
+
+async def index_files(conversation_id: str | None, files: list[tuple[str, str, str]]):
+    """Chunk (file_id, filename, text) entries in parallel and add them to the conversation's index."""
+    if not files:
+        return
+    results = await extraction_service.run_all(*(
+        extraction_service.run_in_pool(
+            build_chunks, text, settings.retrieval_chunk_tokens, settings.retrieval_chunk_overlap_tokens
+        )
+        for _, _, text in files
+    ))
+    await mongo_service.store_chunks(conversation_id, [
+        {"file_id": file_id, "filename": filename, "index": i, **chunk}
+        for (file_id, filename, _), chunks in zip(files, results)
+        for i, chunk in enumerate(chunks)
+    ])
+
+
+def _bm25_scores(chunks: list[dict], query_terms: list[str]) -> list[float]:
+    n = len(chunks)
+    avg_len = sum(c["length"] for c in chunks) / n or 1
+    df = Counter(t for c in chunks for t in set(query_terms) if t in c["terms"])
+    scores = []
+    for c in chunks:
+        score = 0.0
+        for term in query_terms:
+            tf = c["terms"].get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * c["length"] / avg_len))
+        scores.append(score)
+    return scores
+
+
+async def select_context(
+    conversation_id: str, query: str, new_file_ids: list[str]
+) -> list[tuple[str, str]]:
+    """File context for a prompt as (filename, text) pairs, within max_document_tokens.
+
+    Documents that fit the budget are included whole; otherwise the top-k chunks
+    by BM25 against the user's message are, preferring files just attached.
+    Without any match the opening of the newest document stands in.
+    """
+    chunks = await mongo_service.get_chunk_index(conversation_id)
+    if not chunks:
+        return []
+
+    budget = settings.max_document_tokens
+    if sum(c["tokens"] for c in chunks) <= budget:
+        selected = chunks
+    else:
+        new_files = set(new_file_ids)
+        scores = _bm25_scores(chunks, tokenize(query))
+        ranked = sorted(
+            zip(scores, chunks),
+            key=lambda sc: (sc[0], sc[1]["file_id"] in new_files, -sc[1]["index"]),
+            reverse=True,
+        )
+        if ranked[0][0] == 0:
+            # Nothing matched lexically (e.g. "summarize this") - lead with the opening of the
+            # files just attached or, on a follow-up turn, of the latest one (ids are ObjectIds)
+            lead = new_files or {max(c["file_id"] for c in chunks)}
+            ranked = [(0, c) for c in sorted(chunks, key=lambda c: c["index"]) if c["file_id"] in lead]
+        selected, used = [], 0
+        for _, chunk in ranked:
+            if len(selected) >= settings.retrieval_top_k:
+                break
+            if used + chunk["tokens"] > budget:
+                continue
+            selected.append(chunk)
+            used += chunk["tokens"]
+
+    texts = await mongo_service.get_chunk_texts([c["_id"] for c in selected])
+
+    # Reassemble excerpts per file in document order
+    by_file: dict[str, list[dict]] = {}
+    for chunk in sorted(selected, key=lambda c: (c["file_id"], c["index"])):
+        by_file.setdefault(chunk["file_id"], []).append(chunk)
+    context = []
+    for file_chunks in by_file.values():
+        text = texts[file_chunks[0]["_id"]]
+        for prev, chunk in zip(file_chunks, file_chunks[1:]):
+            gap = "\n" if chunk["index"] == prev["index"] + 1 else "\n[...]\n"
+            text += gap + texts[chunk["_id"]]
+        context.append((file_chunks[0]["filename"], text))
+    return context
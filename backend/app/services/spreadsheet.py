@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+from itertools import islice
+from pathlib import Path
+
+import openpyxl
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+from app.models.schemas import FileType
+
+# Spreadsheets reach the prompt as a compact summary - schema, per-column
+# statistics and a sample of rows - instead of every cell, so prompt size and
+# extraction time depend on the configured caps rather than on the sheet.
+# Specific rows are fetched on demand with lookup(). Everything here is
+# CPU-bound and runs in the extraction pool.
+
+FILTER_OPS = ("eq", "ne", "gt", "gte", "lt", "lte", "contains")
+
+_CSV_SNIFF_BYTES = 64 * 1024
+_MAX_CELL_CHARS = 60
+
+
+def _read_bytes(source: bytes | str) -> bytes:
+    return source if isinstance(source, bytes) else Path(source).read_bytes()
+
+
+def _column_names(header: tuple, width: int) -> tuple[list[str], bool]:
+    """Column names from the first row when it looks like a header (all text), else A, B, C..."""
+    cells = list(header) + [None] * (width - len(header))
+    is_header = any(c is not None for c in cells) and all(c is None or isinstance(c, str) for c in cells)
+    if not is_header:
+        return [get_column_letter(i + 1) for i in range(width)], False
+    names, seen = [], {}
+    for i, cell in enumerate(cells):
+        name = str(cell).strip() if cell is not None and str(cell).strip() else get_column_letter(i + 1)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names, True
+
+
+def _load_csv(source: bytes | str, max_rows: int) -> tuple[pd.DataFrame, int]:
+    data = _read_bytes(source)
+    sample = data[:_CSV_SNIFF_BYTES].decode("utf-8", errors="replace")
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+    frame = pd.read_csv(
+        io.BytesIO(data),
+        sep=sep,
+        nrows=max_rows,
+        encoding="utf-8",
+        encoding_errors="replace",
+        on_bad_lines="skip",
+    )
+    # Line count is exact unless quoted fields contain newlines
+    total = max(data.count(b"\n") + (not data.endswith(b"\n")) - 1, len(frame))
+    return frame, total
+
+
+def _load_worksheet(ws, max_rows: int) -> tuple[pd.DataFrame, int]:
+    rows = ws.iter_rows(values_only=True)
+    first = next(rows, None)
+    if first is None:
+        return pd.DataFrame(), 0
+    records = list(islice(rows, max_rows))
+    width = max([len(first)] + [len(r) for r in records])
+    names, is_header = _column_names(first, width)
+    if not is_header:
+        records = [first] + records[: max_rows - 1]
+    frame = pd.DataFrame.from_records(records, columns=names[: width] if records else names)
+    frame = frame.dropna(axis=0, how="all").dropna(axis=1, how="all").infer_objects()
+    # max_row comes from the sheet's dimension record, so it's known without reading every row
+    total = (ws.max_row or 0) - is_header
+    return frame, max(total, len(frame))
+
+
+def load_sheets(
+    source: bytes | str, file_type: FileType, max_rows: int, sheet: str | None = None
+) -> list[tuple[str, pd.DataFrame, int]]:
+    """(sheet name, first `max_rows` data rows, total data rows) per sheet, or just `sheet`."""
+    if file_type == FileType.csv:
+        frame, total = _load_csv(source, max_rows)
+        return [("csv", frame, total)]
+
+    src = io.BytesIO(source) if isinstance(source, bytes) else source
+    wb = openpyxl.load_workbook(src, read_only=True, data_only=True)
+    try:
+        if sheet is not None and sheet not in wb.sheetnames:
+            raise ValueError(f"Unknown sheet {sheet!r}; sheets are {', '.join(wb.sheetnames)}")
+        names = [sheet] if sheet is not None else wb.sheetnames
+        return [(name, *_load_worksheet(wb[name], max_rows)) for name in names]
+    finally:
+        wb.close()
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d") if value == value.normalize() else value.isoformat()
+    text = str(value)
+    return text if len(text) <= _MAX_CELL_CHARS else text[: _MAX_CELL_CHARS - 1] + "…"
+
+
+def _describe_column(column: pd.Series) -> str:
+    present = column.dropna()
+    if present.empty:
+        return "empty"
+    if pd.api.types.is_bool_dtype(present):
+        counts = present.value_counts()
+        desc = "boolean, " + ", ".join(f"{k}: {v}" for k, v in counts.items())
+    elif pd.api.types.is_numeric_dtype(present):
+        desc = f"number, min {_fmt(present.min())}, max {_fmt(present.max())}, mean {_fmt(float(present.mean()))}"
+    elif pd.api.types.is_datetime64_any_dtype(present):
+        desc = f"date, {_fmt(present.min())} to {_fmt(present.max())}"
+    else:
+        counts = present.astype(str).value_counts()
+        top = ", ".join(f"{_fmt(k)} ({v})" for k, v in counts.head(3).items())
+        desc = f"text, {counts.size} distinct; top: {top}"
+    missing = len(column) - len(present)
+    return f"{desc}; {missing} empty" if missing else desc
+
+
+def _sample(frame: pd.DataFrame, rows: int) -> pd.DataFrame:
+    """The first rows plus an even random spread of the rest, in sheet order."""
+    if len(frame) <= rows:
+        return frame
+    head = rows // 2
+    rest = frame.iloc[head:].sample(rows - head, random_state=0)
+    return pd.concat([frame.iloc[:head], rest.sort_index()])
+
+
+def summarize_sheet(name: str, frame: pd.DataFrame, total_rows: int, sample_rows: int, max_chars: int) -> str:
+    lines = [f"Sheet: {name} ({total_rows} rows x {frame.shape[1]} columns)"]
+    if frame.empty:
+        return lines[0] + "\n(empty)"
+    if total_rows > len(frame):
+        lines.append(f"[Statistics and samples cover the first {len(frame)} of {total_rows} rows]")
+    lines.append("Columns:")
+    lines.extend(f"- {col}: {_describe_column(frame[col])}" for col in frame.columns)
+
+    sample = _sample(frame, sample_rows)
+    lines.append(f"Sample rows ({len(sample)} of {total_rows}; row numbers from 1):")
+    lines.append(" | ".join(["row", *map(str, frame.columns)]))
+    for index, row in zip(sample.index, sample.itertuples(index=False)):
+        lines.append(" | ".join([str(index + 1), *("" if pd.isna(v) else _fmt(v) for v in row)]))
+
+    text = "\n".join(lines)
+    if len(text) > max_chars:
+        text = text[: text.rfind("\n", 0, max_chars)] + "\n[Truncated]"
+    return text
+
+
+def summarize(
+    source: bytes | str, file_type: FileType, max_rows: int, sample_rows: int, max_sheet_chars: int
+) -> str:
+    """Prompt-ready summary of every sheet (or the CSV)."""
+    return "\n\n".join(
+        summarize_sheet(name, frame, total, sample_rows, max_sheet_chars)
+        for name, frame, total in load_sheets(source, file_type, max_rows)
+    )
+
+
+def _coerce(column: pd.Series, value):
+    if pd.api.types.is_bool_dtype(column):
+        return str(value).lower() in ("true", "1", "yes") if isinstance(value, str) else bool(value)
+    if pd.api.types.is_numeric_dtype(column):
+        try:
+            return float(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{value!r} is not a number") from e
+    if pd.api.types.is_datetime64_any_dtype(column):
+        try:
+            return pd.Timestamp(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{value!r} is not a date") from e
+    return str(value)
+
+
+def lookup(
+    source: bytes | str,
+    file_type: FileType,
+    sheet: str | None,
+    filters: list[dict],
+    columns: list[str] | None,
+    limit: int,
+    max_rows: int,
+) -> dict:
+    """Rows matching all `filters` ({column, op, value}), vectorized over the sheet."""
+    name, frame, total = load_sheets(source, file_type, max_rows, sheet)[0]
+    unknown = [c for c in [f["column"] for f in filters] + (columns or []) if c not in frame.columns]
+    if unknown:
+        raise ValueError(f"Unknown column {unknown[0]!r}; columns are {', '.join(map(str, frame.columns))}")
+
+    mask = pd.Series(True, index=frame.index)
+    for f in filters:
+        column, op, value = frame[f["column"]], f["op"], f["value"]
+        if op == "contains":
+            mask &= column.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+            continue
+        value = _coerce(column, value)
+        if op == "eq":
+            mask &= column == value
+        elif op == "ne":
+            mask &= column != value
+        elif op == "gt":
+            mask &= column > value
+        elif op == "gte":
+            mask &= column >= value
+        elif op == "lt":
+            mask &= column < value
+        elif op == "lte":
+            mask &= column <= value
+        else:
+            raise ValueError(f"Unknown operator {op!r}; use one of {', '.join(FILTER_OPS)}")
+
+    matched = frame.loc[mask, columns] if columns else frame.loc[mask]
+    page = matched.head(limit)
+    return {
+        "sheet": name,
+        "columns": [str(c) for c in page.columns],
+        "rows": json.loads(page.to_json(orient="values", date_format="iso")),
+        "row_numbers": [int(i) + 1 for i in page.index],
+        "matched": int(mask.sum()),
+        "scanned_rows": len(frame),
+        "total_rows": total,
+    }
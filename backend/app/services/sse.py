@@ -0,0 +1,93 @@
+import asyncio
+import json
+from collections.abc import AsyncGenerator
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib encoder produces the same payloads
+    orjson = None
+
+_END = object()
+
+
+def dumps(payload) -> str:
+    """Compact JSON for SSE `data` fields."""
+    if orjson is not None:
+        return orjson.dumps(payload).decode()
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+async def coalesce(
+    source: AsyncGenerator[str, None], interval: float, max_bytes: int, buffer_size: int
+) -> AsyncGenerator[str, None]:
+    """Merge a token stream into fewer, larger frames.
+
+    The first token goes out at once, since time to first token is what users
+    notice. After that, tokens are held for up to `interval` seconds or until
+    `max_bytes` are pending. A separate task reads the source into a bounded
+    queue. A slow client therefore pauses upstream reads instead of growing a
+    buffer, and closing this generator cancels the source.
+    """
+    if interval <= 0:
+        try:
+            async for token in source:
+                yield token
+        finally:
+            await source.aclose()
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+
+    async def pump():
+        try:
+            async for token in source:
+                await queue.put(token)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await source.aclose()
+
+    reader = asyncio.create_task(pump())
+    pending: list[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            if pending:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    yield "".join(pending)
+                    pending.clear()
+                    size = 0
+                    continue
+            else:
+                item = await queue.get()
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                if pending:
+                    yield "".join(pending)
+                raise item
+            if first:
+                first = False
+                yield item
+                continue
+
+            if not pending:
+                deadline = loop.time() + interval
+            pending.append(item)
+            size += len(item.encode())
+            if size >= max_bytes:
+                yield "".join(pending)
+                pending.clear()
+                size = 0
+
+        if pending:
+            yield "".join(pending)
+    finally:
+        reader.cancel()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class GridFSStorage:
+    """File binaries as GridFS files, keyed by content hash."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self._files = db["file_data.files"]
+        self._bucket = AsyncIOMotorGridFSBucket(
+            db, bucket_name="file_data", chunk_size_bytes=settings.storage_chunk_size
+        )
+
+    async def exists(self, key: str) -> bool:
+        return await self._files.find_one({"_id": key}, {"_id": 1}) is not None
+
+    async def put(self, key: str, path: str):
+        """Upload a spooled file; GridFS reads it chunk by chunk."""
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            await self._bucket.upload_from_stream_with_id(key, key, f)
+        except DuplicateKeyError:
+            pass  # Same content already stored by a concurrent upload
+        finally:
+            f.close()
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        grid_out = await self._bucket.open_download_stream(key)
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(settings.storage_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    @asynccontextmanager
+    async def as_path(self, key: str) -> AsyncIterator[str]:
+        """The binary spooled to a temp file, for code that needs a path; removed afterwards."""
+        fd, path = tempfile.mkstemp(prefix="blob-", dir=settings.upload_spool_dir)
+        spool = os.fdopen(fd, "wb")
+        try:
+            grid_out = await self._bucket.open_download_stream(key)
+            while chunk := await grid_out.read(settings.storage_chunk_size):
+                await asyncio.to_thread(spool.write, chunk)
+            spool.close()
+            yield path
+        finally:
+            spool.close()
+            os.unlink(path)
+
+    async def delete(self, key: str):
+        try:
+            await self._bucket.delete(key)
+        except NoFile:
+            pass
+
+
+class LocalStorage:
+    """File binaries on local disk (or a mounted volume), keyed by content hash."""
+
+    def __init__(self, root: str):
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        # Fan out by hash prefix so a single directory doesn't grow unbounded
+        return self._root / key[:2] / key
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._path(key).exists)
+
+    async def put(self, key: str, path: str):
+        dest = self._path(key)
+
+        def write():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_suffix(f".{os.getpid()}.tmp")
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)  # Atomic, so readers never see a partial file
+
+        await asyncio.to_thread(write)
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(settings.storage_chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    @asynccontextmanager
+    async def as_path(self, key: str) -> AsyncIterator[str]:
+        """The stored file itself; blobs are replaced atomically, never modified in place."""
+        yield str(self._path(key))
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+
+
+_storage: GridFSStorage | LocalStorage | None = None
+
+
+def init_storage(db: AsyncIOMotorDatabase):
+    global _storage
+    if settings.storage_backend == "local":
+        _storage = LocalStorage(settings.storage_local_path)
+    else:
+        _storage = GridFSStorage(db)
+
+
+def get_storage() -> GridFSStorage | LocalStorage:
+    if _storage is None:
+        raise RuntimeError("Storage not initialised. Call init_storage() first.")
+    return _storage
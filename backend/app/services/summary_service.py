@@ -0,0 +1,50 @@
+import asyncio
+
+from app.config import get_settings
+from app.services import mongo_service, openai_service, task_queue
+from app.services.context_builder import pack_history
+from app.services.token_counter import message_tokens
+
+settings = get_settings()
+
+# Running summary tasks by conversation id (also keeps the tasks from being garbage collected)
+_running: dict[str, asyncio.Task] = {}
+
+
+def maybe_summarize(conversation_id: str, unsummarized: list[dict]):
+    """Schedule a background summary once the verbatim history outgrows the threshold.
+
+    `unsummarized` is the history the caller already has in hand, so the common
+    case costs no extra database reads.
+    """
+    if sum(message_tokens(m) for m in unsummarized) < settings.summary_trigger_tokens:
+        return
+    if conversation_id in _running:
+        return
+    task = task_queue.submit(summarize_conversation, conversation_id)
+    _running[conversation_id] = task
+    task.add_done_callback(lambda _: _running.pop(conversation_id, None))
+
+
+async def summarize_conversation(conversation_id: str):
+    """Fold everything but the newest turns into the conversation's rolling summary."""
+    convo = await mongo_service.get_conversation(conversation_id)
+    if not convo:
+        return
+    summary_until = convo.get("summary_until")
+    messages = await mongo_service.get_messages_after(conversation_id, summary_until)
+
+    keep = pack_history(messages, settings.summary_keep_recent_tokens)
+    to_fold = messages[: len(messages) - len(keep)]
+    if not to_fold:
+        return
+
+    summary = await openai_service.summarize(convo.get("summary"), to_fold)
+
+    # Only applies if no other worker moved the summary on in the meantime
+    await mongo_service.update_conversation_summary(
+        conversation_id,
+        summary=summary,
+        summary_until=to_fold[-1]["created_at"],
+        previous_until=summary_until,
+    )
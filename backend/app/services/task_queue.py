@@ -0,0 +1,52 @@
+import asyncio
+import random
+from collections.abc import Awaitable, Callable
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Bounds how many background jobs (titles, summaries, ...) talk to upstreams at once
+_semaphore = asyncio.Semaphore(settings.background_task_concurrency)
+_tasks: set[asyncio.Task] = set()
+
+
+async def _run_with_retry(fn: Callable[..., Awaitable], args: tuple, retries: int):
+    for attempt in range(retries + 1):
+        try:
+            async with _semaphore:
+                return await fn(*args)
+        except Exception:
+            if attempt == retries:
+                raise
+            # Exponential backoff with jitter
+            delay = settings.background_task_retry_base_seconds * 2**attempt
+            await asyncio.sleep(delay * (0.5 + random.random()))
+
+
+def _on_done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled():
+        task.exception()  # Mark as retrieved; failures are best-effort by design
+
+
+def submit(fn: Callable[..., Awaitable], *args, retries: int | None = None) -> asyncio.Task:
+    """Run `fn(*args)` in the background with bounded concurrency and retries.
+
+    The returned task can be awaited by callers that want the result.
+    """
+    if retries is None:
+        retries = settings.background_task_retries
+    task = asyncio.create_task(_run_with_retry(fn, args, retries))
+    _tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+async def drain(timeout: float = 10.0):
+    """Give in-flight jobs a chance to finish on shutdown, then cancel the rest."""
+    if not _tasks:
+        return
+    _, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
@@ -0,0 +1,60 @@
+from functools import lru_cache
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Per-message framing overhead in the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# What a single image costs at "high" detail for a typical upload, and at "low"
+IMAGE_TOKENS = 765
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """tiktoken encoding for the model, or None to fall back to the approximation."""
+    if settings.tokenizer != "tiktoken":
+        return None
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None  # BPE files not cached and no network to fetch them
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    if not text:
+        return 0
+    encoding = _encoding(model or settings.openai_model)
+    if encoding is None:
+        # ~4 characters per token for English prose
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: dict) -> int:
+    """Token count of a stored message, using the count cached on the document when present."""
+    tokens = message.get("content_tokens")
+    if tokens is None:
+        tokens = count_tokens(message.get("content", ""))
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def content_tokens(content: str | list[dict]) -> int:
+    """Token count of an OpenAI message content (plain string or multimodal parts)."""
+    if isinstance(content, str):
+        return count_tokens(content)
+    total = 0
+    for part in content:
+        if part["type"] == "text":
+            total += count_tokens(part["text"])
+        elif part["type"] == "image_url":
+            low = part["image_url"].get("detail") == "low"
+            total += LOW_DETAIL_IMAGE_TOKENS if low else IMAGE_TOKENS
+    return total
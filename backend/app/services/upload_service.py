@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from app.config import get_settings
+from app.models.schemas import FileType
+from app.services import file_processor
+
+settings = get_settings()
+
+# Enough leading bytes to recognise every supported format (WEBP needs 12)
+_SNIFF_BYTES = 16
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class IngestedFile:
+    """An upload spooled to a temp file, hashed and validated on the way in."""
+
+    filename: str
+    content_type: str
+    file_type: FileType
+    size: int
+    sha256: str
+    path: str
+
+    def cleanup(self):
+        Path(self.path).unlink(missing_ok=True)
+
+
+async def ingest(upload: UploadFile) -> IngestedFile:
+    """Stream an upload to a spool file in fixed-size chunks.
+
+    Size limit, content sniffing and hashing all happen chunk by chunk, so peak
+    memory is one chunk no matter how large the upload is.
+    """
+    filename = upload.filename or "upload"
+    content_type = upload.content_type or ""
+    ext = Path(filename).suffix.lower().lstrip(".")
+    if ext and ext not in settings.allowed_extensions:
+        raise UploadRejected(415, f"File type .{ext} is not supported")
+    file_type = file_processor.detect_file_type(filename, content_type)
+
+    max_bytes = settings.max_file_size_mb * 1024 * 1024
+    hasher = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=settings.upload_spool_dir)
+    spool = os.fdopen(fd, "wb")
+    try:
+        while chunk := await upload.read(settings.upload_chunk_size):
+            if size == 0 and not file_processor.sniff_matches(file_type, chunk[:_SNIFF_BYTES]):
+                raise UploadRejected(415, f"File {filename} does not look like a valid {file_type.value}")
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(413, f"File {filename} exceeds {settings.max_file_size_mb}MB limit")
+            hasher.update(chunk)
+            await asyncio.to_thread(spool.write, chunk)
+    except BaseException:
+        spool.close()
+        Path(path).unlink(missing_ok=True)
+        raise
+    spool.close()
+
+    return IngestedFile(
+        filename=filename,
+        content_type=content_type,
+        file_type=file_type,
+        size=size,
+        sha256=hasher.hexdigest(),
+        path=path,
+    )
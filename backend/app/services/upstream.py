@@ -0,0 +1,213 @@
+import asyncio
+import importlib.util
+import random
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from app.config import get_settings
+from app.services import metrics
+
+settings = get_settings()
+
+# HTTP/2 multiplexes concurrent streams over a few connections; it needs the h2 package
+_http2 = settings.upstream_http2 and importlib.util.find_spec("h2") is not None
+
+http_client = httpx.AsyncClient(
+    http2=_http2,
+    limits=httpx.Limits(
+        max_connections=settings.upstream_max_connections,
+        max_keepalive_connections=settings.upstream_max_keepalive,
+        keepalive_expiry=settings.upstream_keepalive_expiry_seconds,
+    ),
+    timeout=httpx.Timeout(
+        connect=settings.upstream_connect_timeout_seconds,
+        read=settings.upstream_read_timeout_seconds,
+        write=settings.upstream_write_timeout_seconds,
+        pool=settings.upstream_pool_timeout_seconds,
+    ),
+)
+_clients: dict[tuple[str | None, str], AsyncOpenAI] = {}
+
+
+def get_client(base_url: str | None = None, api_key: str | None = None) -> AsyncOpenAI:
+    """An OpenAI-compatible client for a base URL, sharing the connection pool."""
+    key = (base_url, api_key or settings.openai_api_key)
+    if key not in _clients:
+        # Retries happen in this module (max_retries=0) so they honor the concurrency limit
+        _clients[key] = AsyncOpenAI(
+            api_key=key[1], base_url=base_url, http_client=http_client, max_retries=0
+        )
+    return _clients[key]
+
+
+client = get_client(settings.openai_base_url)
+
+_semaphore = asyncio.Semaphore(settings.upstream_max_concurrency)
+_in_flight = 0
+_waiting = 0
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "errors": 0,
+    "queued": 0,  # Calls that had to wait for a free slot
+    "hedged": 0,
+    "hedge_wins": 0,
+    "acquired": 0,
+    "queue_wait_seconds": 0.0,
+    "max_queue_wait_seconds": 0.0,
+}
+
+
+@asynccontextmanager
+async def _slot():
+    """Hold one of the `upstream_max_concurrency` slots, recording how long the wait was."""
+    global _in_flight, _waiting
+    if _semaphore.locked():
+        _stats["queued"] += 1
+    start = time.perf_counter()
+    _waiting += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _waiting -= 1
+    wait = time.perf_counter() - start
+    metrics.UPSTREAM_QUEUE_WAIT.observe(wait)
+    _stats["acquired"] += 1
+    _stats["queue_wait_seconds"] += wait
+    _stats["max_queue_wait_seconds"] = max(_stats["max_queue_wait_seconds"], wait)
+    _in_flight += 1
+    metrics.UPSTREAM_IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+        _semaphore.release()
+
+
+def _retry_after(headers: httpx.Headers) -> float | None:
+    """Seconds the server asked us to wait, from retry-after-ms or Retry-After."""
+    if value := headers.get("retry-after-ms"):
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if value := headers.get("retry-after"):
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def _retry_delay(error: Exception, attempt: int) -> float | None:
+    """Seconds to wait before retrying after `error`, or None if it shouldn't be retried."""
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = _retry_after(error.response.headers)
+        if retry_after is not None:
+            # Retrying before the server's deadline only earns another 429
+            return max(retry_after, 0) if retry_after <= settings.upstream_retry_max_seconds else None
+    elif not isinstance(error, openai.APIConnectionError):  # Includes timeouts
+        return None
+    # Exponential backoff with jitter
+    delay = min(settings.upstream_retry_base_seconds * 2**attempt, settings.upstream_retry_max_seconds)
+    return delay * (0.5 + random.random())
+
+
+async def _create(api, max_retries: int | None, **kwargs):
+    if max_retries is None:
+        max_retries = settings.upstream_max_retries
+    for attempt in range(max_retries + 1):
+        _stats["requests"] += 1
+        try:
+            return await (api or client).chat.completions.create(**kwargs)
+        except Exception as e:
+            delay = _retry_delay(e, attempt) if attempt < max_retries else None
+            if delay is None:
+                _stats["errors"] += 1
+                raise
+            _stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+
+async def complete(*, api=None, max_retries: int | None = None, **kwargs):
+    """A chat completion through the shared pool, with retries on 429/5xx/connection errors.
+
+    `api` is the client to call (default: `client`); `max_retries` overrides the setting.
+    """
+    async with _slot():
+        return await _create(api, max_retries, **kwargs)
+
+
+async def stream(*, api=None, max_retries: int | None = None, **kwargs) -> AsyncGenerator:
+    """Streamed chat completion chunks; takes the same options as complete().
+
+    The slot is held until the stream is consumed or closed. Retries only cover
+    failures before the response starts; callers should close this generator
+    (e.g. with contextlib.aclosing) to release the connection early.
+    """
+    async with _slot():
+        response = await _create(api, max_retries, stream=True, **kwargs)
+        try:
+            async for chunk in response:
+                yield chunk
+        finally:
+            await response.close()
+
+
+async def hedged(delay: float, **kwargs):
+    """complete(), plus a backup request if the first hasn't answered after `delay` seconds.
+
+    Meant for short, idempotent calls where tail latency matters (e.g. titles).
+    No backup is sent while calls are queueing, so hedging never adds to overload.
+    """
+    first = asyncio.create_task(complete(**kwargs))
+    if delay <= 0:
+        return await first
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or _semaphore.locked():
+        return await first
+
+    _stats["hedged"] += 1
+    second = asyncio.create_task(complete(**kwargs))
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        _stats["hedge_wins"] += 1
+                    return task.result()
+        return first.result()  # Both failed: raise the original error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def stats() -> dict:
+    acquired = _stats["acquired"]
+    return {
+        "http2": _http2,
+        "in_flight": _in_flight,
+        "waiting": _waiting,
+        **{k: v for k, v in _stats.items() if not k.endswith("_seconds")},
+        "avg_queue_wait_ms": round(_stats["queue_wait_seconds"] / acquired * 1000, 2) if acquired else 0.0,
+        "max_queue_wait_ms": round(_stats["max_queue_wait_seconds"] * 1000, 2),
+    }
+
+
+async def close():
+    await http_client.aclose()
@@ -0,0 +1,97 @@
+"""OpenAI-compatible chat completions server with a configurable pace.
+
+Streams `reply_tokens` one-word tokens, the first after `ttft_ms`, then at
+`tokens_per_second`. Run standalone with:
+
+    python -m benchmarks.fake_openai --port 8100 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def create_app(ttft_ms: float, tokens_per_second: float, reply_tokens: int) -> Starlette:
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        words = [f"word{i} " for i in range(reply_tokens)]
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": reply_tokens,
+            "total_tokens": prompt_tokens + reply_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft_ms / 1000)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish_reason=None, with_usage=False) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if with_usage else [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            if with_usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(ttft_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+            for i, word in enumerate(words):
+                if i and interval:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": word})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, with_usage=True)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    args = parser.parse_args()
+    app = create_app(args.ttft_ms, args.tokens_per_second, args.reply_tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
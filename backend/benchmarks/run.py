@@ -0,0 +1,330 @@
+"""Load test the chat API and compare the results with checked-in baselines.
+
+Boots the fake OpenAI server and the app (with in-memory MongoDB and Redis) as
+subprocesses, drives concurrent SSE chat streams and file uploads against it,
+and reports throughput, time to first token, latency percentiles and the app's
+memory per concurrent stream. From the backend directory:
+
+    python -m benchmarks.run                      # run and compare with baselines.json
+    python -m benchmarks.run --scenario chat --concurrency 100
+    python -m benchmarks.run --save-baseline      # accept the current numbers
+
+Exits non-zero when a metric regresses by more than `--tolerance`. Numbers
+depend on the machine; refresh the baselines when the reference machine changes.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+BASELINES = Path(__file__).with_name("baselines.json")
+
+# Metrics where lower is better; all others (throughput) are higher-is-better
+_LOWER_IS_BETTER = ("ttft_ms", "latency_ms", "memory_per_stream_kb", "errors")
+
+# Per-scenario load settings, stored with each result; baselines only apply to the same load
+_RUN_CONFIG = ("requests", "concurrency")
+
+
+@dataclass
+class Scenario:
+    name: str
+    requests: int
+    concurrency: int
+    files: int = 0
+
+
+@dataclass
+class Sample:
+    ttft: float | None = None
+    latency: float = 0.0
+    error: str | None = None
+
+
+@dataclass
+class RssSampler:
+    pid: int
+    interval: float = 0.05
+    peak_kb: int = 0
+    _task: asyncio.Task | None = field(default=None, repr=False)
+
+    def read_kb(self) -> int:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    async def _sample(self):
+        while True:
+            self.peak_kb = max(self.peak_kb, self.read_kb())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak_kb = self.read_kb()
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self):
+        self._task.cancel()
+        self.peak_kb = max(self.peak_kb, self.read_kb())
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _spreadsheet(rows: int = 200) -> bytes:
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["id", "region", "units", "price"])
+    for i in range(rows):
+        ws.append([i, f"region-{i % 7}", i * 3 % 101, round(i * 1.37, 2)])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+async def _chat(client: httpx.AsyncClient, index: int, files: list[tuple[str, bytes, str]]) -> Sample:
+    sample = Sample()
+    start = time.perf_counter()
+    data = {"message": f"Benchmark question {index}: summarise the attached data."}
+    upload = [("files", (f"{i}-{name}", content, ctype)) for i, (name, content, ctype) in enumerate(files)]
+    try:
+        async with client.stream(
+            "POST", "/api/chat/send", data=data, files=upload or None,
+            # Every request must reach the model, not the response cache
+            headers={"Cache-Control": "no-cache"},
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                sample.error = f"HTTP {response.status_code}"
+                return sample
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                    if event == "token" and sample.ttft is None:
+                        sample.ttft = time.perf_counter() - start
+                    elif event == "error":
+                        sample.error = "error event"
+                    elif event == "done":
+                        break
+    except httpx.HTTPError as e:
+        sample.error = type(e).__name__
+    sample.latency = time.perf_counter() - start
+    return sample
+
+
+async def run_scenario(base_url: str, app_pid: int, scenario: Scenario) -> dict:
+    files = [("data.xlsx", _spreadsheet(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")]
+    files = files * scenario.files
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        # Warm up imports, pools and caches before measuring
+        await asyncio.gather(*(_chat(client, -i - 1, files) for i in range(min(scenario.concurrency, 5))))
+
+        sampler = RssSampler(app_pid)
+        idle_kb = sampler.read_kb()
+        semaphore = asyncio.Semaphore(scenario.concurrency)
+
+        async def one(i: int) -> Sample:
+            async with semaphore:
+                return await _chat(client, i, files)
+
+        sampler.start()
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(one(i) for i in range(scenario.requests)))
+        elapsed = time.perf_counter() - start
+        await sampler.stop()
+
+    ok = [s for s in samples if s.error is None]
+    ttfts = [s.ttft * 1000 for s in ok if s.ttft is not None]
+    latencies = [s.latency * 1000 for s in ok]
+    result = {
+        "requests": scenario.requests,
+        "concurrency": scenario.concurrency,
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 2),
+    }
+    for pct in (50, 95, 99):
+        result[f"ttft_ms_p{pct}"] = _round(_percentile(ttfts, pct))
+    for pct in (50, 95, 99):
+        result[f"latency_ms_p{pct}"] = _round(_percentile(latencies, pct))
+    if idle_kb:
+        result["rss_idle_mb"] = round(idle_kb / 1024, 1)
+        result["rss_peak_mb"] = round(sampler.peak_kb / 1024, 1)
+        result["memory_per_stream_kb"] = round(max(sampler.peak_kb - idle_kb, 0) / scenario.concurrency, 1)
+    return result
+
+
+def _round(value: float | None) -> float | None:
+    return None if value is None else round(value, 1)
+
+
+def comparable(result: dict, baseline: dict) -> bool:
+    """Whether a scenario ran with the same load (requests, concurrency) as its baseline."""
+    return all(result.get(key) == baseline.get(key) for key in _RUN_CONFIG)
+
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions of `results` against `baselines`.
+
+    Scenarios run with a different load than their baseline are skipped; their
+    throughput and latencies aren't comparable.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        baseline = baselines.get(name, {})
+        if not comparable(metrics, baseline):
+            continue
+        for metric, value in metrics.items():
+            base = baseline.get(metric)
+            if not isinstance(base, (int, float)) or not isinstance(value, (int, float)):
+                continue
+            if metric in _RUN_CONFIG or metric in ("rss_idle_mb", "rss_peak_mb"):
+                continue
+            if metric.startswith(_LOWER_IS_BETTER):
+                # Allow a small absolute slack so tiny baselines (e.g. 0 errors, 2ms) aren't flaky
+                if value > base * (1 + tolerance) + (0 if metric == "errors" else 5):
+                    regressions.append(f"{name}.{metric}: {value} > baseline {base}")
+            elif value < base * (1 - tolerance):
+                regressions.append(f"{name}.{metric}: {value} < baseline {base}")
+    return regressions
+
+
+async def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _spawn(module: str, args: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", module, *args], env=env, cwd=Path(__file__).parent.parent)
+
+
+async def main_async(args) -> int:
+    scenarios = {
+        "chat_stream": Scenario("chat_stream", args.requests, args.concurrency),
+        "chat_upload": Scenario("chat_upload", args.upload_requests, args.upload_concurrency, files=1),
+    }
+    if args.scenario != "all":
+        scenarios = {k: v for k, v in scenarios.items() if k.startswith(args.scenario)}
+
+    fake_port, app_port = _free_port(), _free_port()
+    storage = tempfile.TemporaryDirectory(prefix="bench-storage-")
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        "STORAGE_BACKEND": "local",
+        "STORAGE_LOCAL_PATH": storage.name,
+        "TOKENIZER": "approx",
+        "RATE_LIMIT_PER_MINUTE": "1000000000",
+        "DAILY_TOKEN_BUDGET": "1000000000000",
+    }
+    fake = _spawn("benchmarks.fake_openai", [
+        "--port", str(fake_port),
+        "--ttft-ms", str(args.ttft_ms),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--reply-tokens", str(args.reply_tokens),
+    ], env)
+    app = _spawn("benchmarks.serve", ["--port", str(app_port)], env)
+    try:
+        await _wait_ready(f"http://127.0.0.1:{fake_port}/", fake)
+        await _wait_ready(f"http://127.0.0.1:{app_port}/health", app)
+        results = {}
+        for name, scenario in scenarios.items():
+            results[name] = await run_scenario(f"http://127.0.0.1:{app_port}", app.pid, scenario)
+            print(f"{name}: {json.dumps(results[name])}")
+    finally:
+        for proc in (app, fake):
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        storage.cleanup()
+
+    config = {
+        "ttft_ms": args.ttft_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "reply_tokens": args.reply_tokens,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps({"config": config, "results": results}, indent=2) + "\n")
+    if args.save_baseline:
+        baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+        baselines["config"] = config
+        baselines.setdefault("results", {}).update(results)
+        BASELINES.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"Baselines written to {BASELINES}")
+        return 0
+    if BASELINES.exists():
+        baselines = json.loads(BASELINES.read_text())
+        if baselines.get("config") != config:
+            print("Fake server settings differ from the baselines'; skipping comparison")
+            return 0
+        for name, result in results.items():
+            baseline = baselines.get("results", {}).get(name, {})
+            if baseline and not comparable(result, baseline):
+                load = ", ".join(f"{key}={baseline.get(key)}" for key in _RUN_CONFIG)
+                print(f"{name}: baseline was measured with {load}; skipping comparison")
+        regressions = compare(results, baselines.get("results", {}), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["all", "chat_stream", "chat_upload"], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--upload-requests", type=int, default=40)
+    parser.add_argument("--upload-concurrency", type=int, default=10)
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baselines")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
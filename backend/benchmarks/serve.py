@@ -0,0 +1,44 @@
+"""Run `app.main:app` with in-memory stand-ins for MongoDB and Redis.
+
+mongomock-motor replaces the Motor client and fakeredis the Redis client, so a
+benchmark needs neither service. `--real-mongo` / `--real-redis` use MONGODB_URI
+and REDIS_URL instead. Model calls go to OPENAI_BASE_URL, normally the fake server.
+"""
+import argparse
+
+import uvicorn
+
+
+def install_stand_ins(mongo: bool, redis: bool):
+    """Patch the store clients; must run before the app's lifespan connects."""
+    if mongo:
+        from mongomock_motor import AsyncMongoMockClient
+
+        from app.services import mongo_service
+
+        mongo_service.AsyncIOMotorClient = AsyncMongoMockClient
+    if redis:
+        import fakeredis
+
+        from app.services import redis_service
+
+        server = fakeredis.FakeServer()
+        redis_service.redis.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--real-mongo", action="store_true", help="Use MONGODB_URI instead of mongomock")
+    parser.add_argument("--real-redis", action="store_true", help="Use REDIS_URL instead of fakeredis")
+    args = parser.parse_args()
+
+    install_stand_ins(mongo=not args.real_mongo, redis=not args.real_redis)
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Move messages stored one per document into per-conversation bucket documents.
+
+Merges each conversation's `messages` into its `message_buckets`: rows already
+in a bucket are skipped, and messages stored only in buckets (written after the
+switch) are kept, so it is safe to re-run at any time. From the backend
+directory, with the app's MongoDB settings:
+
+    python -m scripts.migrate_messages --dry-run   # count what would move
+    python -m scripts.migrate_messages             # build the buckets
+    # set MESSAGE_STORAGE=buckets and restart the app, then:
+    python -m scripts.migrate_messages             # pick up stragglers written before the restart
+    python -m scripts.migrate_messages --drop-source
+
+`--drop-source` only deletes messages that are already in a bucket, so it
+never loses one.
+"""
+import argparse
+import asyncio
+import time
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+from app.services import mongo_service
+from app.services.token_counter import count_tokens
+
+settings = get_settings()
+
+
+def build_buckets(conversation_id: ObjectId, messages: list[dict], size: int) -> list[dict]:
+    """Bucket documents for a conversation's messages (given oldest first)."""
+    buckets = []
+    for seq, start in enumerate(range(0, len(messages), size)):
+        chunk = [{k: v for k, v in m.items() if k != "conversation_id"} for m in messages[start : start + size]]
+        for msg in chunk:
+            if "content_tokens" not in msg:
+                msg["content_tokens"] = count_tokens(msg["content"])
+        buckets.append({
+            "conversation_id": conversation_id,
+            "seq": seq,
+            "count": len(chunk),
+            "first_at": chunk[0]["created_at"],
+            "last_at": max(m["created_at"] for m in chunk),
+            "messages": chunk,
+        })
+    return buckets
+
+
+async def migrate_conversation(db, conversation_id: str, size: int, dry_run: bool) -> tuple[int, int]:
+    """(messages, buckets) added for one conversation."""
+    oid = ObjectId(conversation_id)
+    stored = set(await db.message_buckets.distinct("messages._id", {"conversation_id": oid}))
+    messages = await (
+        db.messages.find({"conversation_id": conversation_id, "_id": {"$nin": list(stored)}})
+        .sort([("created_at", 1), ("_id", 1)])
+        .to_list(length=None)
+    )
+    if not messages or dry_run:
+        return len(messages), 0 if stored else len(build_buckets(oid, messages, size))
+
+    if not stored:
+        try:
+            buckets = build_buckets(oid, messages, size)
+            await db.message_buckets.insert_many(buckets, ordered=True)
+            return len(messages), len(buckets)
+        except BulkWriteError:
+            pass  # The app started a bucket meanwhile; merge message by message below
+
+    # Appending (as the app does) keeps every message already in the buckets
+    before = await db.message_buckets.count_documents({"conversation_id": oid})
+    for msg in messages:
+        msg.setdefault("content_tokens", count_tokens(msg["content"]))
+        await mongo_service._push_message(db, msg)
+    return len(messages), await db.message_buckets.count_documents({"conversation_id": oid}) - before
+
+
+async def drop_source(db, conversation_id: str) -> int:
+    """Delete a conversation's source messages that are stored in its buckets."""
+    stored = await db.message_buckets.distinct("messages._id", {"conversation_id": ObjectId(conversation_id)})
+    if not stored:
+        return 0
+    result = await db.messages.delete_many({"conversation_id": conversation_id, "_id": {"$in": stored}})
+    return result.deleted_count
+
+
+async def migrate(size: int, concurrency: int, dry_run: bool = False, drop: bool = False) -> dict:
+    db = mongo_service.get_db()
+    conversation_ids = [c for c in await db.messages.distinct("conversation_id") if ObjectId.is_valid(c)]
+    totals = {"conversations": 0, "messages": 0, "buckets": 0, "dropped": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(conversation_id: str):
+        async with semaphore:
+            if drop:
+                totals["dropped"] += await drop_source(db, conversation_id)
+            else:
+                messages, buckets = await migrate_conversation(db, conversation_id, size, dry_run)
+                totals["messages"] += messages
+                totals["buckets"] += buckets
+            totals["conversations"] += 1
+
+    await asyncio.gather(*(one(c) for c in conversation_ids))
+    return totals
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket-size", type=int, default=settings.message_bucket_size)
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations migrated at once")
+    parser.add_argument("--dry-run", action="store_true", help="Count messages and buckets without writing")
+    parser.add_argument("--drop-source", action="store_true", help="Delete migrated rows from `messages`")
+    args = parser.parse_args()
+
+    settings.message_bucket_size = args.bucket_size  # Used when appending to existing buckets
+    await mongo_service.connect_db()  # Also creates the bucket indexes
+    try:
+        start = time.perf_counter()
+        totals = await migrate(args.bucket_size, args.concurrency, args.dry_run, args.drop_source)
+        elapsed = time.perf_counter() - start
+        if args.drop_source:
+            print(f"Deleted {totals['dropped']} migrated messages from {totals['conversations']} conversations")
+        else:
+            verb = "Would write" if args.dry_run else "Wrote"
+            print(
+                f"{verb} {totals['messages']} messages ({totals['buckets']} new buckets) "
+                f"for {totals['conversations']} conversations in {elapsed:.1f}s"
+            )
+    finally:
+        await mongo_service.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
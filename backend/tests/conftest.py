@@ -0,0 +1,4 @@
+import os
+
+# Tests run offline: use the approximate tokenizer instead of fetching tiktoken's BPE files
+os.environ.setdefault("TOKENIZER", "approx")
@@ -0,0 +1,48 @@
+"""Tests for the benchmark harness's fake OpenAI server and baseline comparison."""
+import asyncio
+
+import httpx
+import openai
+
+from benchmarks import fake_openai, run
+
+
+def test_fake_server_speaks_the_openai_streaming_protocol():
+    app = fake_openai.create_app(ttft_ms=0, tokens_per_second=0, reply_tokens=5)
+
+    async def go():
+        http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://fake")
+        client = openai.AsyncOpenAI(api_key="x", base_url="http://fake/v1", http_client=http_client)
+        stream = await client.chat.completions.create(
+            model="m", messages=[{"role": "user", "content": "hi"}],
+            stream=True, stream_options={"include_usage": True},
+        )
+        text, usage = "", None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+        await http_client.aclose()
+        return text, usage
+
+    text, usage = asyncio.run(go())
+    assert text == "word0 word1 word2 word3 word4 "
+    assert usage.completion_tokens == 5
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    load = {"requests": 100, "concurrency": 10}
+    baseline = {"chat": {**load, "throughput_rps": 10.0, "ttft_ms_p95": 400.0, "errors": 0}}
+    assert run.compare({"chat": {**load, "throughput_rps": 9.0, "ttft_ms_p95": 450.0, "errors": 0}},
+                       baseline, 0.25) == []
+    regressions = run.compare({"chat": {**load, "throughput_rps": 7.0, "ttft_ms_p95": 600.0, "errors": 2}},
+                              baseline, 0.25)
+    assert [r.split(":")[0] for r in regressions] == ["chat.throughput_rps", "chat.ttft_ms_p95", "chat.errors"]
+
+
+def test_compare_skips_scenarios_run_with_a_different_load():
+    baseline = {"chat": {"requests": 200, "concurrency": 50, "throughput_rps": 7.0, "latency_ms_p50": 7000.0}}
+    results = {"chat": {"requests": 40, "concurrency": 5, "throughput_rps": 2.1, "latency_ms_p50": 2400.0}}
+    assert not run.comparable(results["chat"], baseline["chat"])
+    assert run.compare(results, baseline, 0.25) == []
@@ -0,0 +1,104 @@
+"""Tests for the chat API: inline uploads and background generation."""
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    from app.api import chat
+    from app.services import mongo_service
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongo_service, "_db", client["test"])
+    monkeypatch.setattr(mongo_service, "_pending_messages", [])
+    monkeypatch.setattr(mongo_service, "_pending_updates", {})
+    monkeypatch.setattr(mongo_service, "_pending_retries", [])
+    monkeypatch.setattr(mongo_service, "_pending_usage", {})
+    monkeypatch.setattr(chat.settings, "sse_coalesce_ms", 0)
+    return chat
+
+
+def _generate(chat, monkeypatch, pieces, fail=False):
+    from app.services import generation_service, mongo_service
+
+    async def chat_stream(meta, **kwargs):
+        meta["route"] = {"model": "big-model"}
+        for piece in pieces:
+            yield piece
+        if fail:
+            raise RuntimeError("upstream dropped")
+
+    monkeypatch.setattr(chat.openai_service, "chat_stream", chat_stream)
+
+    async def run():
+        convo = await mongo_service.create_conversation()
+        cid = str(convo["_id"])
+        user_msg = await mongo_service.add_message(cid, "user", "hi")
+        generation = generation_service.Generation("c" * 24)
+        events, stored_at_end = [], None
+
+        async def emit(event, payload):
+            nonlocal stored_at_end
+            if event in ("done", "error"):
+                stored_at_end = await mongo_service.get_db().messages.find_one({"role": "assistant"})
+            events.append(event)
+
+        generation.emit = emit
+        await chat._run_generation(
+            generation, "1.2.3.4", cid, convo, [], user_msg, "hi", [], [], None, True
+        )
+        return events, stored_at_end
+
+    return asyncio.run(run())
+
+
+def test_answer_is_stored_before_done(chat, monkeypatch):
+    events, stored = _generate(chat, monkeypatch, ["Hello", " there"])
+    assert events == ["token", "token", "done"]
+    assert stored["content"] == "Hello there"
+    assert stored["usage"]["model"] == "big-model"
+
+
+def test_partial_answer_of_a_failed_stream_is_stored_and_billed(chat, monkeypatch):
+    from app.services import mongo_service
+
+    billed = []
+
+    async def record_token_usage(client_id, tokens):
+        billed.append(tokens)
+
+    monkeypatch.setattr(chat.redis_service, "record_token_usage", record_token_usage)
+    events, stored = _generate(chat, monkeypatch, ["Hello", " there"], fail=True)
+    assert events == ["token", "token", "error"]
+    assert stored["content"] == "Hello there"
+    assert stored["usage"]["error"] and stored["usage"]["completion_tokens"] > 0
+    assert billed == [stored["usage"]["completion_tokens"]]
+
+    [row] = asyncio.run(mongo_service.get_daily_usage("2000-01-01"))
+    assert (row["model"], row["errors"]) == ("big-model", 1)
+
+
+def test_inline_image_failures_map_to_client_errors(chat, monkeypatch):
+    from fastapi import HTTPException
+    from PIL import UnidentifiedImageError
+
+    from app.models.schemas import FileType
+    from app.services.upload_service import IngestedFile
+
+    upload = IngestedFile(filename="pic.png", content_type="image/png", file_type=FileType.image,
+                          size=4, sha256="ab" * 32, path="/nonexistent")
+
+    def status(error):
+        async def encode_image(path, sha256):
+            raise error
+
+        monkeypatch.setattr(chat.extraction_service, "encode_image", encode_image)
+        with pytest.raises(HTTPException) as excinfo:
+            asyncio.run(chat._encode_image(upload))
+        assert excinfo.value.__cause__ is error
+        return excinfo.value.status_code
+
+    assert status(UnidentifiedImageError("cannot identify image file")) == 415
+    assert status(asyncio.TimeoutError()) == 422
@@ -0,0 +1,67 @@
+"""Tests for token-aware context assembly."""
+
+
+def _msg(role: str, content: str, tokens: int) -> dict:
+    return {"role": role, "content": content, "content_tokens": tokens}
+
+
+def test_pack_history_keeps_newest_within_budget():
+    from app.services.context_builder import pack_history
+    from app.services.token_counter import MESSAGE_OVERHEAD_TOKENS
+
+    history = [_msg("user", f"m{i}", 10) for i in range(10)]
+    packed = pack_history(history, 3 * (10 + MESSAGE_OVERHEAD_TOKENS))
+    assert [m["content"] for m in packed] == ["m7", "m8", "m9"]
+    assert pack_history(history, 5) == []
+
+
+def test_build_messages_respects_budget(monkeypatch):
+    from app.services import openai_service, token_counter
+
+    monkeypatch.setattr(token_counter.settings, "tokenizer", "approx")
+    token_counter._encoding.cache_clear()
+    history = [_msg("user" if i % 2 else "assistant", "x" * 400, 100) for i in range(50)]
+
+    messages = openai_service.build_messages(history, "hello", token_budget=1000)
+    assert messages[0]["role"] == "system"
+    assert messages[-1]["content"][-1] == {"type": "text", "text": "hello"}
+    # ~1000 tokens minus system prompt and new message leaves room for 8 history turns
+    assert len(messages) - 2 == 8
+    assert messages[-2]["content"] == history[-1]["content"]
+
+
+def test_summary_replaces_old_turns_in_prompt(monkeypatch):
+    from app.services import openai_service, token_counter
+
+    monkeypatch.setattr(token_counter.settings, "tokenizer", "approx")
+    token_counter._encoding.cache_clear()
+    messages = openai_service.build_messages(
+        [_msg("assistant", "recent answer", 3)], "next question", summary="User is planning a trip."
+    )
+    assert messages[1] == {
+        "role": "system",
+        "content": "Summary of the earlier conversation:\nUser is planning a trip.",
+    }
+    assert messages[2]["content"] == "recent answer"
+
+
+def test_maybe_summarize_only_past_threshold(monkeypatch):
+    import asyncio
+
+    from app.services import summary_service
+
+    scheduled = []
+
+    async def fake_summarize(conversation_id):
+        scheduled.append(conversation_id)
+
+    monkeypatch.setattr(summary_service, "summarize_conversation", fake_summarize)
+    monkeypatch.setattr(summary_service.settings, "summary_trigger_tokens", 100)
+
+    async def run():
+        summary_service.maybe_summarize("small", [_msg("user", "hi", 10)])
+        summary_service.maybe_summarize("big", [_msg("user", "long", 60), _msg("assistant", "long", 60)])
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert scheduled == ["big"]
@@ -0,0 +1,244 @@
+"""Tests for off-loop file extraction."""
+import asyncio
+import hashlib
+import io
+
+import openpyxl
+
+
+def _xlsx_bytes(rows: int) -> bytes:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for i in range(rows):
+        ws.append([i, f"row {i}"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def test_extract_respects_row_cap(monkeypatch):
+    from app.models.schemas import FileType
+    from app.services import extraction_service
+
+    monkeypatch.setattr(extraction_service.settings, "extraction_max_rows", 3)
+    text = asyncio.run(extraction_service.extract(_xlsx_bytes(10), FileType.xlsx))
+    assert "row 2" in text
+    assert "row 3" not in text
+    assert "cover the first 3 of 10 rows" in text
+
+
+def test_extract_in_process_pool():
+    from app.models.schemas import FileType
+    from app.services import extraction_service
+
+    async def run():
+        extraction_service.start_executor()
+        try:
+            return await extraction_service.run_all(
+                extraction_service.extract(_xlsx_bytes(2), FileType.xlsx),
+                extraction_service.extract(b"", FileType.image),
+            )
+        finally:
+            extraction_service.shutdown_executor()
+
+    text, image_text = asyncio.run(run())
+    assert "row 1" in text
+    assert image_text is None
+
+
+def test_extract_served_from_cache(monkeypatch):
+    from app.models.schemas import FileType
+    from app.services import cache_service, extraction_service
+
+    calls = []
+
+    def fake_extract_text(*args):
+        calls.append(args)
+        return "parsed"
+
+    monkeypatch.setattr(extraction_service.file_processor, "extract_text", fake_extract_text)
+    cache_service._local.clear()
+
+    async def run():
+        sha = hashlib.sha256(b"same bytes").hexdigest()
+        first = await extraction_service.extract(b"same bytes", FileType.docx, sha)
+        second = await extraction_service.extract(b"same bytes", FileType.docx, sha)
+        return first, second
+
+    assert asyncio.run(run()) == ("parsed", "parsed")
+    assert len(calls) == 1
+
+
+def test_lru_cache_evicts_by_size():
+    from app.services.cache_service import LRUCache
+
+    cache = LRUCache(max_bytes=10)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.get("a")
+    cache.set("c", "12345")
+    assert cache.get("a") == "12345"
+    assert cache.get("b") is None
+    assert cache.get("c") == "12345"
+
+
+def _decode_data_url(data_url: str):
+    import base64
+
+    from PIL import Image
+
+    header, b64 = data_url.split(",", 1)
+    return header, Image.open(io.BytesIO(base64.b64decode(b64)))
+
+
+def test_large_photo_is_downscaled_and_stripped():
+    from PIL import Image
+
+    from app.services import file_processor
+
+    photo = Image.new("RGB", (4000, 3000), (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees
+    exif[0x010F] = "PhoneCo"  # Make
+    buf = io.BytesIO()
+    photo.save(buf, format="JPEG", exif=exif.tobytes())
+
+    data_url, detail = file_processor.normalize_image(buf.getvalue())
+    header, img = _decode_data_url(data_url)
+    assert header == "data:image/webp;base64"
+    assert detail == "high"
+    # Orientation applied (portrait), short side at 768, no metadata left
+    assert img.size == (768, 1024)
+    assert not img.getexif()
+
+
+def test_small_image_keeps_alpha_and_uses_low_detail():
+    from PIL import Image
+
+    from app.services import file_processor
+
+    buf = io.BytesIO()
+    Image.new("RGBA", (300, 200), (0, 0, 255, 128)).save(buf, format="PNG")
+
+    data_url, detail = file_processor.normalize_image(buf.getvalue(), image_format="jpeg")
+    header, img = _decode_data_url(data_url)
+    assert (header, detail, img.size, img.mode) == ("data:image/jpeg;base64", "low", (300, 200), "RGB")
+
+
+def test_normalized_image_served_from_cache(monkeypatch):
+    from app.services import cache_service, extraction_service
+
+    calls = []
+
+    def fake_normalize(*args):
+        calls.append(args)
+        return "data:image/webp;base64,AAAA", "high"
+
+    monkeypatch.setattr(extraction_service.file_processor, "normalize_image", fake_normalize)
+    cache_service._local.clear()
+
+    async def run():
+        sha = hashlib.sha256(b"photo").hexdigest()
+        return [await extraction_service.encode_image(b"photo", sha) for _ in range(2)]
+
+    assert asyncio.run(run()) == [("data:image/webp;base64,AAAA", "high")] * 2
+    assert len(calls) == 1
+
+
+def _pdf_bytes(pages: int) -> bytes:
+    """Minimal PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", "", "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        text = f"BT /F1 12 Tf 72 720 Td (Page {p + 1} text) Tj ET"
+        objects.append(f"<< /Length {len(text)} >>\nstream\n{text}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def test_pdf_pages_extract_in_shards_and_are_cached_per_page(monkeypatch):
+    from app.models.schemas import FileType
+    from app.services import cache_service, extraction_service, file_processor
+
+    monkeypatch.setattr(extraction_service.settings, "extraction_pdf_shard_pages", 2)
+    cache_service._local.clear()
+    shards = []
+    real_extract = file_processor.extract_pdf_pages
+
+    def tracking_extract(source, start, end):
+        shards.append((start, end))
+        return real_extract(source, start, end)
+
+    monkeypatch.setattr(extraction_service.file_processor, "extract_pdf_pages", tracking_extract)
+    pdf = _pdf_bytes(5)
+    sha = hashlib.sha256(pdf).hexdigest()
+
+    async def run():
+        progress = []
+
+        async def report(done, total):
+            progress.append((done, total))
+
+        text = await extraction_service.extract(pdf, FileType.pdf, sha, progress=report)
+        # A lower page cap changes the document key, but every page is still cached
+        monkeypatch.setattr(extraction_service.settings, "extraction_max_pages", 3)
+        capped = await extraction_service.extract(pdf, FileType.pdf, sha)
+        return text, progress, capped
+
+    text, progress, capped = asyncio.run(run())
+    assert text == "\n\n".join(f"Page {i} text" for i in range(1, 6))
+    assert sorted(shards) == [(0, 2), (2, 4), (4, 5)]
+    assert progress == [(i, 5) for i in range(1, 6)]
+    assert capped.endswith("Page 3 text\n\n[Truncated: first 3 of 5 pages]")
+    assert len(shards) == 3
+
+
+def test_pdf_character_cap_stops_extraction(monkeypatch):
+    from app.models.schemas import FileType
+    from app.services import extraction_service
+
+    monkeypatch.setattr(extraction_service.settings, "extraction_max_chars", 15)
+    text = asyncio.run(extraction_service.extract(_pdf_bytes(4), FileType.pdf))
+    assert text == "Page 1 text\n\nPage\n\n[Truncated: first 15 characters]"
+
+
+def test_overrunning_job_does_not_hold_the_pool(monkeypatch):
+    import time
+
+    import pytest
+
+    from app.services import extraction_service
+
+    monkeypatch.setattr(extraction_service.settings, "extraction_workers", 1)
+    monkeypatch.setattr(extraction_service.settings, "extraction_timeout_seconds", 5.0)
+
+    async def run():
+        extraction_service.start_executor()
+        try:
+            await extraction_service.run_in_pool(abs, -1)  # Worker is up
+            monkeypatch.setattr(extraction_service.settings, "extraction_timeout_seconds", 0.5)
+            with pytest.raises(asyncio.TimeoutError):
+                await extraction_service.run_in_pool(time.sleep, 60)
+            # Without recycling, this would queue behind the sleeping worker and time out
+            monkeypatch.setattr(extraction_service.settings, "extraction_timeout_seconds", 10.0)
+            return await extraction_service.run_in_pool(abs, -3), len(extraction_service._retired)
+        finally:
+            extraction_service.shutdown_executor()
+
+    result, retired = asyncio.run(run())
+    assert result == 3
+    assert retired == 1
+    assert extraction_service._retired == []
@@ -0,0 +1,182 @@
+"""Tests for file storage and ranged downloads."""
+import asyncio
+
+
+def test_parse_range():
+    from app.api.files import _parse_range
+
+    assert _parse_range("bytes=0-9", 100) == (0, 9)
+    assert _parse_range("bytes=90-", 100) == (90, 99)
+    assert _parse_range("bytes=-10", 100) == (90, 99)
+    assert _parse_range("bytes=50-500", 100) == (50, 99)
+    assert _parse_range("bytes=100-", 100) is None
+    assert _parse_range("bytes=0-1,5-6", 100) is None
+    assert _parse_range("items=0-1", 100) is None
+
+
+def test_local_storage_streams_ranges(tmp_path, monkeypatch):
+    from app.services import storage_service
+
+    monkeypatch.setattr(storage_service.settings, "storage_chunk_size", 4)
+    storage = storage_service.LocalStorage(str(tmp_path / "store"))
+    source = tmp_path / "upload"
+    source.write_bytes(b"0123456789")
+
+    async def run():
+        await storage.put("ab" * 32, str(source))
+        chunks = [c async for c in storage.iter_range("ab" * 32, 2, 8)]
+        exists = await storage.exists("ab" * 32)
+        await storage.delete("ab" * 32)
+        return chunks, exists, await storage.exists("ab" * 32)
+
+    chunks, existed, exists_after = asyncio.run(run())
+    assert chunks == [b"2345", b"678"]
+    assert existed and not exists_after
+
+
+def test_preuploaded_file_is_prepared_then_attached(tmp_path, monkeypatch):
+    import hashlib
+    import io
+
+    import openpyxl
+    import pytest
+    from mongomock_motor import AsyncMongoMockClient
+
+    from app.models.schemas import FileType
+    from app.services import file_service, mongo_service, storage_service
+    from app.services.upload_service import IngestedFile
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongo_service, "_db", client["test"])
+    monkeypatch.setattr(mongo_service, "_pending_updates", {})
+    monkeypatch.setattr(mongo_service, "_pending_retries", [])
+    monkeypatch.setattr(storage_service, "_storage", storage_service.LocalStorage(str(tmp_path / "store")))
+
+    wb = openpyxl.Workbook()
+    wb.active.append(["quarterly", "revenue"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    spool = tmp_path / "upload.xlsx"
+    spool.write_bytes(buf.getvalue())
+    upload = IngestedFile(
+        filename="q.xlsx", content_type="application/vnd.ms-excel", file_type=FileType.xlsx,
+        size=len(buf.getvalue()), sha256=hashlib.sha256(buf.getvalue()).hexdigest(), path=str(spool),
+    )
+
+    async def run():
+        file_id = await file_service.accept(upload)
+        [doc] = await file_service.wait_ready([file_id], "c1")
+        with pytest.raises(file_service.FileNotUsable):
+            await file_service.wait_ready(["0" * 24], "c1")
+        attached = await mongo_service.attach_files("c1", [file_id])
+        index = await mongo_service.get_chunk_index("c1")
+        return doc, attached, index
+
+    doc, attached, index = asyncio.run(run())
+    assert doc["status"] == "ready"
+    assert attached == 1 and index[0]["filename"] == "q.xlsx"
+    assert not spool.exists()
+
+
+def test_blobs_are_shared_and_deleted_with_their_last_reference(tmp_path, monkeypatch):
+    from mongomock_motor import AsyncMongoMockClient
+
+    from app.services import mongo_service, storage_service
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongo_service, "_db", client["test"])
+    storage = storage_service.LocalStorage(str(tmp_path / "store"))
+    monkeypatch.setattr(storage_service, "_storage", storage)
+    spool = tmp_path / "upload"
+    spool.write_bytes(b"same bytes")
+    sha = "cd" * 32
+
+    async def run():
+        await mongo_service._retain_blobs({sha: (str(spool), 10, 2)})
+        await mongo_service._release_blobs({sha: 1})
+        kept = await storage.exists(sha)
+        await mongo_service._release_blobs({sha: 1})
+        blobs = mongo_service.get_db().blobs
+        gone = not await storage.exists(sha) and not await blobs.find_one({"_id": sha})
+
+        # An upload that saw the blob just before it was released stores it again
+        real_distinct, stale = type(blobs).distinct, [[sha]]
+
+        async def stale_distinct(self, *args, **kwargs):
+            return stale.pop() if stale else await real_distinct(self, *args, **kwargs)
+
+        monkeypatch.setattr(type(blobs), "distinct", stale_distinct)
+        await mongo_service._retain_blobs({sha: (str(spool), 10, 1)})
+        restored = await mongo_service.get_db().blobs.find_one({"_id": sha})
+        return kept, gone, restored, await storage.exists(sha)
+
+    kept, gone, restored, exists = asyncio.run(run())
+    assert kept and gone
+    assert restored["ref_count"] == 1 and exists
+
+
+def test_unattached_preuploads_expire(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    from bson import ObjectId
+    from mongomock_motor import AsyncMongoMockClient
+
+    from app.services import file_service, mongo_service, storage_service
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongo_service, "_db", client["test"])
+    storage = storage_service.LocalStorage(str(tmp_path / "store"))
+    monkeypatch.setattr(storage_service, "_storage", storage)
+    spool = tmp_path / "upload"
+    spool.write_bytes(b"report")
+    upload = {"filename": "r.pdf", "content_type": "application/pdf", "size": 6, "file_type": "pdf",
+              "file_path": str(spool), "sha256": "ef" * 32}
+
+    async def run():
+        [stale] = await mongo_service.store_files(None, [upload])
+        [sent] = await mongo_service.store_files(None, [upload])
+        await mongo_service.attach_files("c1", [sent])
+        await mongo_service.get_db().files.update_many(
+            {}, {"$set": {"created_at": datetime.now(timezone.utc) - timedelta(days=2)}}
+        )
+        swept = await file_service.sweep_unattached()
+        blob = await mongo_service.get_db().blobs.find_one({"_id": "ef" * 32})
+        return swept, await mongo_service.get_db().files.find_one({"_id": ObjectId(sent)}), blob
+
+    swept, sent, blob = asyncio.run(run())
+    assert swept == 1
+    assert sent["conversation_id"] == "c1"
+    assert blob["ref_count"] == 1
+
+
+def test_gridfs_blob_is_spooled_for_path_readers(tmp_path, monkeypatch):
+    import io
+    import os
+
+    from app.services import storage_service
+
+    monkeypatch.setattr(storage_service.settings, "storage_chunk_size", 4)
+    monkeypatch.setattr(storage_service.settings, "upload_spool_dir", str(tmp_path))
+
+    class Download:
+        def __init__(self):
+            self._data = io.BytesIO(b"0123456789")
+
+        async def read(self, n):
+            return self._data.read(n)
+
+    class Bucket:
+        async def open_download_stream(self, key):
+            return Download()
+
+    storage = object.__new__(storage_service.GridFSStorage)
+    storage._bucket = Bucket()
+
+    async def run():
+        async with storage.as_path("ab" * 32) as path:
+            with open(path, "rb") as f:
+                return path, f.read()
+
+    path, data = asyncio.run(run())
+    assert data == b"0123456789"
+    assert not os.path.exists(path)
@@ -0,0 +1,68 @@
+"""Tests for background generations and their resumable event logs."""
+import asyncio
+import json
+
+from app.services import generation_service
+
+
+async def _produce(generation, tokens, delay=0.01):
+    await generation.emit("start", {"message_id": generation.message_id})
+    for token in tokens:
+        if await generation.should_stop():
+            break
+        await generation.emit("token", {"token": token})
+        await asyncio.sleep(delay)
+    await generation.emit("done", {"message_id": generation.message_id})
+
+
+async def _read(message_id, last_event_id=None):
+    return [e async for e in generation_service.events(message_id, last_event_id)]
+
+
+def _tokens(events):
+    return "".join(json.loads(e["data"])["token"] for e in events if e["event"] == "token")
+
+
+def test_viewers_share_a_generation_and_resume_after_last_event():
+    async def run():
+        generation = generation_service.Generation("a" * 24)
+        generation_service.start(generation, _produce, ["Hel", "lo", " there"])
+        first, second = await asyncio.gather(_read(generation.message_id), _read(generation.message_id))
+        resumed = await _read(generation.message_id, last_event_id="2")
+        return first, second, resumed
+
+    first, second, resumed = asyncio.run(run())
+    assert first == second
+    assert [e["event"] for e in first] == ["start", "token", "token", "token", "done"]
+    assert _tokens(first) == "Hello there"
+    assert [e["id"] for e in first] == ["1", "2", "3", "4", "5"]
+    # Resuming after event 2 replays only what the client missed
+    assert _tokens(resumed) == "lo there"
+
+
+def test_cancel_stops_the_generation():
+    async def run():
+        generation = generation_service.Generation("b" * 24)
+        generation_service.start(generation, _produce, ["x"] * 100, 0.01)
+        await asyncio.sleep(0.03)
+        assert await generation_service.cancel(generation.message_id)
+        return await _read(generation.message_id)
+
+    events = asyncio.run(run())
+    assert events[-1]["event"] == "done"
+    assert 0 < len(_tokens(events)) < 100
+
+
+def test_failed_generation_ends_readers_with_an_error():
+    async def broken(generation):
+        await generation.emit("start", {})
+        raise RuntimeError("upstream exploded")
+
+    async def run():
+        generation = generation_service.Generation("c" * 24)
+        generation_service.start(generation, broken)
+        return await _read(generation.message_id)
+
+    events = asyncio.run(run())
+    assert events[-1]["event"] == "error"
+    assert "upstream exploded" in events[-1]["data"]
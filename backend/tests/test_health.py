@@ -4,13 +4,13 @@
 def test_app_import():
     from app.main import app
     assert app is not None
-    assert app.title == "Full-Stack AI Chat"
+    assert app.title == "Conversa AI"
 
 
 def test_config_import():
     from app.config import Settings
     s = Settings(openai_api_key="test")
-    assert s.app_name == "Full-Stack AI Chat"
+    assert s.app_name == "Conversa AI"
     assert s.max_file_size_mb == 10
 
 
@@ -0,0 +1,16 @@
+"""Tests for the Prometheus endpoint and request instrumentation."""
+from fastapi.testclient import TestClient
+
+
+def test_requests_are_labelled_by_route_template():
+    from app.main import app
+
+    client = TestClient(app)  # No lifespan: the handlers below don't need the databases
+    assert client.get("/").status_code == 200
+    client.get("/api/files/not-a-real-id/nothing")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert "chat_time_to_first_token_seconds" in body
+    assert 'route="/metrics"' not in body
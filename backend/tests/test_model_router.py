@@ -0,0 +1,70 @@
+"""Tests for model routing and failover, against the in-process fake provider."""
+import asyncio
+
+import pytest
+
+from app.config import ModelBackend
+
+
+@pytest.fixture
+def router(monkeypatch):
+    from app.services import model_router
+
+    monkeypatch.setattr(model_router, "_backends", None)
+    return model_router
+
+
+def _fake(name: str, tier: str = "primary", **options) -> ModelBackend:
+    return ModelBackend(name=name, model=f"{name}-model", tier=tier, provider="fake", options=options)
+
+
+def _stream(router, prompt: str):
+    async def run():
+        meta = {}
+        chunks = [c async for c in router.stream([{"role": "user", "content": prompt}], meta)]
+        text = "".join(c.choices[0].delta.content for c in chunks if c.choices)
+        return text, meta["route"]
+
+    return asyncio.run(run())
+
+
+def test_fails_over_before_first_token(router, monkeypatch):
+    monkeypatch.setattr(router.settings, "fast_route_max_prompt_tokens", 0)
+    router.configure([_fake("broken", error_rate=1.0), _fake("backup")])
+
+    text, route = _stream(router, "hello")
+    assert text == "[backup-model] hello"
+    assert route["backend"] == "backup"
+    assert route["failovers"] == ["broken"]
+
+
+def test_slow_first_token_triggers_failover(router, monkeypatch):
+    monkeypatch.setattr(router.settings, "fast_route_max_prompt_tokens", 0)
+    monkeypatch.setattr(router.settings, "router_first_token_timeout_seconds", 0.05)
+    router.configure([_fake("stalled", ttft_seconds=5.0), _fake("backup")])
+
+    _, route = _stream(router, "hello")
+    assert route["backend"] == "backup"
+    assert route["failovers"] == ["stalled"]
+
+
+def test_simple_prompts_go_to_fast_tier(router):
+    router.configure([_fake("big"), _fake("small", tier="fast")])
+
+    _, route = _stream(router, "thanks!")
+    assert (route["backend"], route["reason"]) == ("small", "simple_prompt")
+
+    long_prompt = "explain this in depth " * 400
+    _, route = _stream(router, long_prompt)
+    assert (route["backend"], route["reason"]) == ("big", "default")
+
+
+def test_unhealthy_backend_is_tried_last(router, monkeypatch):
+    monkeypatch.setattr(router.settings, "fast_route_max_prompt_tokens", 0)
+    router.configure([_fake("flaky"), _fake("steady")])
+    flaky = router.backends()[0]
+    for _ in range(5):
+        flaky.record(False)
+
+    ordered, _ = router.plan([{"role": "user", "content": "hi"}])
+    assert [b.name for b in ordered] == ["steady", "flaky"]
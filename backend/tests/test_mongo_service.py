@@ -0,0 +1,290 @@
+"""Tests for the MongoDB write path, against an in-memory mongomock database."""
+import asyncio
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    from app.services import mongo_service
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongo_service, "_client", client)
+    monkeypatch.setattr(mongo_service, "_db", client["test"])
+    monkeypatch.setattr(mongo_service, "_pending_messages", [])
+    monkeypatch.setattr(mongo_service, "_pending_updates", {})
+    monkeypatch.setattr(mongo_service, "_pending_retries", [])
+    monkeypatch.setattr(mongo_service, "_pending_usage", {})
+    return mongo_service
+
+
+def test_buffered_writes_are_visible_to_reads(mongo):
+    async def run():
+        convo = await mongo.create_conversation()
+        cid = str(convo["_id"])
+        await mongo.add_message(cid, "user", "hello")
+        await mongo.add_message(cid, "assistant", "hi there", buffered=True)
+        assert await mongo.get_db().messages.count_documents({}) == 1
+
+        convo, history = await mongo.get_conversation_with_history(cid, 10)
+        return convo, history
+
+    convo, history = asyncio.run(run())
+    assert convo["message_count"] == 2
+    assert [m["content"] for m in history] == ["hello", "hi there"]
+    assert all("content_tokens" in m for m in history)
+
+
+def test_flush_batches_counters_per_conversation(mongo):
+    async def run():
+        a = str((await mongo.create_conversation())["_id"])
+        b = str((await mongo.create_conversation())["_id"])
+        for _ in range(3):
+            await mongo.add_message(a, "assistant", "x", buffered=True)
+        await mongo.add_message(b, "assistant", "y", buffered=True)
+        assert len(mongo._pending_updates) == 2
+        await mongo.flush_writes()
+        db = mongo.get_db()
+        counts = {str(c["_id"]): c["message_count"] async for c in db.conversations.find()}
+        return counts[a], counts[b], await db.messages.count_documents({})
+
+    assert asyncio.run(run()) == (3, 1, 4)
+
+
+def test_retried_flush_does_not_double_count(mongo, monkeypatch):
+    from datetime import datetime, timezone
+
+    from pymongo.errors import AutoReconnect
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        await mongo.add_message(cid, "assistant", "x", token_count=7, buffered=True, usage={"model": "big"})
+        db = mongo.get_db()
+
+        # The server applies the counters, then the connection drops before the reply
+        real_bulk_write = type(db.conversations).bulk_write
+
+        async def applied_then_lost(self, ops, **kwargs):
+            await real_bulk_write(self, ops, **kwargs)
+            raise AutoReconnect("connection reset")
+
+        monkeypatch.setattr(type(db.conversations), "bulk_write", applied_then_lost)
+        with pytest.raises(AutoReconnect):
+            await mongo.flush_writes()
+        monkeypatch.setattr(type(db.conversations), "bulk_write", real_bulk_write)
+        assert mongo._pending_retries
+        await mongo.flush_writes()
+        await mongo.flush_writes()
+
+        convo = await db.conversations.find_one()
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return convo["message_count"], (await mongo.get_daily_usage(today))[0]
+
+    message_count, usage = asyncio.run(run())
+    assert message_count == 1
+    assert (usage["messages"], usage["total_tokens"]) == (1, 7)
+
+
+def test_message_pages_walk_both_directions(mongo):
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        for i in range(7):
+            await mongo.add_message(cid, "user", f"m{i}")
+
+        latest = await mongo.get_messages(cid, limit=3)
+        older = await mongo.get_messages(cid, limit=3, before=latest["older_cursor"])
+        oldest = await mongo.get_messages(cid, limit=3, before=older["older_cursor"])
+        newer = await mongo.get_messages(cid, limit=3, after=oldest["newer_cursor"])
+        return latest, older, oldest, newer
+
+    latest, older, oldest, newer = asyncio.run(run())
+    contents = lambda page: [m["content"] for m in page["items"]]
+    assert contents(latest) == ["m4", "m5", "m6"]
+    assert (latest["has_older"], latest["has_newer"]) == (True, False)
+    assert contents(older) == ["m1", "m2", "m3"]
+    assert contents(oldest) == ["m0"]
+    assert (oldest["has_older"], oldest["has_newer"]) == (False, True)
+    assert contents(newer) == contents(older)
+
+
+def test_conversation_pages_and_bad_cursor(mongo):
+    async def run():
+        for i in range(5):
+            await mongo.create_conversation(f"c{i}")
+        first = await mongo.list_conversations(limit=2, exact_total=True)
+        second = await mongo.list_conversations(limit=2, before=first["older_cursor"])
+        with pytest.raises(ValueError):
+            await mongo.list_conversations(before="not-a-cursor")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [c["title"] for c in first["items"]] == ["c4", "c3"]
+    assert first["total"] == 5
+    assert [c["title"] for c in second["items"]] == ["c2", "c1"]
+    assert second["has_older"] and second["has_newer"]
+
+
+def test_chat_turn_reads_from_conversation_cache(mongo, monkeypatch):
+    import fakeredis
+
+    from app.services import redis_service
+
+    monkeypatch.setattr(redis_service, "_redis", fakeredis.FakeAsyncRedis(decode_responses=True))
+    monkeypatch.setattr(redis_service, "_scripts", {})
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        await mongo.add_message(cid, "user", "hello")
+        await mongo.add_message(cid, "assistant", "hi there", buffered=True)
+
+        def no_db():
+            raise AssertionError("cache miss went to the database")
+
+        get_db = mongo.get_db
+        monkeypatch.setattr(mongo, "get_db", no_db)
+        convo, history = await mongo.get_conversation_with_history(cid, 10)
+        monkeypatch.setattr(mongo, "get_db", get_db)
+
+        await mongo.update_conversation_title(cid, "Greetings")
+        refreshed = await mongo.get_conversation(cid)
+        return convo, history, refreshed
+
+    convo, history, refreshed = asyncio.run(run())
+    assert convo["message_count"] == 2
+    assert [m["content"] for m in history] == ["hello", "hi there"]
+    assert refreshed["title"] == "Greetings"
+
+
+def test_stale_cache_refill_does_not_replace_updated_entry(mongo, monkeypatch):
+    import fakeredis
+
+    from app.services import conversation_cache, redis_service
+
+    monkeypatch.setattr(redis_service, "_redis", fakeredis.FakeAsyncRedis(decode_responses=True))
+    monkeypatch.setattr(redis_service, "_scripts", {})
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        await mongo.add_message(cid, "user", "hello")
+        # A reader that missed the cache got the database's view before the answer landed
+        stale = await mongo.get_db().conversations.find_one({"_id": ObjectId(cid)})
+        stale_messages = await mongo.get_db().messages.find({"conversation_id": cid}).to_list(None)
+        await mongo.add_message(cid, "assistant", "hi there", buffered=True)
+        await conversation_cache.put(stale, stale_messages)
+        _, cached = await conversation_cache.get(cid, 10)
+
+        await conversation_cache.invalidate(cid)
+        await conversation_cache.put(stale, stale_messages)
+        _, refilled = await conversation_cache.get(cid, 10)
+        return cached, refilled
+
+    cached, refilled = asyncio.run(run())
+    assert [m["content"] for m in cached] == ["hello", "hi there"]
+    assert [m["content"] for m in refilled] == ["hello"]
+
+
+def test_usage_rolls_up_per_conversation_and_day(mongo):
+    from datetime import datetime, timezone
+
+    def usage(model, prompt, completion, ttft, cached=False):
+        return {"model": model, "prompt_tokens": prompt, "completion_tokens": completion,
+                "ttft_ms": ttft, "generation_ms": 1000, "cached": cached}
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        await mongo.add_message(cid, "assistant", "a", token_count=30, buffered=True,
+                                usage=usage("big", 20, 10, 300))
+        await mongo.add_message(cid, "assistant", "b", token_count=50, buffered=True,
+                                usage=usage("big", 30, 20, 500))
+        await mongo.add_message(cid, "assistant", "c", buffered=True,
+                                usage=usage(None, 0, 0, 5, cached=True))
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return await mongo.get_conversation_usage(cid), await mongo.get_daily_usage(today)
+
+    per_conversation, daily = asyncio.run(run())
+    big = next(r for r in per_conversation if r["model"] == "big")
+    assert (big["messages"], big["prompt_tokens"], big["completion_tokens"], big["total_tokens"]) == (2, 50, 30, 80)
+    assert big["avg_ttft_ms"] == 400
+    assert {(r["model"], r["messages"], r["cached"]) for r in daily} == {("big", 2, 0), ("unknown", 1, 1)}
+    assert next(r for r in daily if r["model"] == "big")["avg_ttft_ms"] == 400
+
+
+@pytest.fixture
+def bucketed(mongo, monkeypatch):
+    monkeypatch.setattr(mongo.settings, "message_storage", "buckets")
+    monkeypatch.setattr(mongo.settings, "message_bucket_size", 3)
+    asyncio.run(mongo.get_db().message_buckets.create_index([("conversation_id", 1), ("seq", 1)], unique=True))
+    return mongo
+
+
+def test_bucketed_messages_read_in_few_documents(bucketed):
+    mongo = bucketed
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        ids = []
+        for i in range(7):
+            msg = await mongo.add_message(cid, "user", f"m{i}", buffered=i % 2 == 1,
+                                          usage={"model": "big"} if i == 6 else None)
+            ids.append(msg["_id"])
+        await mongo.flush_writes()
+        buckets = await mongo.get_db().message_buckets.find().sort("seq", 1).to_list(length=None)
+
+        recent = await mongo.get_recent_messages(cid, 4)
+        latest = await mongo.get_messages(cid, limit=3)
+        older = await mongo.get_messages(cid, limit=3, before=latest["older_cursor"])
+        newer = await mongo.get_messages(cid, limit=3, after=older["newer_cursor"])
+        single = await mongo.get_message(str(ids[4]))
+        usage = await mongo.get_conversation_usage(cid)
+
+        await mongo.delete_conversation(cid)
+        left = await mongo.get_db().message_buckets.count_documents({})
+        return buckets, recent, latest, older, newer, single, usage, left
+
+    buckets, recent, latest, older, newer, single, usage, left = asyncio.run(run())
+    contents = lambda msgs: [m["content"] for m in msgs]
+    assert [(b["seq"], b["count"]) for b in buckets] == [(0, 3), (1, 3), (2, 1)]
+    assert all(isinstance(b["conversation_id"], ObjectId) for b in buckets)
+    assert contents(recent) == ["m3", "m4", "m5", "m6"]
+    assert "usage" not in recent[-1]  # History reads leave large fields behind
+    assert contents(latest["items"]) == ["m4", "m5", "m6"] and latest["has_older"]
+    assert contents(older["items"]) == ["m1", "m2", "m3"]
+    assert contents(newer["items"]) == ["m4", "m5", "m6"]
+    assert single["content"] == "m4" and single["conversation_id"] == recent[0]["conversation_id"]
+    assert usage == []  # Only user messages
+    assert left == 0
+
+
+def test_migration_merges_into_buckets(mongo, monkeypatch):
+    from scripts import migrate_messages
+
+    monkeypatch.setattr(mongo.settings, "message_bucket_size", 2)
+    asyncio.run(mongo.get_db().message_buckets.create_index([("conversation_id", 1), ("seq", 1)], unique=True))
+
+    async def run():
+        cid = str((await mongo.create_conversation())["_id"])
+        for i in range(5):
+            await mongo.add_message(cid, "user", f"m{i}")
+        await mongo.get_db().messages.update_many({}, {"$unset": {"content_tokens": ""}})
+        first = await migrate_messages.migrate(size=2, concurrency=2)
+
+        # After the switch: one message only in buckets, one straggler only in messages
+        monkeypatch.setattr(mongo.settings, "message_storage", "buckets")
+        await mongo.add_message(cid, "assistant", "after switch")
+        monkeypatch.setattr(mongo.settings, "message_storage", "documents")
+        await mongo.add_message(cid, "user", "straggler")
+        again = await migrate_messages.migrate(size=2, concurrency=2)
+        dropped = await migrate_messages.migrate(size=2, concurrency=2, drop=True)
+
+        monkeypatch.setattr(mongo.settings, "message_storage", "buckets")
+        convo, history = await mongo.get_conversation_with_history(cid, 10)
+        return first, again, dropped, history, await mongo.get_db().messages.count_documents({})
+
+    first, again, dropped, history, remaining = asyncio.run(run())
+    assert (first["messages"], first["buckets"]) == (5, 3)
+    assert again["messages"] == 1  # Only the straggler; nothing already bucketed is rewritten
+    assert dropped["dropped"] == 6 and remaining == 0
+    assert [m["content"] for m in history] == ["m0", "m1", "m2", "m3", "m4", "after switch", "straggler"]
+    assert all(m["content_tokens"] > 0 for m in history)
@@ -0,0 +1,83 @@
+"""Tests for rate limiting and daily token budgets, with and without Redis."""
+import asyncio
+
+
+def test_local_rate_limit_caps_burst(monkeypatch):
+    from app.services import redis_service
+
+    monkeypatch.setattr(redis_service, "_redis", None)
+    monkeypatch.setattr(redis_service.settings, "rate_limit_per_minute", 3)
+    monkeypatch.setattr(redis_service, "_local_buckets", type(redis_service._local_buckets)())
+
+    async def run():
+        return [await redis_service.check_rate_limit("10.0.0.1") for _ in range(4)]
+
+    assert asyncio.run(run()) == [True, True, True, False]
+    # Other clients have their own bucket
+    assert asyncio.run(redis_service.check_rate_limit("10.0.0.2")) is True
+
+
+def test_token_budget_debited_from_usage(monkeypatch):
+    from app.services import redis_service
+
+    monkeypatch.setattr(redis_service, "_redis", None)
+    monkeypatch.setattr(redis_service.settings, "daily_token_budget", 1000)
+    monkeypatch.setattr(redis_service, "_local_usage", {})
+
+    async def run():
+        before = await redis_service.check_token_budget("client")
+        await redis_service.record_token_usage("client", 600)
+        middle = await redis_service.check_token_budget("client")
+        await redis_service.record_token_usage("client", 400)
+        after = await redis_service.check_token_budget("client")
+        return before, middle, after
+
+    assert asyncio.run(run()) == (True, True, False)
+
+
+def test_sliding_window_script_allows_denies_and_expires(monkeypatch):
+    import fakeredis
+
+    from app.services import redis_service
+
+    fake = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis_service, "_redis", fake)
+    monkeypatch.setattr(redis_service, "_scripts", {})
+
+    async def hit(now_ms, request_id):
+        return await redis_service.run_script(
+            redis_service._SLIDING_WINDOW_LUA,
+            keys=["rate:10.0.0.1"],
+            args=[now_ms, 60_000, 2, f"{now_ms}-{request_id}"],
+        )
+
+    async def run():
+        results = [await hit(1_000, "a"), await hit(2_000, "b"), await hit(3_000, "c")]
+        # The first request leaves the window at 61s, freeing one slot but not two
+        results += [await hit(61_500, "d"), await hit(61_600, "e")]
+        ttl = await fake.pttl("rate:10.0.0.1")
+        return results, ttl
+
+    results, ttl = asyncio.run(run())
+    assert results == [1, 1, 0, 1, 0]
+    assert 0 < ttl <= 60_000
+
+
+def test_rate_limit_uses_redis_window(monkeypatch):
+    import fakeredis
+
+    from app.services import redis_service
+
+    fake = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis_service, "_redis", fake)
+    monkeypatch.setattr(redis_service, "_rate_limit_script", fake.register_script(redis_service._SLIDING_WINDOW_LUA))
+    monkeypatch.setattr(redis_service.settings, "rate_limit_per_minute", 2)
+    clock = [1_000.0]
+    monkeypatch.setattr(redis_service.time, "time", lambda: clock[0])
+
+    async def run():
+        allowed = [await redis_service.check_rate_limit("10.0.0.3") for _ in range(3)]
+        clock[0] += 61
+        return allowed, await redis_service.check_rate_limit("10.0.0.3")
+
+    assert asyncio.run(run()) == ([True, True, False], True)
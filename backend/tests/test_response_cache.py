@@ -0,0 +1,78 @@
+"""Tests for the response cache."""
+import asyncio
+
+
+def test_cache_key_normalizes_whitespace():
+    from app.services.response_cache import cache_key
+
+    a = cache_key("gpt-4o", [{"role": "user", "content": "What is  GDP?\n"}])
+    b = cache_key("gpt-4o", [{"role": "user", "content": "What is GDP?"}])
+    c = cache_key("gpt-4o-mini", [{"role": "user", "content": "What is GDP?"}])
+    assert a == b
+    assert a != c
+
+
+def test_chat_stream_replays_cached_answer(monkeypatch):
+    from app.services import cache_service, openai_service, upstream
+
+    cache_service._local.clear()
+    calls = []
+
+    class FakeStream:
+        def __init__(self, pieces):
+            self.pieces = pieces
+
+        def __aiter__(self):
+            return self._gen()
+
+        async def close(self):
+            pass
+
+        async def _gen(self):
+            for p in self.pieces:
+                delta = type("Delta", (), {"content": p})
+                yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})], "usage": None})
+
+    async def fake_create(**kwargs):
+        calls.append(kwargs)
+        return FakeStream(["Hello", " there", ", friend."])
+
+    monkeypatch.setattr(upstream.client.chat.completions, "create", fake_create)
+
+    async def run(use_cache=True):
+        meta = {}
+        tokens = [t async for t in openai_service.chat_stream([], "hi", use_cache=use_cache, meta=meta)]
+        return "".join(tokens), meta["cached"]
+
+    assert asyncio.run(run()) == ("Hello there, friend.", False)
+    assert asyncio.run(run()) == ("Hello there, friend.", True)
+    assert asyncio.run(run(use_cache=False)) == ("Hello there, friend.", False)
+    assert len(calls) == 2
+
+
+def test_cached_answers_are_scoped_to_the_routed_models(monkeypatch):
+    from app.config import ModelBackend
+    from app.services import cache_service, model_router, openai_service
+
+    cache_service._local.clear()
+    monkeypatch.setattr(model_router, "_backends", None)
+
+    def configure(fast_model: str):
+        model_router.configure([
+            ModelBackend(name="big", model="big-model", provider="fake"),
+            ModelBackend(name="small", model=fast_model, tier="fast", provider="fake"),
+        ])
+
+    async def run(prompt: str):
+        meta = {}
+        text = "".join([t async for t in openai_service.chat_stream([], prompt, meta=meta)])
+        return text, meta["cached"]
+
+    configure("small-model")
+    assert model_router.cache_scope([{"role": "user", "content": "hi"}]) == ("fast", ["small-model"])
+    assert asyncio.run(run("hi")) == ("[small-model] hi", False)
+    assert asyncio.run(run("hi")) == ("[small-model] hi", True)
+
+    # Another fast model must not replay the old model's answer
+    configure("other-model")
+    assert asyncio.run(run("hi")) == ("[other-model] hi", False)
@@ -0,0 +1,76 @@
+"""Tests for document chunking and BM25 retrieval."""
+import asyncio
+
+
+def test_build_chunks_respects_size_and_overlap(monkeypatch):
+    from app.services import retrieval_service, token_counter
+
+    monkeypatch.setattr(token_counter.settings, "tokenizer", "approx")
+    token_counter._encoding.cache_clear()
+    text = "\n\n".join(" ".join(f"w{p}x{i}" for i in range(30)) for p in range(10))
+
+    chunks = retrieval_service.build_chunks(text, chunk_tokens=50, overlap_tokens=10)
+    assert len(chunks) > 1
+    assert all(c["tokens"] <= 52 for c in chunks)
+    # Consecutive chunks share their boundary words
+    assert chunks[0]["text"].split()[-1] in chunks[1]["text"]
+    assert chunks[0]["terms"]["w0x0"] == 1
+
+
+def test_select_context_ranks_relevant_chunks(monkeypatch):
+    from app.services import retrieval_service
+
+    def chunk(i, file_id, text):
+        terms = retrieval_service.tokenize(text)
+        return {
+            "_id": i, "file_id": file_id, "filename": f"{file_id}.pdf", "index": i,
+            "tokens": 100, "length": len(terms), "terms": {t: terms.count(t) for t in terms},
+        }
+
+    chunks = [
+        chunk(0, "report", "quarterly revenue grew in APAC"),
+        chunk(1, "report", "headcount and hiring plans"),
+        chunk(2, "report", "office relocation timeline"),
+        chunk(3, "notes", "revenue targets for next year"),
+    ]
+    texts = {c["_id"]: f"text {c['_id']}" for c in chunks}
+
+    async def get_chunk_index(conversation_id):
+        return chunks
+
+    async def get_chunk_texts(ids):
+        return {i: texts[i] for i in ids}
+
+    monkeypatch.setattr(retrieval_service.mongo_service, "get_chunk_index", get_chunk_index)
+    monkeypatch.setattr(retrieval_service.mongo_service, "get_chunk_texts", get_chunk_texts)
+    monkeypatch.setattr(retrieval_service.settings, "max_document_tokens", 250)
+
+    context = asyncio.run(retrieval_service.select_context("c1", "How did revenue do?", ["report"]))
+    assert context == [("notes.pdf", "text 3"), ("report.pdf", "text 0")]
+
+    context = asyncio.run(retrieval_service.select_context("c1", "summarize this", ["report"]))
+    assert context == [("report.pdf", "text 0\ntext 1")]
+
+
+def test_follow_up_without_match_falls_back_to_latest_document(monkeypatch):
+    from app.services import retrieval_service
+
+    def chunk(i, file_id, index):
+        return {"_id": i, "file_id": file_id, "filename": f"{file_id}.pdf", "index": index,
+                "tokens": 100, "length": 1, "terms": {f"term{i}": 1}}
+
+    older, latest = "65a000000000000000000001", "65a000000000000000000002"
+    chunks = [chunk(0, older, 0), chunk(1, older, 1)] + [chunk(2 + i, latest, i) for i in range(5)]
+
+    async def get_chunk_index(conversation_id):
+        return chunks
+
+    async def get_chunk_texts(ids):
+        return {i: f"text {i}" for i in ids}
+
+    monkeypatch.setattr(retrieval_service.mongo_service, "get_chunk_index", get_chunk_index)
+    monkeypatch.setattr(retrieval_service.mongo_service, "get_chunk_texts", get_chunk_texts)
+    monkeypatch.setattr(retrieval_service.settings, "max_document_tokens", 250)
+
+    context = asyncio.run(retrieval_service.select_context("c1", "summarize it", []))
+    assert context == [(f"{latest}.pdf", "text 2\ntext 3")]
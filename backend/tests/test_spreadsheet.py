@@ -0,0 +1,64 @@
+"""Tests for spreadsheet summaries and row lookups."""
+import io
+
+import openpyxl
+import pytest
+
+from app.models.schemas import FileType
+from app.services import file_processor, spreadsheet
+
+
+def _orders_xlsx(rows: int) -> bytes:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Orders"
+    ws.append(["id", "region", "amount"])
+    for i in range(rows):
+        ws.append([i + 1, ["north", "south", "east"][i % 3], i * 10.0])
+    wb.create_sheet("Notes").append(["text"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def test_summary_has_schema_stats_and_bounded_samples():
+    text = spreadsheet.summarize(_orders_xlsx(1000), FileType.xlsx, 50_000, 10, 8000)
+    assert "Sheet: Orders (1000 rows x 3 columns)" in text
+    assert "- amount: number, min 0, max 9990, mean 4995" in text
+    assert "- region: text, 3 distinct" in text
+    assert "Sample rows (10 of 1000" in text
+    assert "Sheet: Notes (0 rows" in text
+
+    short = spreadsheet.summarize(_orders_xlsx(1000), FileType.xlsx, 50_000, 500, 2000)
+    assert len(short.split("\n\nSheet: Notes")[0]) <= 2000 + len("\n[Truncated]")
+    assert "[Truncated]" in short
+
+
+def test_csv_is_detected_sniffed_and_summarized():
+    data = b"city;population\nParis;2100000\nLyon;520000\n"
+    assert file_processor.detect_file_type("cities.csv", "text/csv") == FileType.csv
+    assert file_processor.sniff_matches(FileType.csv, data)
+    assert not file_processor.sniff_matches(FileType.csv, b"%PDF-1.7")
+
+    text = file_processor.extract_text(data, FileType.csv)
+    assert "Sheet: csv (2 rows x 2 columns)" in text
+    assert "population: number, min 520000, max 2100000" in text
+
+
+def test_lookup_filters_rows():
+    result = spreadsheet.lookup(
+        _orders_xlsx(30),
+        FileType.xlsx,
+        "Orders",
+        [{"column": "region", "op": "eq", "value": "south"}, {"column": "amount", "op": "gte", "value": "100"}],
+        ["id", "amount"],
+        3,
+        50_000,
+    )
+    assert result["matched"] == 7
+    assert result["columns"] == ["id", "amount"]
+    assert result["rows"] == [[11, 100.0], [14, 130.0], [17, 160.0]]
+    assert result["row_numbers"] == [11, 14, 17]
+
+    with pytest.raises(ValueError, match="Unknown column"):
+        spreadsheet.lookup(_orders_xlsx(3), FileType.xlsx, None, [{"column": "x", "op": "eq", "value": 1}], None, 5, 100)
@@ -0,0 +1,55 @@
+"""Tests for SSE token coalescing."""
+import asyncio
+
+
+def test_tokens_are_coalesced_into_frames():
+    from app.services import sse
+
+    async def tokens():
+        for t in ["Hel", "lo", ", ", "wor", "ld"]:
+            yield t
+        await asyncio.sleep(0.1)
+        yield "!"
+
+    async def run():
+        return [f async for f in sse.coalesce(tokens(), 0.03, 1024, 64)]
+
+    # First token at once, the burst as one frame, the late token on its own
+    assert asyncio.run(run()) == ["Hel", "lo, world", "!"]
+
+
+def test_byte_budget_flushes_early():
+    from app.services import sse
+
+    async def tokens():
+        for _ in range(7):
+            yield "abcd"
+
+    async def run():
+        return [f async for f in sse.coalesce(tokens(), 10.0, 8, 64)]
+
+    assert asyncio.run(run()) == ["abcd", "abcdabcd", "abcdabcd", "abcdabcd"]
+
+
+def test_closing_the_frames_cancels_the_source():
+    from app.services import sse
+
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            while True:
+                yield "token "
+                await asyncio.sleep(0.005)
+        finally:
+            closed.set()
+
+    async def run():
+        frames = sse.coalesce(endless(), 0.02, 1024, 4)
+        async for _ in frames:
+            break
+        await frames.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        return closed.is_set()
+
+    assert asyncio.run(run())
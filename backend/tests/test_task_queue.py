@@ -0,0 +1,38 @@
+"""Tests for the background task queue."""
+import asyncio
+
+import pytest
+
+
+def test_submit_retries_then_succeeds(monkeypatch):
+    from app.services import task_queue
+
+    monkeypatch.setattr(task_queue.settings, "background_task_retry_base_seconds", 0)
+    attempts = []
+
+    async def flaky(value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise RuntimeError("upstream hiccup")
+        return value * 2
+
+    async def run():
+        return await task_queue.submit(flaky, 21, retries=2)
+
+    assert asyncio.run(run()) == 42
+    assert attempts == [21, 21, 21]
+
+
+def test_submit_gives_up_after_retries(monkeypatch):
+    from app.services import task_queue
+
+    monkeypatch.setattr(task_queue.settings, "background_task_retry_base_seconds", 0)
+
+    async def broken():
+        raise RuntimeError("down")
+
+    async def run():
+        return await task_queue.submit(broken, retries=1)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
@@ -0,0 +1,67 @@
+"""Tests for streaming upload ingestion."""
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, Request, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+
+def _upload(data: bytes, filename: str, content_type: str) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+
+
+def test_ingest_hashes_and_spools(monkeypatch):
+    from app.services import upload_service
+
+    monkeypatch.setattr(upload_service.settings, "upload_chunk_size", 8)
+    data = b"%PDF-1.4\n" + b"x" * 100
+    ingested = asyncio.run(upload_service.ingest(_upload(data, "doc.pdf", "application/pdf")))
+    try:
+        assert ingested.size == len(data)
+        assert ingested.sha256 == hashlib.sha256(data).hexdigest()
+        with open(ingested.path, "rb") as f:
+            assert f.read() == data
+    finally:
+        ingested.cleanup()
+
+
+def test_ingest_rejects_oversized_and_mismatched(monkeypatch):
+    from app.services import upload_service
+
+    monkeypatch.setattr(upload_service.settings, "max_file_size_mb", 1)
+    big = b"\x89PNG\r\n\x1a\n" + b"0" * (1024 * 1024)
+    with pytest.raises(upload_service.UploadRejected) as exc:
+        asyncio.run(upload_service.ingest(_upload(big, "big.png", "image/png")))
+    assert exc.value.status_code == 413
+
+    with pytest.raises(upload_service.UploadRejected) as exc:
+        asyncio.run(upload_service.ingest(_upload(b"not a pdf", "fake.pdf", "application/pdf")))
+    assert exc.value.status_code == 415
+
+    with pytest.raises(upload_service.UploadRejected) as exc:
+        asyncio.run(upload_service.ingest(_upload(b"MZ", "tool.exe", "application/octet-stream")))
+    assert exc.value.status_code == 415
+
+
+def test_body_size_limit_middleware():
+    from app.middleware import BodySizeLimitMiddleware
+
+    app = FastAPI()
+    app.add_middleware(BodySizeLimitMiddleware, max_bytes=100)
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    client = TestClient(app)
+    assert client.post("/echo", content=b"x" * 50).json() == {"size": 50}
+    assert client.post("/echo", content=b"x" * 500).status_code == 413
+
+    def chunks():
+        yield b"x" * 80
+        yield b"x" * 80
+
+    assert client.post("/echo", content=chunks()).status_code == 413
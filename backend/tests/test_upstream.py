@@ -0,0 +1,61 @@
+"""Tests for the upstream OpenAI client's retries and hedging."""
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+
+def _status_error(status: int, headers: dict | None = None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    cls = openai.RateLimitError if status == 429 else openai.APIStatusError
+    return cls("upstream error", response=response, body=None)
+
+
+def test_retries_rate_limits_after_retry_after(monkeypatch):
+    from app.services import upstream
+
+    calls = []
+
+    async def fake_create(**kwargs):
+        calls.append(asyncio.get_running_loop().time())
+        if len(calls) == 1:
+            raise _status_error(429, {"retry-after-ms": "50"})
+        return "ok"
+
+    monkeypatch.setattr(upstream.client.chat.completions, "create", fake_create)
+    assert asyncio.run(upstream.complete(model="m", messages=[])) == "ok"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.05
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    from app.services import upstream
+
+    calls = []
+
+    async def fake_create(**kwargs):
+        calls.append(kwargs)
+        raise _status_error(400)
+
+    monkeypatch.setattr(upstream.client.chat.completions, "create", fake_create)
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(upstream.complete(model="m", messages=[]))
+    assert len(calls) == 1
+
+
+def test_hedged_call_returns_the_faster_backup(monkeypatch):
+    from app.services import upstream
+
+    delays = [1.0, 0.0]  # The first request stalls, the backup answers at once
+
+    async def fake_create(**kwargs):
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return f"answered after {delay}s"
+
+    monkeypatch.setattr(upstream.client.chat.completions, "create", fake_create)
+    result = asyncio.run(upstream.hedged(0.05, model="m", messages=[]))
+    assert result == "answered after 0.0s"
+    assert upstream.stats()["hedge_wins"] >= 1
@@ -41,8 +41,8 @@ export default function Home() {
     }
     (async () => {
       try {
-        const msgs = await getMessages(activeConversationId);
-        setMessages(msgs);
+        const page = await getMessages(activeConversationId);
+        setMessages(page.messages);
       } catch (err) {
         console.error("Failed to load messages:", err);
       }
@@ -95,7 +95,9 @@ export default function Home() {
             ? "pdf"
             : f.name.endsWith(".docx")
               ? "docx"
-              : "xlsx",
+              : f.name.endsWith(".csv")
+                ? "csv"
+                : "xlsx",
       })),
       token_count: 0,
       created_at: new Date().toISOString(),
@@ -119,8 +121,8 @@ export default function Home() {
           setIsStreaming(false);
           setStreamingContent("");
           // Reload messages and conversations
-          const msgs = await getMessages(conversationId);
-          setMessages(msgs);
+          const page = await getMessages(conversationId);
+          setMessages(page.messages);
           await loadConversations();
         },
         // onError
@@ -142,6 +144,10 @@ export default function Home() {
             },
           ]);
         },
+        // onTitle: generated in the background, arrives mid-stream
+        () => {
+          loadConversations();
+        },
       );
     } catch (err) {
       setIsStreaming(false);
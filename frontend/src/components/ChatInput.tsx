@@ -2,6 +2,7 @@
 
 import { useState, useRef, useEffect } from "react";
 import FileUpload from "./FileUpload";
+import { preuploadFile } from "@/lib/api";
 import { SendHorizontal, Loader2 } from "lucide-react";
 
 interface ChatInputProps {
@@ -32,6 +33,11 @@ export default function ChatInput({ onSend, disabled = false }: ChatInputProps)
     setFiles([]);
   };
 
+  const handleFilesChange = (next: File[]) => {
+    next.forEach(preuploadFile);
+    setFiles(next);
+  };
+
   const handleKeyDown = (e: React.KeyboardEvent) => {
     if (e.key === "Enter" && !e.shiftKey) {
       e.preventDefault();
@@ -43,7 +49,7 @@ export default function ChatInput({ onSend, disabled = false }: ChatInputProps)
     <div className="border-t border-chat-border bg-chat-bg px-4 py-3">
       <div className="max-w-3xl mx-auto">
         <div className="flex items-end gap-2 bg-chat-input rounded-xl border border-chat-border px-3 py-2">
-          <FileUpload files={files} onFilesChange={setFiles} />
+          <FileUpload files={files} onFilesChange={handleFilesChange} />
 
           <textarea
             ref={textareaRef}
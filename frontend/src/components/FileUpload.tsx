@@ -59,6 +59,7 @@ export default function FileUpload({ files, onFilesChange }: FileUploadProps) {
     if (ext === "pdf") return "pdf";
     if (ext === "docx") return "docx";
     if (ext === "xlsx") return "xlsx";
+    if (ext === "csv") return "csv";
     return "image";
   };
 
@@ -91,7 +92,7 @@ export default function FileUpload({ files, onFilesChange }: FileUploadProps) {
         ref={inputRef}
         type="file"
         multiple
-        accept=".pdf,.docx,.xlsx,.png,.jpg,.jpeg,.webp"
+        accept=".pdf,.docx,.xlsx,.csv,.png,.jpg,.jpeg,.webp"
         className="hidden"
         onChange={(e) => handleFiles(e.target.files)}
       />
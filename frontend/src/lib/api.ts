@@ -1,4 +1,4 @@
-import { Conversation, ConversationList, Message } from "@/types";
+import { Conversation, ConversationList, MessageList, PageOptions, UploadedFile } from "@/types";
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "";
 
@@ -13,16 +13,28 @@ async function apiFetch<T>(path: string, init?: RequestInit): Promise<T> {
 
 // --- Conversations ---
 
-export async function listConversations(): Promise<ConversationList> {
-  return apiFetch("/api/conversations");
+function pageQuery(options: PageOptions): string {
+  const params = new URLSearchParams();
+  if (options.limit) params.set("limit", String(options.limit));
+  if (options.before) params.set("before", options.before);
+  if (options.after) params.set("after", options.after);
+  const query = params.toString();
+  return query ? `?${query}` : "";
+}
+
+export async function listConversations(options: PageOptions = {}): Promise<ConversationList> {
+  return apiFetch(`/api/conversations${pageQuery(options)}`);
 }
 
 export async function getConversation(id: string): Promise<Conversation> {
   return apiFetch(`/api/conversations/${id}`);
 }
 
-export async function getMessages(conversationId: string): Promise<Message[]> {
-  return apiFetch(`/api/conversations/${conversationId}/messages`);
+export async function getMessages(
+  conversationId: string,
+  options: PageOptions = {}
+): Promise<MessageList> {
+  return apiFetch(`/api/conversations/${conversationId}/messages${pageQuery(options)}`);
 }
 
 export async function deleteConversation(id: string): Promise<void> {
@@ -38,14 +50,22 @@ export async function sendMessageStream(
   onToken: (token: string) => void,
   onDone: (conversationId: string) => void,
   onError: (error: string) => void,
+  onTitle?: (title: string) => void,
 ): Promise<void> {
   const formData = new FormData();
   formData.append("message", message);
   if (conversationId) {
     formData.append("conversation_id", conversationId);
   }
+  // Files picked earlier were uploaded (and processed) in the background; send
+  // their ids, and fall back to an inline upload for any that failed
   for (const file of files) {
-    formData.append("files", file);
+    const fileId = await preuploads.get(file)?.catch(() => null);
+    if (fileId) {
+      formData.append("file_ids", fileId);
+    } else {
+      formData.append("files", file);
+    }
   }
 
   const res = await fetch(`${API_URL}/api/chat/send`, {
@@ -59,16 +79,95 @@ export async function sendMessageStream(
     return;
   }
 
-  const reader = res.body?.getReader();
-  if (!reader) {
-    onError("No response stream");
-    return;
+  // The answer is generated server-side regardless of this connection, so if it
+  // drops mid-answer we reconnect and continue after the last event we saw
+  const state: StreamState = { messageId: null, lastEventId: null, finished: false };
+  const handlers: StreamHandlers = { onToken, onDone, onError, onTitle };
+  let body = res.body;
+  for (let attempt = 0; ; attempt++) {
+    if (body) {
+      try {
+        await readEvents(body, state, handlers);
+      } catch {
+        // connection dropped; resume below
+      }
+    }
+    if (state.finished) return;
+    if (!state.messageId || attempt >= MAX_RESUME_ATTEMPTS) {
+      onError("Connection lost");
+      return;
+    }
+    await new Promise((resolve) => setTimeout(resolve, 500 * (attempt + 1)));
+    const headers: Record<string, string> = {};
+    if (state.lastEventId) headers["Last-Event-ID"] = state.lastEventId;
+    const resumed = await fetch(`${API_URL}/api/chat/stream/${state.messageId}`, { headers }).catch(
+      () => null
+    );
+    if (resumed && !resumed.ok) {
+      onError("Generation not found");
+      return;
+    }
+    body = resumed ? resumed.body : null;
   }
+}
+
+const MAX_RESUME_ATTEMPTS = 3;
+
+interface StreamState {
+  messageId: string | null;
+  lastEventId: string | null;
+  finished: boolean;
+}
+
+interface StreamHandlers {
+  onToken: (token: string) => void;
+  onDone: (conversationId: string) => void;
+  onError: (error: string) => void;
+  onTitle?: (title: string) => void;
+}
+
+export function cancelGeneration(messageId: string): Promise<unknown> {
+  return apiFetch(`/api/chat/stream/${messageId}/cancel`, { method: "POST" });
+}
 
+async function readEvents(
+  body: ReadableStream<Uint8Array>,
+  state: StreamState,
+  handlers: StreamHandlers,
+): Promise<void> {
+  const reader = body.getReader();
   const decoder = new TextDecoder();
   let buffer = "";
+  let event = "message";
+  let id: string | null = null;
+  let data = "";
+
+  const dispatch = () => {
+    if (id) state.lastEventId = id;
+    try {
+      const parsed = data ? JSON.parse(data) : {};
+      if (event === "start") {
+        state.messageId = parsed.message_id;
+      } else if (event === "token") {
+        handlers.onToken(parsed.token);
+      } else if (event === "title") {
+        handlers.onTitle?.(parsed.title);
+      } else if (event === "done") {
+        state.finished = true;
+        handlers.onDone(parsed.conversation_id);
+      } else if (event === "error") {
+        state.finished = true;
+        handlers.onError(parsed.error);
+      }
+    } catch {
+      // skip unparseable events
+    }
+    event = "message";
+    id = null;
+    data = "";
+  };
 
-  while (true) {
+  while (!state.finished) {
     const { done, value } = await reader.read();
     if (done) break;
 
@@ -76,28 +175,41 @@ export async function sendMessageStream(
     const lines = buffer.split("\n");
     buffer = lines.pop() || "";
 
-    for (const line of lines) {
-      if (line.startsWith("data: ")) {
-        const data = line.slice(6);
-        try {
-          const parsed = JSON.parse(data);
-          if (parsed.token) {
-            onToken(parsed.token);
-          } else if (parsed.conversation_id) {
-            onDone(parsed.conversation_id);
-          } else if (parsed.error) {
-            onError(parsed.error);
-          }
-        } catch {
-          // skip unparseable lines
-        }
+    for (let line of lines) {
+      line = line.replace(/\r$/, "");
+      if (line === "") {
+        if (data) dispatch();
+      } else if (line.startsWith("event: ")) {
+        event = line.slice(7);
+      } else if (line.startsWith("id: ")) {
+        id = line.slice(4);
+      } else if (line.startsWith("data: ")) {
+        data += line.slice(6);
       }
     }
   }
+  reader.cancel().catch(() => {});
 }
 
 // --- Files ---
 
+const preuploads = new WeakMap<File, Promise<string>>();
+
+export async function uploadFile(file: File): Promise<UploadedFile> {
+  const formData = new FormData();
+  formData.append("file", file);
+  return apiFetch("/api/files", { method: "POST", body: formData });
+}
+
+/** Start uploading a file as soon as it is picked, so sending doesn't wait for it. */
+export function preuploadFile(file: File): void {
+  if (!preuploads.has(file)) {
+    const upload = uploadFile(file).then((uploaded) => uploaded.file_id);
+    upload.catch(() => {}); // Failures fall back to an inline upload on send
+    preuploads.set(file, upload);
+  }
+}
+
 export function getFileDownloadUrl(fileId: string): string {
   return `${API_URL}/api/files/${fileId}/download`;
 }
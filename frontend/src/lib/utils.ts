@@ -28,6 +28,7 @@ export function getFileIcon(fileType: string): string {
     case "docx":
       return "📝";
     case "xlsx":
+    case "csv":
       return "📊";
     case "image":
       return "🖼️";
@@ -2,10 +2,29 @@ export interface FileMetadata {
   filename: string;
   content_type: string;
   size: number;
-  file_type: "pdf" | "docx" | "xlsx" | "image";
+  file_type: "pdf" | "docx" | "xlsx" | "csv" | "image";
   file_id?: string;
 }
 
+export interface UploadedFile {
+  file_id: string;
+  filename: string;
+  content_type: string;
+  size: number;
+  file_type: FileMetadata["file_type"];
+  status: "processing" | "ready" | "failed";
+}
+
+export interface MessageUsage {
+  model: string | null;
+  prompt_tokens: number;
+  completion_tokens: number;
+  ttft_ms: number | null;
+  generation_ms: number | null;
+  cached: boolean;
+  error: boolean;
+}
+
 export interface Message {
   id: string;
   conversation_id: string;
@@ -13,6 +32,7 @@ export interface Message {
   content: string;
   files: FileMetadata[];
   token_count: number;
+  usage?: MessageUsage | null;
   created_at: string;
 }
 
@@ -24,7 +44,25 @@ export interface Conversation {
   updated_at: string;
 }
 
-export interface ConversationList {
+export interface PageCursors {
+  older_cursor: string | null;
+  newer_cursor: string | null;
+  has_older: boolean;
+  has_newer: boolean;
+}
+
+export interface ConversationList extends PageCursors {
   conversations: Conversation[];
   total: number;
 }
+
+export interface MessageList extends PageCursors {
+  messages: Message[];
+  total: number;
+}
+
+export interface PageOptions {
+  limit?: number;
+  before?: string;
+  after?: string;
+}